@@ -2,7 +2,7 @@
 import os
 from collections import Counter, defaultdict
 from config import MAIN_INBOX, IMPORTANT_DIR
-from utils import parse_email
+from mail_index import scan_maildir
 from gpt_api import ask_gpt
 
 def batch_cleanup_analysis():
@@ -18,10 +18,7 @@ def batch_cleanup_analysis():
     for mailbox_name, mailbox_path in mailboxes:
         if not os.path.exists(mailbox_path):
             continue
-        email_files = [f for f in os.listdir(mailbox_path) if os.path.isfile(os.path.join(mailbox_path, f))]
-        for email_file in email_files:
-            file_path = os.path.join(mailbox_path, email_file)
-            subject, sender, _, date_str, _ = parse_email(file_path)
+        for email_file, subject, sender, date_str, _ in scan_maildir(mailbox_path):
             sender_counts[sender] += 1
             sender_emails[sender].append({
                 'filename': email_file,
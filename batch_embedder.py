@@ -0,0 +1,154 @@
+"""Batched requests to OpenAI-compatible ``/v1/embeddings`` endpoints.
+
+The embedding helpers used to send one text per HTTP call, although the
+endpoint accepts a list under ``input``. ``BatchEmbedder`` takes
+``(key, text)`` pairs as they are produced. It groups them into batches of
+up to ``EMBED_BATCH_SIZE`` texts and ``EMBED_BATCH_MAX_CHARS`` characters,
+sends each batch as one request, and yields ``(key, vector)`` pairs in input
+order, so callers can match every vector to its email.
+
+If a batch request fails, its texts are retried one at a time. A text that
+still cannot be embedded yields ``None``, and the rest of the batch is kept.
+
+When the embedder is given its ``model`` name, vectors are read from and
+written to the persistent ``embedding_cache``, and only uncached texts are
+sent. Setting ``USE_EMBED_CACHE=false`` turns this off.
+"""
+
+import time
+import logging
+
+import http_session
+from config import EMBED_BATCH_SIZE, EMBED_BATCH_MAX_CHARS, USE_EMBED_CACHE
+from embedding_cache import embedding_cache
+
+
+class EmbeddingError(Exception):
+    """Raised when an embeddings response does not match its request."""
+
+
+def post_embeddings(url, model, texts, headers=None, read_timeout=60):
+    """POST ``texts`` to the embeddings endpoint ``url``.
+
+    Returns one vector per text, in input order.
+    """
+    response = http_session.post(
+        url,
+        json={"model": model, "input": list(texts)},
+        headers=headers,
+        read_timeout=read_timeout,
+    )
+    response.raise_for_status()
+    data = sorted(response.json()["data"], key=lambda d: d.get("index", 0))
+    if len(data) != len(texts):
+        raise EmbeddingError(f"sent {len(texts)} texts, got {len(data)} embeddings")
+    return [d["embedding"] for d in data]
+
+
+def client_embedder(client, model):
+    """Return an ``embed_many`` callable backed by an ``openai.OpenAI`` client."""
+
+    def embed_many(texts):
+        response = client.embeddings.create(model=model, input=list(texts))
+        data = sorted(response.data, key=lambda d: d.index)
+        if len(data) != len(texts):
+            raise EmbeddingError(f"sent {len(texts)} texts, got {len(data)} embeddings")
+        return [d.embedding for d in data]
+
+    return embed_many
+
+
+class BatchEmbedder:
+    """Accumulates texts and embeds them with one request per batch.
+
+    ``embed_many`` takes a list of texts and returns their vectors in the same
+    order. ``post_embeddings`` and ``client_embedder`` build such callables.
+    ``model`` names the embedding model for cache keys; without it nothing
+    is cached.
+    """
+
+    def __init__(
+        self,
+        embed_many,
+        batch_size=EMBED_BATCH_SIZE,
+        max_chars=EMBED_BATCH_MAX_CHARS,
+        model=None,
+        cache=None,
+    ):
+        self.embed_many = embed_many
+        self.model = model
+        if cache is None and model and USE_EMBED_CACHE:
+            cache = embedding_cache
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.max_chars = max_chars
+        self.requests = 0
+        self.texts = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    def _batches(self, items):
+        batch, chars = [], 0
+        for key, text in items:
+            if batch and (
+                len(batch) >= self.batch_size or chars + len(text) > self.max_chars
+            ):
+                yield batch
+                batch, chars = [], 0
+            batch.append((key, text))
+            chars += len(text)
+        if batch:
+            yield batch
+
+    def _call(self, texts):
+        start = time.perf_counter()
+        try:
+            return self.embed_many(texts)
+        finally:
+            self.requests += 1
+            self.seconds += time.perf_counter() - start
+
+    def _embed_batch(self, texts):
+        try:
+            return self._call(texts)
+        except Exception as e:
+            logging.warning(f"Embedding batch of {len(texts)} failed: {e}")
+            if len(texts) == 1:
+                self.failures += 1
+                return [None]
+        vectors = []
+        for text in texts:
+            try:
+                vectors.extend(self._call([text]))
+            except Exception as e:
+                logging.error(f"Embedding failed: {e}")
+                self.failures += 1
+                vectors.append(None)
+        return vectors
+
+    def embed(self, items):
+        """Yield ``(key, vector)`` for each ``(key, text)`` in ``items``, in order.
+
+        ``items`` is consumed lazily, one batch at a time, so it may be a
+        generator that parses or prompts as it goes.
+        """
+        for batch in self._batches(items):
+            texts = [text for _, text in batch]
+            if self.cache is not None:
+                vectors = self.cache.embed_many(self.model, texts, self._embed_batch)
+            else:
+                vectors = self._embed_batch(texts)
+            self.texts += len(batch)
+            for (key, _), vector in zip(batch, vectors):
+                yield key, vector
+
+    def embed_texts(self, texts):
+        """Return the vectors for ``texts`` (``None`` where embedding failed)."""
+        return [vector for _, vector in self.embed(enumerate(texts))]
+
+    def report(self):
+        return (
+            f"[embed] {self.texts} texts in {self.requests} requests "
+            f"({self.seconds:.1f}s"
+            + (f", {self.failures} failed)" if self.failures else ")")
+        )
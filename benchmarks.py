@@ -0,0 +1,527 @@
+"""Micro-benchmarks for the mail processing hot paths.
+
+Each benchmark builds its own synthetic data in a temporary directory so it
+can run without a real maildir or model server::
+
+    python benchmarks.py parse --count 500
+    python benchmarks.py knn --count 20000
+    python benchmarks.py embed --count 2000
+    python benchmarks.py ann --count 100000
+    python benchmarks.py store --count 100000
+    python benchmarks.py scan --count 10000 --workers 8
+    python benchmarks.py stream --count 2000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import parse_email, parse_email_headers
+
+
+SAMPLE_HTML = (
+    "<html><body><h1>Weekly digest</h1>"
+    + "<p>Item {i}: something happened, read more at https://example.com/{i}</p>" * 40
+    + "<p>Unsubscribe | Privacy Policy | Manage preferences</p></body></html>"
+)
+
+
+def write_synthetic_maildir(path, count):
+    """Write ``count`` multipart newsletter-style messages into ``path``."""
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        body = SAMPLE_HTML.format(i=i)
+        message = (
+            f"From: Newsletter {i % 50} <news{i % 50}@example.com>\n"
+            f"To: me@example.com\n"
+            f"Subject: Digest #{i}: {i * 7} new updates\n"
+            f"Date: Mon, 1 Jan 2024 10:{i % 60:02d}:00 +0000\n"
+            f"Message-ID: <msg-{i}@example.com>\n"
+            "MIME-Version: 1.0\n"
+            'Content-Type: multipart/alternative; boundary="BOUNDARY"\n'
+            "\n"
+            "--BOUNDARY\n"
+            "Content-Type: text/plain; charset=utf-8\n\n"
+            f"{body}\n"
+            "--BOUNDARY\n"
+            "Content-Type: text/html; charset=utf-8\n\n"
+            f"{body}\n"
+            "--BOUNDARY--\n"
+        )
+        with open(os.path.join(path, f"{i:06d}.eml"), "w", encoding="utf-8") as f:
+            f.write(message)
+    return sorted(os.path.join(path, f) for f in os.listdir(path))
+
+
+def _time_per_item(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def bench_parse(args):
+    """Compare full ``parse_email`` against header-only parsing per message."""
+    with tempfile.TemporaryDirectory() as tmp:
+        files = write_synthetic_maildir(tmp, args.count)
+        full = _time_per_item(parse_email, files)
+        headers = _time_per_item(parse_email_headers, files)
+    print(f"messages           : {args.count}")
+    print(f"parse_email        : {full * 1e6:9.1f} µs/message")
+    print(f"parse_email_headers: {headers * 1e6:9.1f} µs/message")
+    print(f"speedup            : {full / headers:9.1f}x")
+
+
+def _worker_counts(limit):
+    counts, n = [], 1
+    while n < limit:
+        counts.append(n)
+        n *= 2
+    return counts + [limit]
+
+
+def bench_scan(args):
+    """Scaling of the filter-rules pass from one worker to ``--workers``."""
+    import utils
+    from parallel_scan import parallel_map, scan_workers
+    from rule_engine import init_worker, worker_filter_action
+
+    rules = [
+        {"pattern": "invoice #\\d+", "action": "archive"},
+        {"pattern": "flash sale", "action": "delete"},
+        {"pattern": "^From: .*@bank\\.example", "action": "review"},
+    ]
+    limit = scan_workers(args.workers)
+    with tempfile.TemporaryDirectory() as tmp:
+        maildir = os.path.join(tmp, "new")
+        files = write_synthetic_maildir(maildir, args.count)
+        utils.RULES_FILE = os.path.join(tmp, "filter_rules.json")
+        with open(utils.RULES_FILE, "w", encoding="utf-8") as f:
+            json.dump(rules, f)
+
+        print(f"messages: {args.count}, CPUs: {os.cpu_count()}")
+        baseline = None
+        for workers in _worker_counts(limit):
+            start = time.perf_counter()
+            actions = parallel_map(
+                worker_filter_action,
+                files,
+                workers,
+                min_items=0,
+                initializer=init_worker,
+            )
+            assert len(list(actions)) == args.count
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"filter rules {workers:3d} workers: {elapsed:7.2f} s "
+                f"{args.count / elapsed:8.0f} msg/s  ({baseline / elapsed:.2f}x)"
+            )
+
+
+def _legacy_count_tokens(prompt, model):
+    import tiktoken
+
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(prompt))
+
+
+def bench_tokens(args):
+    """Per-call overhead of token counting before and after encoder caching."""
+    from gpt_api import count_tokens
+
+    prompt = SAMPLE_HTML.format(i=1)[:4000]
+    for model in ("gpt-4o-mini", "qwen2.5-coder:0.5b"):
+        rows = [
+            ("legacy", lambda: _legacy_count_tokens(prompt, model)),
+            ("exact (cached)", lambda: count_tokens(prompt, model, exact=True)),
+            ("estimate", lambda: count_tokens(prompt, model, exact=False)),
+        ]
+        for label, func in rows:
+            try:
+                per_call = _time_per_item(lambda _: func(), range(args.count))
+            except Exception as e:
+                print(f"{model:20} {label:15}: unavailable ({type(e).__name__})")
+                continue
+            print(f"{model:20} {label:15}: {per_call * 1e6:9.1f} µs/call")
+
+
+def _random_embeddings(count, dim, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def _legacy_knn_label(query, embs, threshold):
+    import numpy as np
+
+    sims = [
+        (
+            e["label"],
+            float(
+                np.dot(query, e["emb"])
+                / (np.linalg.norm(query) * np.linalg.norm(e["emb"]))
+            ),
+        )
+        for e in embs
+    ]
+    best_label, best_sim = max(sims, key=lambda x: x[1])
+    return best_label if best_sim >= threshold else None
+
+
+def _run_mail_path():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_mail")
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return path
+
+
+def bench_knn(args):
+    """k-NN labelling: per-record Python loop vs the pre-normalised matrix index."""
+    _run_mail_path()
+    from knn_index import KnnIndex
+
+    dim, n_queries = 768, 50
+    vectors = _random_embeddings(args.count, dim)
+    labels = [("JUNK", "REVIEW", "REPLY")[i % 3] for i in range(args.count)]
+    queries = _random_embeddings(n_queries, dim, seed=1)
+
+    embs = [{"label": l, "emb": v.tolist()} for l, v in zip(labels, vectors)]
+    legacy = _time_per_item(lambda q: _legacy_knn_label(q, embs, 0.0), queries[:5])
+
+    start = time.perf_counter()
+    index = KnnIndex()
+    index.add_many(vectors, labels)
+    build = time.perf_counter() - start
+    single = _time_per_item(lambda q: index.label_for(q, k=5), queries)
+    start = time.perf_counter()
+    index.labels_for(queries, k=5)
+    batched = (time.perf_counter() - start) / n_queries
+
+    assert index.label_for(queries[0]) == _legacy_knn_label(queries[0], embs, 0.0)
+    print(f"stored vectors     : {args.count} x {dim}")
+    print(f"index build        : {build * 1000:9.1f} ms")
+    print(f"legacy loop        : {legacy * 1000:9.3f} ms/query")
+    print(f"index matvec       : {single * 1000:9.3f} ms/query")
+    print(f"index matmul batch : {batched * 1000:9.3f} ms/query")
+    print(
+        f"speedup            : {legacy / single:9.1f}x single, {legacy / batched:.1f}x batched"
+    )
+
+
+def _clustered_embeddings(count, dim, seed=0, noise=0.58):
+    """Embeddings grouped into topics and threads, labelled by thread."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((200, dim)).astype(np.float32)
+    threads = topics[rng.integers(0, 200, 5000)]
+    threads += 0.5 * rng.standard_normal(threads.shape).astype(np.float32)
+    picks = rng.integers(0, 5000, count)
+    vectors = threads[picks] + noise * rng.standard_normal((count, dim)).astype(
+        np.float32
+    )
+    labels = [("JUNK", "REVIEW", "REPLY")[t % 3] for t in picks]
+    return vectors, labels
+
+
+def bench_ann(args):
+    """IVF-PQ index vs exact k-NN: recall@10, queries/s and threshold agreement."""
+    _run_mail_path()
+    import numpy as np
+    from ann_index import AnnIndex
+    from knn_index import KnnIndex
+
+    dim, k, threshold, n_queries = 768, 10, 0.80, 200
+    vectors, labels = _clustered_embeddings(args.count + n_queries, dim)
+    queries, vectors, labels = (
+        vectors[:n_queries],
+        vectors[n_queries:],
+        labels[n_queries:],
+    )
+
+    exact = KnnIndex()
+    exact.add_many(vectors, labels)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        ann = AnnIndex(os.path.join(tmp, "embeddings.ann.npz"))
+        for i in range(0, len(vectors), 10000):
+            ann.add_many(vectors[i : i + 10000], labels[i : i + 10000])
+        ann.save()
+        build = time.perf_counter() - start
+
+        exact_ids, _ = exact.search_batch(queries, k)
+        exact_qps = 1 / _time_per_item(lambda q: exact.search(q, k), queries)
+        exact_labels = [exact.label_for(q, threshold=threshold) for q in queries]
+        print(f"stored vectors : {args.count} x {dim}, {ann.nlist} lists, m={ann.m}")
+        print(f"build + save   : {build:8.1f} s")
+        print(f"RAM per vector : {ann.m + 10} B (PQ codes, id, label) vs {dim * 4} B")
+        matched = sum(label is not None for label in exact_labels) / n_queries
+        print(f"exact          : {exact_qps:8.0f} queries/s  ({matched:.0%} labelled)")
+        for nprobe in (1, 4, 8, 16, 32):
+            ann_ids = np.array([ann.search(q, k, nprobe)[0] for q in queries])
+            qps = 1 / _time_per_item(lambda q: ann.search(q, k, nprobe), queries)
+            recall = np.mean(
+                [len(set(a) & set(e)) / k for a, e in zip(ann_ids, exact_ids)]
+            )
+            agree = np.mean(
+                [
+                    ann.label_for(q, threshold=threshold, nprobe=nprobe) == label
+                    for q, label in zip(queries, exact_labels)
+                ]
+            )
+            print(
+                f"nprobe {nprobe:3d}     : {qps:8.0f} queries/s  recall@{k} "
+                f"{recall:.3f}  label@{threshold} agrees {agree:.1%}"
+            )
+
+
+_LOADERS = {
+    "python + numpy only": "import numpy",
+    "jsonl: json.loads every record": (
+        "import json\n" "records = [json.loads(line) for line in open(path)]"
+    ),
+    "jsonl: KnnIndex.from_jsonl": (
+        "from knn_index import KnnIndex\n" "index = KnnIndex.from_jsonl(path)"
+    ),
+    "store f16: open": (
+        "from embedding_store import EmbeddingStore\n"
+        "store = EmbeddingStore.open(path + '.f16.store')"
+    ),
+    "store f16: KnnIndex.sync": (
+        "from embedding_store import EmbeddingStore\n"
+        "from knn_index import KnnIndex\n"
+        "KnnIndex().sync(EmbeddingStore.open(path + '.f16.store'))"
+    ),
+    "store i8: KnnIndex.sync": (
+        "from embedding_store import EmbeddingStore\n"
+        "from knn_index import KnnIndex\n"
+        "KnnIndex().sync(EmbeddingStore.open(path + '.i8.store'))"
+    ),
+}
+
+
+# Peak RSS in KiB. ru_maxrss carries over the forking parent's peak on Linux,
+# so the kernel's high-water mark for the new address space is read instead.
+_PEAK_RSS = """
+def peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+
+def _measure_load(snippet, path):
+    """Run ``snippet`` in a fresh interpreter; return (seconds, peak RSS MiB)."""
+    run_mail = _run_mail_path()
+    code = "\n".join(
+        [
+            "import sys, time",
+            _PEAK_RSS,
+            f"sys.path.insert(0, {run_mail!r})",
+            f"path = {path!r}",
+            "start = time.perf_counter()",
+            snippet,
+            "elapsed = time.perf_counter() - start",
+            "print(elapsed, peak_rss())",
+        ]
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(out[0]), int(out[1]) / 1024
+
+
+def _dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def bench_store(args):
+    """Start-up cost of embeddings.jsonl vs the columnar embedding store."""
+    _run_mail_path()
+    import json
+
+    import numpy as np
+    from embedding_store import migrate_jsonl
+
+    dim = 768
+    rng = np.random.default_rng(0)
+    # Distinct vectors are serialised once and reused, which keeps generation
+    # fast without changing what the loaders have to parse.
+    emb_json = [json.dumps(v.tolist()) for v in rng.standard_normal((1000, dim)) / 30]
+    body = json.dumps("Hi team, notes from today's sync follow. " * 12)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embeddings.jsonl")
+        with open(path, "w") as f:
+            for i in range(args.count):
+                label = ("JUNK", "REVIEW", "REPLY")[i % 3]
+                f.write(
+                    f'{{"subject": "Re: sync #{i}", "body": {body}, '
+                    f'"label": "{label}", "emb": {emb_json[i % 1000]}, '
+                    f'"ts": "2024-01-01T10:00:00"}}\n'
+                )
+        for dtype, suffix in (("float16", ".f16.store"), ("int8", ".i8.store")):
+            start = time.perf_counter()
+            migrate_jsonl(path, path + suffix, dtype)
+            print(
+                f"migrate to {dtype:7s}: {time.perf_counter() - start:6.1f} s, "
+                f"{_dir_size(path + suffix) / 2**20:7.1f} MiB on disk"
+            )
+        print(f"records: {args.count} x {dim}, jsonl {_dir_size(path) / 2**20:.1f} MiB")
+        for name, snippet in _LOADERS.items():
+            seconds, rss = _measure_load(snippet, path)
+            print(f"{name:32s}: {seconds:7.2f} s  peak RSS {rss:7.1f} MiB")
+
+
+class _MockEmbeddingsHandler(BaseHTTPRequestHandler):
+    """``/v1/embeddings`` stand-in with a fixed per-request and per-text cost."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    request_latency = 0.003
+    text_latency = 0.0002
+    dim = 768
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        time.sleep(self.request_latency + self.text_latency * len(texts))
+        data = [
+            {"index": i, "embedding": [len(t) / (j + 1) for j in range(self.dim)]}
+            for i, t in enumerate(texts)
+        ]
+        payload = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def bench_embed(args):
+    """Embedding throughput: one text per request vs ``BatchEmbedder`` batches."""
+    from batch_embedder import BatchEmbedder, post_embeddings
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockEmbeddingsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/embeddings"
+    texts = [
+        f"Subject: Digest #{i}\n\n" + "lorem ipsum " * 40 for i in range(args.count)
+    ]
+
+    def embed_many(batch):
+        return post_embeddings(url, "mock-embed", batch)
+
+    try:
+        print(f"texts: {args.count}")
+        baseline = None
+        for batch_size in (1, 8, 32, 128):
+            embedder = BatchEmbedder(embed_many, batch_size=batch_size)
+            start = time.perf_counter()
+            vectors = embedder.embed_texts(texts)
+            elapsed = time.perf_counter() - start
+            assert len(vectors) == len(texts) and None not in vectors
+            assert vectors[7][0] == len(texts[7])
+            baseline = baseline or elapsed
+            print(
+                f"batch {batch_size:4d}: {embedder.requests:5d} requests "
+                f"{args.count / elapsed:8.0f} texts/s  ({baseline / elapsed:.1f}x)"
+            )
+    finally:
+        server.shutdown()
+
+
+class _MockStreamHandler(BaseHTTPRequestHandler):
+    """Streams ``?tokens=N`` chat deltas as UTF-8 SSE without a charset."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in _stream_tokens(self.server.tokens):
+            chunk = {"choices": [{"delta": {"content": token}}]}
+            self.wfile.write(
+                f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+            )
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def _stream_tokens(count):
+    words = ["Café ", "naïve ", "— ", "日本 ", "reply "]
+    return [words[i % len(words)] for i in range(count)]
+
+
+def bench_stream(args):
+    """Reading a streamed reply; also checks non-ASCII deltas decode intact."""
+    import http_session
+    from gpt_api import _sse_deltas, consume_stream
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockStreamHandler)
+    server.tokens = args.count
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    try:
+        start = time.perf_counter()
+        response = http_session.post(url, json={"stream": True}, stream=True)
+        try:
+            reply = consume_stream(_sse_deltas(response), start, model="mock")
+        finally:
+            response.close()
+        text = reply["choices"][0]["message"]["content"]
+        assert text == "".join(_stream_tokens(args.count)), text[:80]
+        stats = reply["stream"]
+        print(
+            f"tokens: {stats['chunks']}, first token {stats['ttft_ms']:.1f} ms, "
+            f"{stats['tokens_per_s']:.0f} tokens/s"
+        )
+    finally:
+        server.shutdown()
+
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "tokens": bench_tokens,
+    "knn": bench_knn,
+    "embed": bench_embed,
+    "ann": bench_ann,
+    "store": bench_store,
+    "scan": bench_scan,
+    "stream": bench_stream,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument(
+        "--workers", type=int, default=0, help="scan: most workers (0 = CPUs)"
+    )
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
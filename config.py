@@ -30,6 +30,30 @@ FROMGPT_DIR = os.getenv("FROMGPT_DIR", os.path.expanduser("~/.mail/Gmail/FromGPT
 IMAP_HOST = os.getenv("IMAP_HOST", "imap.gmail.com")
 IMAP_USER = os.getenv("IMAP_USER")
 IMAP_PASS = os.getenv("IMAP_PASS")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "true").lower() in {"1", "true", "yes"}
+IMAP_TRASH_FOLDER = os.getenv("IMAP_TRASH_FOLDER", "[Gmail]/Trash")
+# Local Message-ID -> UID map of the IMAP inbox (empty string disables it)
+IMAP_UID_DB = os.getenv(
+    "IMAP_UID_DB", os.path.expanduser("~/.cache/emailassistant/imap_uids.sqlite3")
+)
+
+# mbsync runs after local moves are coalesced per channel over this many seconds
+MBSYNC_COMMAND = os.getenv("MBSYNC_COMMAND", "mbsync")
+SYNC_DEBOUNCE_SECONDS = float(os.getenv("SYNC_DEBOUNCE_SECONDS", "5"))
+SYNC_LOCK_DIR = os.getenv(
+    "SYNC_LOCK_DIR", os.path.expanduser("~/.cache/emailassistant/locks")
+)
+
+# Mail watcher daemon: "inotify", "poll" (every WATCH_POLL_SECONDS; a file is
+# taken once unchanged for WATCH_SETTLE_SECONDS) or "auto" (inotify if available)
+WATCH_BACKEND = os.getenv("WATCH_BACKEND", "auto").lower()
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "2"))
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "1"))
+# Queue depth and arrival-to-action latency, rewritten while the watcher runs
+WATCH_STATUS_FILE = os.getenv(
+    "WATCH_STATUS_FILE", os.path.expanduser("~/.cache/emailassistant/watcher.json")
+)
 
 # LLM Configuration
 LOCAL_AI_IP = os.getenv("LOCAL_AI_IP", "192.168.1.69")
@@ -39,6 +63,103 @@ TEXTGEN_PORT = os.getenv("TEXTGEN_PORT", "5150")
 # Whether to use a locally hosted language model
 USE_LOCAL_LLM = os.getenv("USE_LOCAL_LLM", "true").lower() in {"1", "true", "yes"}
 
+# Ceiling on concurrent in-flight model requests per backend; the adaptive
+# throttle starts at THROTTLE_START_CONCURRENCY and probes up to this
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+
+# Email classification mode: "two-step" (summary then action) or "structured"
+# (single JSON reply with summary, action and confidence)
+CLASSIFY_MODE = os.getenv("CLASSIFY_MODE", "two-step").lower()
+
+# On-disk cache of model responses shared by all entry points
+USE_LLM_CACHE = os.getenv("USE_LLM_CACHE", "true").lower() in {"1", "true", "yes"}
+LLM_CACHE_DIR = os.getenv(
+    "LLM_CACHE_DIR", os.path.expanduser("~/.cache/emailassistant/llm_cache")
+)
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+
+# Persistent embedding cache (float32 vectors in SQLite, LRU-evicted past
+# EMBED_CACHE_MAX_BYTES of vector data)
+USE_EMBED_CACHE = os.getenv("USE_EMBED_CACHE", "true").lower() in {"1", "true", "yes"}
+EMBED_CACHE_DB = os.getenv(
+    "EMBED_CACHE_DB", os.path.expanduser("~/.cache/emailassistant/embeddings.sqlite3")
+)
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Near-duplicate clustering in bulk runs (off by default): only one email per
+# cluster of fingerprints at least DEDUP_SIMILARITY alike (0–1) is sent to the
+# model and its action applies to the whole cluster. With
+# DEDUP_DELETE_MEMBERS off, DELETE only trashes the classified email and its
+# look-alikes stay in the inbox for the next run.
+USE_DEDUP = os.getenv("USE_DEDUP", "false").lower() in {"1", "true", "yes"}
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.95"))
+DEDUP_DELETE_MEMBERS = os.getenv("DEDUP_DELETE_MEMBERS", "true").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+
+# HTTP client settings shared by all model and embedding requests
+# (HTTP_POOL_SIZE connections per host, pools kept for HTTP_POOL_HOSTS hosts)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "360"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "8"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+
+# Local model selection: PREFERRED_MODEL pins a model when the server offers
+# it; OLLAMA_DEFAULT_MODEL is used when the model list cannot be fetched.
+PREFERRED_MODEL = os.getenv("PREFERRED_MODEL")
+OLLAMA_DEFAULT_MODEL = os.getenv("OLLAMA_DEFAULT_MODEL", "qwen2.5-coder:0.5b")
+MODEL_LIST_TTL = float(os.getenv("MODEL_LIST_TTL", "300"))
+
+# Count request tokens exactly with tiktoken (OpenAI models only) instead of
+# the fast ~4-characters-per-token estimate
+EXACT_TOKENS = os.getenv("EXACT_TOKENS", "false").lower() in {"1", "true", "yes"}
+
+# Read model replies as a token stream (records time to first token and
+# tokens/s; prompts with a stop pattern always stream so they can end early)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() in {"1", "true", "yes"}
+
+# Adaptive throttle for bulk runs: concurrency is halved when median latency
+# exceeds THROTTLE_LATENCY_TOLERANCE x the idle baseline or more than
+# THROTTLE_ERROR_RATE of requests fail, and raised by one otherwise. Each
+# batch sends THROTTLE_BATCH_ROUNDS requests per concurrency slot.
+THROTTLE_MIN_CONCURRENCY = int(os.getenv("THROTTLE_MIN_CONCURRENCY", "1"))
+THROTTLE_START_CONCURRENCY = int(os.getenv("THROTTLE_START_CONCURRENCY", "2"))
+THROTTLE_BATCH_ROUNDS = int(os.getenv("THROTTLE_BATCH_ROUNDS", "5"))
+THROTTLE_LATENCY_TOLERANCE = float(os.getenv("THROTTLE_LATENCY_TOLERANCE", "2.0"))
+THROTTLE_ERROR_RATE = float(os.getenv("THROTTLE_ERROR_RATE", "0.1"))
+THROTTLE_MAX_PAUSE = float(os.getenv("THROTTLE_MAX_PAUSE", "30"))
+
+# Per-run journals that let an interrupted bulk run resume where it stopped
+RUN_JOURNAL_DIR = os.getenv(
+    "RUN_JOURNAL_DIR", os.path.expanduser("~/.cache/emailassistant/runs")
+)
+RUN_JOURNAL_KEEP = int(os.getenv("RUN_JOURNAL_KEEP", "20"))
+
+# Structured request log (JSONL, rotated by size; rotated files are
+# zstd-compressed when REQUEST_LOG_ZSTD is set and zstandard is installed).
+# Prompt/response bodies are only kept with REQUEST_LOG_BODIES.
+REQUEST_LOG_PATH = os.getenv(
+    "REQUEST_LOG_PATH", os.path.join(os.path.dirname(__file__), "gpt_requests.jsonl")
+)
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+REQUEST_LOG_BACKUPS = int(os.getenv("REQUEST_LOG_BACKUPS", "5"))
+REQUEST_LOG_ZSTD = os.getenv("REQUEST_LOG_ZSTD", "false").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+REQUEST_LOG_BODIES = os.getenv("REQUEST_LOG_BODIES", "false").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+
 # Base URLs for local model servers
 OLLAMA_BASE_URL = f"http://{LOCAL_AI_IP}:{OLLAMA_PORT}"
 # Maintained for backward compatibility
@@ -50,3 +171,20 @@ ANYTHING_API_KEY = os.getenv("ANYTHING_API_KEY")
 REMOTE_HOST = os.getenv("REMOTE_HOST")
 REMOTE_USER = os.getenv("REMOTE_USER")
 REMOTE_PATH = os.getenv("REMOTE_PATH")
+# Texts sent per /v1/embeddings request, capped at EMBED_BATCH_MAX_CHARS in total
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_MAX_CHARS = int(os.getenv("EMBED_BATCH_MAX_CHARS", "200000"))
+
+# Persistent maildir metadata index used by listing and search helpers
+MAIL_INDEX_DB = os.getenv(
+    "MAIL_INDEX_DB", os.path.expanduser("~/.cache/emailassistant/mail_index.sqlite3")
+)
+
+# Per-message ceiling (bytes) on buffered body text when parsing mail
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(512 * 1024)))
+
+# Process pool for the filter-rules pass over the inbox (0 = one worker per
+# CPU); folders with fewer than SCAN_PARALLEL_MIN files are matched in-process
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "0"))
+SCAN_CHUNK_SIZE = int(os.getenv("SCAN_CHUNK_SIZE", "64"))
+SCAN_PARALLEL_MIN = int(os.getenv("SCAN_PARALLEL_MIN", "500"))
@@ -0,0 +1,109 @@
+"""Near-duplicate clustering for bulk classification.
+
+Newsletters and notifications often arrive as many copies of one template
+with different numbers or links. Each email is reduced to a 64-bit SimHash of
+its normalized subject and formatted body; emails whose fingerprints differ
+in at most a few bits are grouped, and only the first email of each group
+(the representative) needs to be sent to the model.
+"""
+
+import re
+import hashlib
+import os
+
+from utils import parse_email
+
+FINGERPRINT_BITS = 64
+# Fingerprints built from fewer shingles than this are too weak to cluster on.
+MIN_SHINGLES = 3
+
+_RE_PREFIX = re.compile(r"^\s*((re|fwd?|aw)\s*:\s*)+", re.IGNORECASE)
+_DIGITS = re.compile(r"\d+")
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(subject, body):
+    """Lower-case, drop reply prefixes and mask digits so templates line up."""
+    subject = _RE_PREFIX.sub("", subject or "")
+    text = f"{subject}\n{body or ''}".lower()
+    return _DIGITS.sub("#", text)
+
+
+def simhash(text, shingle_size=3):
+    """Return ``(fingerprint, shingle_count)`` for ``text``."""
+    words = _WORD.findall(text)
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = {
+            " ".join(words[i : i + shingle_size])
+            for i in range(len(words) - shingle_size + 1)
+        }
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        h = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint, len(shingles)
+
+
+def max_distance_for(similarity):
+    """Convert a 0–1 similarity threshold into a maximum Hamming distance."""
+    similarity = min(max(similarity, 0.0), 1.0)
+    return int((1.0 - similarity) * FINGERPRINT_BITS)
+
+
+def cluster_fingerprints(fingerprints, similarity):
+    """
+    Group ``{key: fingerprint}`` into near-duplicate clusters.
+
+    Returns ``{representative_key: [member_keys]}`` in input order; keys whose
+    fingerprint is ``None`` always form singleton clusters. Candidates are
+    found by banding: with at most ``k`` differing bits, at least one of
+    ``k + 1`` bands must match exactly.
+    """
+    max_distance = max_distance_for(similarity)
+    bands = max_distance + 1
+    band_width = -(-FINGERPRINT_BITS // bands)
+    band_mask = (1 << band_width) - 1
+    buckets = {}
+    clusters = {}
+    for key, fingerprint in fingerprints.items():
+        if fingerprint is None:
+            clusters[key] = []
+            continue
+        band_keys = [
+            (band, fingerprint >> (band * band_width) & band_mask)
+            for band in range(bands)
+        ]
+        representative = None
+        for band_key in band_keys:
+            for candidate, candidate_fp in buckets.get(band_key, ()):
+                if bin(fingerprint ^ candidate_fp).count("1") <= max_distance:
+                    representative = candidate
+                    break
+            if representative is not None:
+                break
+        if representative is not None:
+            clusters[representative].append(key)
+            continue
+        clusters[key] = []
+        for band_key in band_keys:
+            buckets.setdefault(band_key, []).append((key, fingerprint))
+    return clusters
+
+
+def cluster_emails(inbox_path, email_files, similarity):
+    """Cluster ``email_files`` in ``inbox_path`` by template similarity."""
+    fingerprints = {}
+    for email_file in email_files:
+        subject, _, body, _, _ = parse_email(os.path.join(inbox_path, email_file))
+        fingerprint, shingles = simhash(normalize_text(subject, body))
+        fingerprints[email_file] = fingerprint if shingles >= MIN_SHINGLES else None
+    return cluster_fingerprints(fingerprints, similarity)
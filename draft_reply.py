@@ -4,17 +4,17 @@ import os
 import subprocess
 from utils import parse_email, fuzzy_select_email
 from gpt_api import ask_gpt
+from mail_index import scan_maildir
 from config import MAIN_INBOX, SENT_EMAIL
 
 def list_emails(inbox_path=MAIN_INBOX):
-    email_files = [f for f in os.listdir(inbox_path) if os.path.isfile(os.path.join(inbox_path, f))]
-    if not email_files:
+    emails = scan_maildir(inbox_path)
+    if not emails:
         print("No new emails found.")
         return None
 
     email_info = []
-    for i, email_file in enumerate(email_files):
-        subject, sender, _, date_str, _ = parse_email(os.path.join(inbox_path, email_file))
+    for i, (email_file, subject, sender, date_str, _) in enumerate(emails):
         email_info.append([i + 1, sender, subject, email_file, date_str])
 
     print("\nAvailable Emails:")
@@ -63,7 +63,7 @@ def generate_draft_reply(email_file=None, view_original=True, view_reply=True, s
         f"From: {sender}\nSubject: {subject}\n\n{body}\n\n"
         f"Please provide a clear and professional response."
     )
-    draft_reply_text = ask_gpt(prompt)
+    draft_reply_text = ask_gpt(prompt, use_cache=False)
     
     if draft_reply_text:
         if view_reply:
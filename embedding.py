@@ -1,6 +1,6 @@
 
-import requests
 import logging
+import http_session
 from config import ANYTHING_API_URL, ANYTHING_API_KEY
 
 WORKSPACE_SLUG = "emailgpt"
@@ -30,7 +30,7 @@ def send_embedding(file_reference):
         "deletes": []
     }
     try:
-        response = requests.post(embed_url, headers=headers, json=payload)
+        response = http_session.post(embed_url, headers=headers, json=payload)
         if response.status_code == 200:
             print("Embedding sent successfully.")
             return response.json()
@@ -0,0 +1,209 @@
+"""Persistent cache of text embeddings.
+
+``run_mail`` embedded each email once for the k-NN lookup and again to store
+it, and every re-run or training pass embedded the same texts once more.
+Vectors are now kept in a SQLite table keyed by a SHA-256 of the embedding
+model and the text (``llm_cache.make_key``). They are stored as compact
+float32 blobs, about 4 bytes per dimension instead of a JSON list.
+
+Each entry has a last-used time, refreshed on hits. Every ``EVICT_EVERY``
+stores, the least recently used entries are deleted until the vector data
+fits in ``EMBED_CACHE_MAX_BYTES``.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+
+from config import EMBED_CACHE_DB, EMBED_CACHE_MAX_BYTES
+from llm_cache import make_key
+
+SCHEMA_VERSION = 1
+# Run an eviction pass after this many stored vectors.
+EVICT_EVERY = 500
+# Keys per ``IN (...)`` lookup, below SQLite's bound-parameter limit.
+LOOKUP_CHUNK = 500
+
+_local = threading.local()
+
+
+def get_connection(db_path=EMBED_CACHE_DB):
+    """Return a per-thread connection to the cache, creating the schema if needed."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # Every vector can be recomputed, so an outdated layout is dropped.
+        conn.execute("DROP TABLE IF EXISTS embeddings")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS embeddings_by_use ON embeddings (last_used)"
+    )
+    conn.commit()
+    connections[db_path] = conn
+    return conn
+
+
+def pack(vector):
+    """Encode ``vector`` as a float32 blob."""
+    return array("f", vector).tobytes()
+
+
+def unpack(blob):
+    """Decode a float32 blob back into a list of floats."""
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """Model-and-text keyed vector store with LRU eviction."""
+
+    def __init__(self, db_path=EMBED_CACHE_DB, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, model, texts):
+        """Return the cached vector for each of ``texts`` (``None`` on a miss)."""
+        keys = [make_key(model, text) for text in texts]
+        found = {}
+        try:
+            conn = get_connection(self.db_path)
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), LOOKUP_CHUNK):
+                chunk = unique[i : i + LOOKUP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                found.update(
+                    conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({marks})",
+                        chunk,
+                    )
+                )
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+        vectors = [unpack(found[key]) if key in found else None for key in keys]
+        hits = sum(v is not None for v in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        """Store ``vectors`` for ``texts``, skipping ``None`` entries."""
+        now = time.time()
+        rows = [
+            (make_key(model, text), model, pack(vector), now)
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        ]
+        if not rows:
+            return
+        try:
+            conn = get_connection(self.db_path)
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Could not store embeddings: {e}")
+            return
+        with self._lock:
+            self._stores += len(rows)
+            due = self._stores >= EVICT_EVERY
+            if due:
+                self._stores = 0
+        if due:
+            self.evict()
+
+    def embed_many(self, model, texts, compute):
+        """Return vectors for ``texts``, calling ``compute`` only for misses.
+
+        ``compute`` takes a list of distinct uncached texts and returns their
+        vectors in order; results other than ``None`` are stored.
+        """
+        vectors = self.get_many(model, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if not missing:
+            return vectors
+        computed = dict(zip(missing, compute(missing)))
+        self.put_many(model, missing, [computed.get(t) for t in missing])
+        return [v if v is not None else computed.get(t) for t, v in zip(texts, vectors)]
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits ``max_bytes``."""
+        try:
+            conn = get_connection(self.db_path)
+            total = conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()[0]
+            excess = total - self.max_bytes
+            if excess <= 0:
+                return 0
+            doomed = []
+            for key, size in conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"
+            ):
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+            conn.commit()
+            return len(doomed)
+        except sqlite3.Error as e:
+            logging.warning(f"Embedding cache eviction failed: {e}")
+            return 0
+
+    def stats(self):
+        """Return a snapshot of hit/miss counters for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"[embed cache] {stats['hits']}/{stats['hits'] + stats['misses']} hits "
+            f"({stats['hit_rate']:.0%})"
+        )
+
+
+embedding_cache = EmbeddingCache()
@@ -1,19 +1,36 @@
 # embedding_engine.py
 import os
-import requests
 import logging
 import openai
 from dotenv import load_dotenv
-from config import USE_LOCALAI, LOCAL_AI_BASE_URL
+from config import USE_LOCAL_LLM, LOCAL_AI_BASE_URL
+from batch_embedder import BatchEmbedder, post_embeddings
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 
+OPENAI_EMBED_MODEL = "text-embedding-3-small"
+LOCAL_EMBED_MODEL = "nomic-embed-text-v1.5"
+
+
+def _openai_embed_many(texts):
+    response = openai.embeddings.create(model=OPENAI_EMBED_MODEL, input=texts)
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+def _local_embed_many(texts):
+    return post_embeddings(
+        f"{LOCAL_AI_BASE_URL}/v1/embeddings",
+        LOCAL_EMBED_MODEL,
+        texts,
+        read_timeout=30,
+    )
+
+
 def embed_with_openai(text):
     try:
-        response = openai.Embedding.create(model="text-embedding-3-small", input=text)
-        return response["data"][0]["embedding"]
+        return _openai_embed_many([text])[0]
     except Exception as e:
         logging.error(f"OpenAI embedding failed: {e}")
         return None
@@ -21,20 +38,25 @@ def embed_with_openai(text):
 
 def embed_with_local_model(text):
     try:
-        url = f"{LOCAL_AI_BASE_URL}/v1/embeddings"
-        payload = {"model": "nomic-embed-text-v1.5", "input": text}
-        response = requests.post(url, json=payload, timeout=30)
-        response.raise_for_status()
-        return response.json()["data"][0]["embedding"]
+        return _local_embed_many([text])[0]
     except Exception as e:
         logging.error(f"Local embedding failed: {e}")
         return None
 
 
 def embed_text(text):
-    if USE_LOCALAI:
-        return embed_with_local_model(text)
-    return embed_with_openai(text)
+    """Embed one text, reusing a cached vector when there is one."""
+    return embed_texts([text])[0]
+
+
+def embed_texts(texts, batch_size=None):
+    """Embed ``texts`` with one request per batch; ``None`` marks failures."""
+    if USE_LOCAL_LLM:
+        embed_many, model = _local_embed_many, LOCAL_EMBED_MODEL
+    else:
+        embed_many, model = _openai_embed_many, OPENAI_EMBED_MODEL
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    return BatchEmbedder(embed_many, model=model, **kwargs).embed_texts(texts)
 
 
 # Optional utility to embed a file as text
@@ -1,10 +1,9 @@
 """Utility script to list available models on the local Ollama server."""
 
-import requests
-
+import http_session
 from config import OLLAMA_BASE_URL
 
 list_models_endpoint = f"{OLLAMA_BASE_URL}/v1/models"
 
-response = requests.get(list_models_endpoint, timeout=5)
+response = http_session.get(list_models_endpoint, read_timeout=5)
 print(response.json())
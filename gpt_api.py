@@ -8,14 +8,33 @@ import openai
 from openai import OpenAI
 import os
 import json
-import requests
+import httpx
 import logging
 import tiktoken
 import time
+import functools
 from datetime import datetime
 from dotenv import load_dotenv
-from config import USE_LOCAL_LLM, OLLAMA_BASE_URL
+from config import (
+    EXACT_TOKENS,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    USE_LLM_CACHE,
+    USE_EMBED_CACHE,
+    USE_LOCAL_LLM,
+    OLLAMA_BASE_URL,
+    STREAM_RESPONSES,
+)
 from rich.console import Console
+from llm_cache import make_key, response_cache
+import http_session
+from batch_embedder import BatchEmbedder, post_embeddings
+from embedding_cache import embedding_cache
+from model_resolver import model_resolver
+from prompt_setup import PROMPT_VERSION
+from request_log import request_log
+from throttle import throttle
 
 # Setup rich console for pretty output
 console = Console()
@@ -29,24 +48,57 @@ username = os.getenv("WEBUI_USR")
 password = os.getenv("WEBUI_PSWD")
 API_KEY = os.getenv("OPENAI_API_KEY")
 BASE_URL = os.getenv("OPENAI_BASE_URL")
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+client = OpenAI(
+    api_key=API_KEY,
+    base_url=BASE_URL,
+    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    max_retries=HTTP_MAX_RETRIES,
+)
 
 if not API_KEY and not USE_LOCAL_LLM:
     raise ValueError(
         "OPENAI_API_KEY environment variable not set or failed to load from .env."
     )
 
-gpt_request_log_path = os.path.join(project_dir, "gpt_requests.log")
 TIMESTAMP = datetime.now()
 WORKSPACE_SLUG = "emailgpt"
 
 
-def count_tokens(prompt, model="gpt-4o-mini"):
+def max_concurrency():
+    """Return the in-flight request ceiling for the active backend.
+
+    Callers can size thread pools with this; ``throttle.slot`` keeps the
+    requests actually in flight at the throttle's current limit.
+    """
+    return throttle.max_limit
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder_for(model):
+    """Return a cached tiktoken encoder for OpenAI ``model``, or ``None``."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except Exception:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(prompt))
+        return None
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) for any model."""
+    return (len(text) + 3) // 4
+
+
+def count_tokens(prompt, model="gpt-4o-mini", exact=None):
+    """Return the token count of ``prompt`` for ``model``.
+
+    Exact tiktoken counts are only computed when ``exact`` (default
+    ``EXACT_TOKENS``) is set and the model has a known OpenAI encoding;
+    everything else, including local Ollama models, gets ``estimate_tokens``.
+    """
+    if EXACT_TOKENS if exact is None else exact:
+        encoder = _encoder_for(model)
+        if encoder is not None:
+            return len(encoder.encode(prompt))
+    return estimate_tokens(prompt)
 
 
 def log_gpt_request(
@@ -55,64 +107,180 @@ def log_gpt_request(
     token_count,
     elapsed_time,
     model_name=None,
-    log_file_path="gpt_requests.log",
+    cache="bypass",
 ):
-    """Log details of a model interaction for auditing and timing analysis."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    model_used = model_name or api_response.get("model", "Unknown Model")
-    total_tokens = api_response.get("usage", {}).get("total_tokens", "Unknown")
+    """Record a model interaction in the structured request log.
+
+    ``token_count`` may be a zero-argument callable; it is then evaluated by
+    the log's writer thread instead of on the request path. ``cache`` is one
+    of ``"hit"``, ``"miss"`` or ``"bypass"``.
+    """
+    api_response = api_response or {}
     server_time_ns = api_response.get("total_duration")
-    server_time_ms = (
-        f"{server_time_ns / 1_000_000:.2f}" if server_time_ns else "Unknown"
-    )
-    log_entry = (
-        "\n=== GPT Interaction ===\n"
-        f"Timestamp           : {timestamp}\n"
-        f"Model               : {model_used}\n"
-        f"Request Tokens      : {token_count}\n"
-        f"Total Tokens Used   : {total_tokens}\n"
-        f"Elapsed Time (s)    : {elapsed_time:.3f}\n"
-        f"Server Time (ms)    : {server_time_ms}\n\n"
-        "--- PROMPT START ---\n"
-        f"{prompt}\n"
-        "--- PROMPT END ---\n\n"
-        "--- RESPONSE START ---\n"
-        f"{json.dumps(api_response, indent=2)}\n"
-        "--- RESPONSE END ---\n"
-        "=== END OF GPT INTERACTION ===\n\n"
-    )
+    record = {
+        "model": model_name or api_response.get("model"),
+        "backend": "ollama" if USE_LOCAL_LLM else "openai",
+        "cache": cache,
+        "request_tokens": token_count,
+        "usage": api_response.get("usage"),
+        "client_ms": round(elapsed_time * 1000, 2),
+        "server_ms": round(server_time_ns / 1_000_000, 2) if server_time_ns else None,
+        "error": api_response.get("error"),
+        "stream": api_response.get("stream"),
+        "connections": http_session.connection_stats(),
+    }
     try:
-        with open(gpt_request_log_path, "a", encoding="utf-8") as log_file:
-            log_file.write(log_entry)
+        request_log.log(record, prompt=prompt, response=api_response)
     except Exception as e:
-        logging.error(f"Error writing GPT log entry: {e}")
+        logging.error(f"Error queueing request log record: {e}")
 
 
 def call_ollama_embedding(text, model="nomic-embed-text"):
-    """Request embeddings from the local Ollama server."""
+    """Request embeddings from the local Ollama server.
+
+    ``text`` may be a string or a list. When every text is already in the
+    embedding cache, the response is rebuilt from it without a request.
+    """
+    texts = text if isinstance(text, list) else [text]
+    if USE_EMBED_CACHE:
+        cached = embedding_cache.get_many(model, texts)
+        if texts and None not in cached:
+            return {
+                "object": "list",
+                "model": model,
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": vector}
+                    for i, vector in enumerate(cached)
+                ],
+                "cached": True,
+            }
     try:
         url = f"{OLLAMA_BASE_URL}/v1/embeddings"
         payload = {"model": model, "input": text}
-        response = requests.post(url, json=payload, timeout=30)
+        response = http_session.post(url, json=payload, read_timeout=30)
         response.raise_for_status()
-        return response.json()
+        result = response.json()
     except Exception as e:
         logging.error(f"Ollama embedding call failed: {e}")
         return {"error": str(e)}
+    if USE_EMBED_CACHE:
+        data = sorted(result.get("data", []), key=lambda d: d.get("index", 0))
+        if len(data) == len(texts):
+            embedding_cache.put_many(model, texts, [d["embedding"] for d in data])
+    return result
+
+
+def call_ollama_embeddings(texts, model="nomic-embed-text"):
+    """Embed ``texts`` on the local Ollama server, one request per batch.
+
+    Returns one vector per text, in order, with ``None`` for failures.
+    """
+    url = f"{OLLAMA_BASE_URL}/v1/embeddings"
+    embedder = BatchEmbedder(
+        lambda batch: post_embeddings(url, model, batch), model=model
+    )
+    return embedder.embed_texts(texts)
 
 
-def call_ollama_llm(prompt, model="qwen2.5-coder:0.5b"):
-    """Send a chat request to the local Ollama server."""
+def call_ollama_llm(
+    prompt, model="qwen2.5-coder:0.5b", json_mode=False, stream=False, stop=None
+):
+    """Send a chat request to the local Ollama server.
+
+    With ``json_mode`` the server is asked to constrain output to a JSON object.
+    With ``stream`` the reply is read as server-sent events (see
+    ``consume_stream``) and the connection is dropped as soon as the compiled
+    regex ``stop`` matches the text received so far.
+    """
     try:
         url = f"{OLLAMA_BASE_URL}/v1/chat/completions"
         console.print(f"[blue]Sending to Ollama at: {url}\n Message: {prompt}[/blue]")
         payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-        response = requests.post(url, json=payload, timeout=360)
-        response.raise_for_status()
-        return response.json()
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        if not (stream or stop):
+            response = http_session.post(url, json=payload)
+            response.raise_for_status()
+            return response.json()
+        payload["stream"] = True
+        start = time.perf_counter()
+        response = http_session.post(url, json=payload, stream=True)
+        try:
+            response.raise_for_status()
+            return consume_stream(_sse_deltas(response), start, stop, model)
+        finally:
+            response.close()
     except Exception as e:
         logging.error(f"Ollama LLM call failed: {e}")
-        return {"error": str(e)}
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        return {"error": str(e), "status": status}
+
+
+def _sse_deltas(response):
+    """Yield content deltas from an OpenAI-style server-sent event stream."""
+    # chunk_size=None hands over data as it arrives instead of in 512-byte reads.
+    # Lines are decoded here: SSE is always UTF-8, but requests falls back to
+    # ISO-8859-1 for a text/event-stream without a charset.
+    for line in response.iter_lines(chunk_size=None):
+        line = line.decode("utf-8")
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            raise RuntimeError(chunk["error"])
+        choices = chunk.get("choices") or [{}]
+        yield (choices[0].get("delta") or {}).get("content") or ""
+
+
+def consume_stream(deltas, start, stop=None, model=None):
+    """Collect streamed ``deltas`` into a chat completion dictionary.
+
+    ``start`` is the ``time.perf_counter()`` value when the request was sent.
+    Reading stops early once ``stop`` matches the accumulated text, leaving
+    the caller to close the underlying stream. Timing is returned under
+    ``"stream"``: time to first token, chunk count (about one token each) and
+    tokens per second after the first token.
+    """
+    parts = []
+    text = ""
+    first = None
+    chunks = 0
+    stopped = False
+    for delta in deltas:
+        if not delta:
+            continue
+        if first is None:
+            first = time.perf_counter()
+        chunks += 1
+        parts.append(delta)
+        if stop is not None:
+            text = "".join(parts)
+            if stop.search(text):
+                stopped = True
+                break
+    end = time.perf_counter()
+    text = "".join(parts)
+    generation = end - first if first is not None else 0.0
+    return {
+        "model": model,
+        "choices": [
+            {
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop_pattern" if stopped else "stop",
+            }
+        ],
+        "stream": {
+            "ttft_ms": round((first - start) * 1000, 2) if first else None,
+            "chunks": chunks,
+            "tokens_per_s": (
+                round((chunks - 1) / generation, 2) if generation > 0 else None
+            ),
+            "stopped_early": stopped,
+        },
+    }
 
 
 def format_api_response(api_response):
@@ -147,59 +315,143 @@ def format_api_response(api_response):
         return {"text": None, "sources": [], "close": False, "error": str(e)}
 
 
-def ask_gpt(prompt, model=None):
-    """Send a prompt to the configured language model and return a response."""
+def ask_gpt(
+    prompt, model=None, json_mode=False, use_cache=True, stream=None, stop=None
+):
+    """Send a prompt to the configured language model and return a response.
+
+    ``json_mode`` requests JSON-constrained output from backends that support it.
+    ``stream`` (default ``STREAM_RESPONSES``) reads the reply token by token;
+    with a compiled regex ``stop`` the stream is closed as soon as it matches,
+    so the returned text ends at the match.
+    Responses are served from the shared on-disk cache when possible; pass
+    ``use_cache=False`` for prompts that must always reach the model.
+    """
+    if stream is None:
+        stream = STREAM_RESPONSES or stop is not None
+    if not (use_cache and USE_LLM_CACHE):
+        return _ask_backend(prompt, model, json_mode, stream=stream, stop=stop)[0]
+    model_to_use = model or (get_active_model() if USE_LOCAL_LLM else "gpt-4o-mini")
+    key_parts = [model_to_use, PROMPT_VERSION, json_mode, prompt]
+    if stop is not None:
+        # Truncated replies must not be served to callers without ``stop``.
+        key_parts.append(stop.pattern)
+    key = make_key(*key_parts)
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return _ask_backend(
+            prompt, model_to_use, json_mode, "miss", stream=stream, stop=stop
+        )
+
+    start = time.perf_counter()
+    response = response_cache.get_or_compute(key, compute)
+    if not computed:
+        elapsed = time.perf_counter() - start
+        log_gpt_request(prompt, None, None, elapsed, model_to_use, cache="hit")
+    return response
+
+
+def _ask_backend(
+    prompt, model=None, json_mode=False, cache="bypass", stream=False, stop=None
+):
+    """Call the configured backend and return ``(response, cacheable)``."""
 
     if USE_LOCAL_LLM:
         model_to_use = model or get_active_model()
-        token_count = count_tokens(prompt, model=model_to_use)
+        token_count = functools.partial(count_tokens, prompt, model_to_use)
         try:
             console.print(
                 f"[bold green]Calling {model_to_use} at {OLLAMA_BASE_URL}[/bold green]"
             )
-            start = time.perf_counter()
-            api_response = call_ollama_llm(prompt, model=model_to_use)
-            elapsed = time.perf_counter() - start
+            with throttle.slot():
+                start = time.perf_counter()
+                api_response = call_ollama_llm(
+                    prompt,
+                    model=model_to_use,
+                    json_mode=json_mode,
+                    stream=stream,
+                    stop=stop,
+                )
+                elapsed = time.perf_counter() - start
             formatted_response = format_api_response(api_response)
-            log_gpt_request(prompt, api_response, token_count, elapsed, model_to_use)
-            return formatted_response
+            _feed_throttle(api_response, elapsed)
+            log_gpt_request(
+                prompt, api_response, token_count, elapsed, model_to_use, cache
+            )
+            return formatted_response, "error" not in api_response
         except Exception as e:
             logging.error(f"Error during Ollama call: {e}")
-            return None
+            return None, False
     else:
         model_to_use = model or "gpt-4o-mini"
-        token_count = count_tokens(prompt, model=model_to_use)
+        token_count = functools.partial(count_tokens, prompt, model_to_use)
         if not API_KEY:
             raise RuntimeError(
                 "OpenAI API key is not set. Please check .env and environment variables."
             )
         try:
-            start = time.perf_counter()
-            api_response = client.chat.completions.create(
-                model=model_to_use, messages=[{"role": "user", "content": prompt}]
-            )
-            elapsed = time.perf_counter() - start
-            api_dict = api_response.model_dump()
-            log_gpt_request(prompt, api_dict, token_count, elapsed, model_to_use)
-            return format_api_response(api_dict)
+            with throttle.slot():
+                start = time.perf_counter()
+                extra = (
+                    {"response_format": {"type": "json_object"}} if json_mode else {}
+                )
+                api_response = client.chat.completions.create(
+                    model=model_to_use,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=stream,
+                    **extra,
+                )
+                if stream:
+                    try:
+                        api_dict = consume_stream(
+                            (
+                                (chunk.choices[0].delta.content or "")
+                                for chunk in api_response
+                                if chunk.choices
+                            ),
+                            start,
+                            stop,
+                            model_to_use,
+                        )
+                    finally:
+                        api_response.close()
+                else:
+                    api_dict = api_response.model_dump()
+                elapsed = time.perf_counter() - start
+            _feed_throttle(api_dict, elapsed)
+            log_gpt_request(prompt, api_dict, token_count, elapsed, model_to_use, cache)
+            return format_api_response(api_dict), True
         except Exception as e:
             logging.error(f"Error during GPT API call: {e}")
-            return None
+            throttle.record(
+                None, error=True, rate_limited=isinstance(e, openai.RateLimitError)
+            )
+            return None, False
+
+
+def _feed_throttle(api_response, elapsed):
+    """Report one backend call to the adaptive throttle.
+
+    Time to first token is used for streamed replies since it reflects queueing
+    on the server without depending on how long the answer is.
+    """
+    ttft_ms = (api_response.get("stream") or {}).get("ttft_ms")
+    throttle.record(
+        ttft_ms / 1000 if ttft_ms else elapsed,
+        error="error" in api_response,
+        rate_limited=api_response.get("status") == 429,
+    )
 
 
 def get_active_model():
-    """Return the first available model reported by the local Ollama server."""
-    try:
-        url = f"{OLLAMA_BASE_URL}/v1/models"
-        response = requests.get(url, timeout=3)
-        response.raise_for_status()
-        models = response.json().get("data", [])
-        if models:
-            return models[0].get("id", "Unknown")
-        return "Unknown"
-    except Exception as e:
-        logging.warning(f"Could not get active model: {e}")
-        return "Unknown"
+    """Return the model to use on the local Ollama server.
+
+    Resolution is served from ``model_resolver``'s TTL cache, so this no longer
+    costs an HTTP round trip per prompt.
+    """
+    return model_resolver.resolve()
 
 
 def display_summary_report(response):
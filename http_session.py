@@ -0,0 +1,101 @@
+"""Shared, pooled HTTP session for calls to model and embedding servers.
+
+Every ``requests`` call in the project goes through the one ``Session`` built
+here, so TCP/TLS connections are kept alive and reused across calls and
+threads. The mounted adapter keeps up to ``HTTP_POOL_SIZE`` connections per
+host, for up to ``HTTP_POOL_HOSTS`` hosts, and retries connection errors and
+5xx responses with exponential backoff and jitter. Read timeouts are not
+retried. Timeouts default to ``(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)``.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_POOL_HOSTS,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_sessions = {}
+_adapters = []
+_lock = threading.Lock()
+
+
+def get_session(retry=True):
+    """Return the process-wide pooled ``requests.Session``.
+
+    ``retry=False`` returns a sibling session that fails fast, for probes such
+    as model listing where a quick fallback beats waiting out the backoff.
+    """
+    session = _sessions.get(retry)
+    if session is None:
+        with _lock:
+            session = _sessions.get(retry)
+            if session is None:
+                retries = Retry(
+                    total=HTTP_MAX_RETRIES if retry else 0,
+                    status_forcelist=RETRY_STATUSES,
+                    # POSTs are retried on 5xx replies and connect errors only:
+                    # a read timeout means the server may still be generating,
+                    # and resending would repeat the whole inference.
+                    allowed_methods=None,
+                    read=False,
+                    backoff_factor=HTTP_BACKOFF_FACTOR,
+                    backoff_jitter=HTTP_BACKOFF_FACTOR,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_HOSTS,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    max_retries=retries,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _adapters.append(adapter)
+                _sessions[retry] = session
+    return session
+
+
+def request(method, url, read_timeout=None, retry=True, **kwargs):
+    """Send a request on the shared session with the configured timeouts."""
+    kwargs.setdefault(
+        "timeout",
+        (HTTP_CONNECT_TIMEOUT, read_timeout if read_timeout else HTTP_READ_TIMEOUT),
+    )
+    return get_session(retry).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def connection_stats():
+    """Return request and connection counts across all pooled hosts."""
+    total_requests = total_connections = 0
+    for adapter in list(_adapters):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            total_requests += pool.num_requests
+            total_connections += pool.num_connections
+    return {
+        "requests": total_requests,
+        "connections": total_connections,
+        "reused": max(total_requests - total_connections, 0),
+    }
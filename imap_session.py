@@ -0,0 +1,254 @@
+"""Persistent IMAP connection for server-side trash operations.
+
+``move_message_to_trash_via_imap`` used to connect, log in, select the inbox
+and search for one message on every call. ``ImapSession`` keeps a single
+authenticated connection per process, so a bulk delete pays for the TLS
+handshake and login only once. It resolves Message-IDs to UIDs and moves
+them all at once with ``UID MOVE`` on a UID set, falling back to
+``UID COPY`` + ``UID STORE +FLAGS (\\Deleted)`` + expunge on servers without
+the MOVE extension. If the connection drops, the session reconnects once and
+retries.
+
+The host, port and TLS use come from ``IMAP_HOST``, ``IMAP_PORT`` and
+``IMAP_SSL``, so the session can also be pointed at a local IMAP server for
+testing.
+"""
+
+import atexit
+import sqlite3
+import imaplib
+import logging
+import threading
+
+from config import (
+    IMAP_HOST,
+    IMAP_PORT,
+    IMAP_SSL,
+    IMAP_USER,
+    IMAP_PASS,
+    IMAP_TRASH_FOLDER,
+    IMAP_UID_DB,
+)
+from imap_uid_map import UidMap, parse_fetch_message_ids
+
+# Largest number of UIDs put in a single command's UID set.
+UID_CHUNK = 500
+# Errors after which the connection is rebuilt and the command retried once.
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+def _quote(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def uid_set(uids):
+    """Compress ``uids`` into an IMAP sequence set such as ``1:4,7,9:10``."""
+    ranges = []
+    for uid in sorted({int(u) for u in uids}):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(f"{a}" if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+class ImapError(Exception):
+    """Raised when the IMAP server rejects a command."""
+
+
+class ImapSession:
+    """One reusable, authenticated IMAP connection with batched UID moves."""
+
+    def __init__(
+        self,
+        host=IMAP_HOST,
+        port=IMAP_PORT,
+        user=IMAP_USER,
+        password=IMAP_PASS,
+        ssl=IMAP_SSL,
+        mailbox="INBOX",
+        trash_folder=IMAP_TRASH_FOLDER,
+        uid_db=IMAP_UID_DB,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.ssl = ssl
+        self.mailbox = mailbox
+        self.trash_folder = trash_folder
+        self.uid_map = UidMap(self, uid_db) if uid_db else None
+        self.logins = 0
+        self._conn = None
+        self._capabilities = ()
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if not (self.user and self.password):
+            raise ImapError("Missing IMAP credentials")
+        cls = imaplib.IMAP4_SSL if self.ssl else imaplib.IMAP4
+        conn = cls(self.host, self.port)
+        try:
+            conn.login(self.user, self.password)
+            self.logins += 1
+            self._select(conn)
+            self._capabilities = tuple(conn.capabilities)
+        except Exception:
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
+            raise
+        self._conn = conn
+        return conn
+
+    def connection(self):
+        """Return the live connection, logging in on first use."""
+        with self._lock:
+            return self._conn or self._connect()
+
+    def has_capability(self, name):
+        self.connection()
+        return name.upper() in self._capabilities
+
+    def _call(self, func):
+        """Run ``func(conn)``, reconnecting and retrying once if the link drops."""
+        with self._lock:
+            try:
+                return func(self.connection())
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"IMAP connection lost ({e}); reconnecting.")
+                self._drop()
+                return func(self.connection())
+
+    def _uid(self, command, *args):
+        def run(conn):
+            typ, data = conn.uid(command, *args)
+            if typ != "OK":
+                raise ImapError(f"UID {command} failed: {data}")
+            return data
+
+        return self._call(run)
+
+    def _select(self, conn):
+        typ, data = conn.select(_quote(self.mailbox))
+        if typ != "OK":
+            raise ImapError(f"Cannot select {self.mailbox}")
+        state = {"MESSAGES": int(data[-1] or 0)}
+        for code in ("UIDVALIDITY", "UIDNEXT"):
+            _, values = conn.response(code)
+            if values[-1] is not None:
+                state[code] = int(values[-1])
+        return state
+
+    def select(self):
+        """Re-select the mailbox and return its ``UIDVALIDITY``, ``UIDNEXT``
+        and ``MESSAGES`` from the SELECT response codes.
+
+        STATUS should not be sent for the selected mailbox (RFC 3501), so the
+        current values come from a fresh SELECT instead. ``UIDNEXT`` is left
+        out when the server does not send it.
+        """
+        state = self._call(self._select)
+        if "UIDVALIDITY" not in state:
+            raise ImapError(f"SELECT {self.mailbox} returned no UIDVALIDITY")
+        return state
+
+    def fetch_message_ids(self, uids):
+        """Return ``(uid, message_id)`` pairs for the messages with ``uids``."""
+        data = self._uid(
+            "FETCH", uid_set(uids), "(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])"
+        )
+        return parse_fetch_message_ids(data)
+
+    def all_uids(self):
+        """Return every UID currently in the mailbox."""
+        data = self._uid("SEARCH", "ALL")
+        return [int(u) for u in (data[0] or b"").split()] if data else []
+
+    def uids_from(self, start):
+        """Return the UIDs in the mailbox from ``start`` upwards."""
+        data = self._uid("SEARCH", "UID", f"{start}:*")
+        uids = [int(u) for u in (data[0] or b"").split()] if data else []
+        # ``start:*`` also matches the highest UID when that is below ``start``.
+        return [uid for uid in uids if uid >= start]
+
+    def search_message_id(self, message_id):
+        """Return the UIDs of messages in the mailbox with ``message_id``."""
+        data = self._uid("SEARCH", "HEADER", "Message-ID", _quote(message_id))
+        return [int(u) for u in (data[0] or b"").split()] if data else []
+
+    def move_uids(self, uids, folder):
+        """Move ``uids`` from the selected mailbox to ``folder``.
+
+        Uses ``UID MOVE`` when the server supports it, otherwise copies,
+        flags the originals ``\\Deleted`` and expunges them (only those UIDs
+        when UIDPLUS is available).
+        """
+        uids = sorted({int(u) for u in uids})
+        if not uids:
+            return
+        target = _quote(folder)
+        for i in range(0, len(uids), UID_CHUNK):
+            chunk = uid_set(uids[i : i + UID_CHUNK])
+            if self.has_capability("MOVE"):
+                self._uid("MOVE", chunk, target)
+                continue
+            self._uid("COPY", chunk, target)
+            self._uid("STORE", chunk, "+FLAGS.SILENT", "(\\Deleted)")
+            if self.has_capability("UIDPLUS"):
+                self._uid("EXPUNGE", chunk)
+            else:
+                self._call(lambda conn: conn.expunge())
+
+    def trash(self, message_ids):
+        """Move the messages with ``message_ids`` to the trash folder.
+
+        UIDs come from the local ``UidMap`` where possible; IDs missing from
+        it are looked up with a server-side search. Returns the set of
+        Message-IDs that were found and moved.
+        """
+        message_ids = list(dict.fromkeys(message_ids))
+        found = {}
+        if self.uid_map is not None:
+            try:
+                self.uid_map.refresh()
+                found = self.uid_map.lookup(message_ids)
+            except (ImapError, sqlite3.Error) as e:
+                logging.warning(f"UID map unavailable, searching instead: {e}")
+        for message_id in message_ids:
+            if message_id not in found:
+                uids = self.search_message_id(message_id)
+                if uids:
+                    found[message_id] = uids
+        uids = [u for uids in found.values() for u in uids]
+        self.move_uids(uids, self.trash_folder)
+        if self.uid_map is not None and uids:
+            self.uid_map.forget(uids)
+        return set(found)
+
+    def _drop(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
+
+    def close(self):
+        """Log out and close the connection, if one is open."""
+        with self._lock:
+            conn, self._conn = self._conn, None
+            if conn is None:
+                return
+            try:
+                conn.logout()
+            except Exception:
+                try:
+                    conn.shutdown()
+                except Exception:
+                    pass
+
+
+imap_session = ImapSession()
+atexit.register(imap_session.close)
@@ -0,0 +1,188 @@
+"""Local Message-ID to IMAP UID map, one per server folder.
+
+Finding a message with ``SEARCH HEADER Message-ID`` makes the server scan the
+folder's headers on every call, which Gmail does slowly. ``UidMap`` keeps the
+Message-ID of every UID in a SQLite table, so server actions can address
+messages by UID directly.
+
+The map is filled with bulk ``UID FETCH (BODY.PEEK[HEADER.FIELDS
+(MESSAGE-ID)])`` and kept current incrementally. Each refresh re-selects the
+folder and reads ``UIDVALIDITY`` and ``UIDNEXT`` from the SELECT response.
+Only UIDs from the stored ``UIDNEXT`` onwards are fetched, found with one
+``UID SEARCH UID n:*``. A changed ``UIDVALIDITY`` discards the folder's rows
+and rebuilds them. When the server's message count no longer matches the
+map, rows for expunged UIDs are dropped after one ``UID SEARCH ALL``.
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import threading
+from email.parser import BytesHeaderParser
+from email.policy import default
+
+from config import IMAP_UID_DB
+
+SCHEMA_VERSION = 1
+# UIDs requested per FETCH command while filling the map.
+FETCH_CHUNK = 5000
+
+_UID_RE = re.compile(rb"UID (\d+)")
+_local = threading.local()
+
+
+def get_connection(db_path=IMAP_UID_DB):
+    """Return a per-thread connection to the map, creating the schema if needed."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # The map only mirrors the server, so an outdated layout is rebuilt.
+        conn.execute("DROP TABLE IF EXISTS folders")
+        conn.execute("DROP TABLE IF EXISTS uids")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS folders (
+            folder TEXT PRIMARY KEY,
+            uidvalidity INTEGER NOT NULL,
+            uidnext INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS uids (
+            folder TEXT NOT NULL,
+            uid INTEGER NOT NULL,
+            message_id TEXT,
+            PRIMARY KEY (folder, uid)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS uids_by_id ON uids (folder, message_id)")
+    conn.commit()
+    connections[db_path] = conn
+    return conn
+
+
+def parse_fetch_message_ids(data):
+    """Return ``(uid, message_id)`` pairs from a Message-ID ``UID FETCH`` reply."""
+    pairs = []
+    parser = BytesHeaderParser(policy=default)
+    for item in data or []:
+        if not isinstance(item, tuple):
+            continue
+        match = _UID_RE.search(item[0])
+        if not match:
+            continue
+        message_id = parser.parsebytes(item[1]).get("Message-ID")
+        message_id = str(message_id).strip() if message_id else None
+        pairs.append((int(match.group(1)), message_id or None))
+    return pairs
+
+
+class UidMap:
+    """Message-ID → UID lookups for the folder selected by an ``ImapSession``."""
+
+    def __init__(self, session, db_path=IMAP_UID_DB):
+        self.session = session
+        self.db_path = db_path
+
+    @property
+    def folder(self):
+        session = self.session
+        return f"{session.user}@{session.host}/{session.mailbox}"
+
+    def refresh(self):
+        """Bring the map up to date with the server and return its size."""
+        folder = self.folder
+        status = self.session.select()
+        conn = get_connection(self.db_path)
+        row = conn.execute(
+            "SELECT uidvalidity, uidnext FROM folders WHERE folder = ?", (folder,)
+        ).fetchone()
+        if row is None or row[0] != status["UIDVALIDITY"]:
+            if row is not None:
+                logging.info(f"UIDVALIDITY changed for {folder}; rebuilding UID map.")
+            conn.execute("DELETE FROM uids WHERE folder = ?", (folder,))
+            start = 1
+        else:
+            start = row[1]
+
+        # Fetch by the UIDs that exist: UIDNEXT on an old folder can be in the
+        # millions with most of the range long expunged.
+        uidnext = status.get("UIDNEXT")
+        new = (
+            self.session.uids_from(start) if uidnext is None or start < uidnext else []
+        )
+        if uidnext is None:
+            uidnext = max(new, default=start - 1) + 1
+        for i in range(0, len(new), FETCH_CHUNK):
+            chunk = new[i : i + FETCH_CHUNK]
+            wanted = set(chunk)
+            pairs = self.session.fetch_message_ids(chunk)
+            conn.executemany(
+                "INSERT OR REPLACE INTO uids (folder, uid, message_id) VALUES (?, ?, ?)",
+                [(folder, uid, mid) for uid, mid in pairs if uid in wanted],
+            )
+
+        count = conn.execute(
+            "SELECT COUNT(*) FROM uids WHERE folder = ?", (folder,)
+        ).fetchone()[0]
+        if count != status["MESSAGES"]:
+            live = set(self.session.all_uids())
+            stored = {
+                uid
+                for (uid,) in conn.execute(
+                    "SELECT uid FROM uids WHERE folder = ?", (folder,)
+                )
+            }
+            gone = stored - live
+            conn.executemany(
+                "DELETE FROM uids WHERE folder = ? AND uid = ?",
+                [(folder, uid) for uid in gone],
+            )
+            count -= len(gone)
+        conn.execute(
+            "INSERT OR REPLACE INTO folders (folder, uidvalidity, uidnext)"
+            " VALUES (?, ?, ?)",
+            (folder, status["UIDVALIDITY"], uidnext),
+        )
+        conn.commit()
+        return count
+
+    def lookup(self, message_ids):
+        """Return ``{message_id: [uid, ...]}`` for the IDs found in the map."""
+        folder = self.folder
+        conn = get_connection(self.db_path)
+        found = {}
+        for message_id in dict.fromkeys(message_ids):
+            uids = [
+                uid
+                for (uid,) in conn.execute(
+                    "SELECT uid FROM uids WHERE folder = ? AND message_id = ?",
+                    (folder, message_id),
+                )
+            ]
+            if uids:
+                found[message_id] = uids
+        return found
+
+    def forget(self, uids):
+        """Drop ``uids`` after they have been moved out of the folder."""
+        conn = get_connection(self.db_path)
+        conn.executemany(
+            "DELETE FROM uids WHERE folder = ? AND uid = ?",
+            [(self.folder, int(uid)) for uid in uids],
+        )
+        conn.commit()
@@ -0,0 +1,238 @@
+"""Content-addressed on-disk cache for language model responses.
+
+Responses are stored as one JSON file per key under ``LLM_CACHE_DIR``, where
+the key is a SHA-256 of the model, prompt template version and prompt. Files
+are written atomically, so several processes (the menu, ``silent_summary``,
+``run_batches``) can share one cache directory. A file's mtime doubles as its
+last-access time: hits touch it, and eviction removes entries older than
+``LLM_CACHE_MAX_AGE_DAYS`` and then the least recently used ones until the
+cache fits in ``LLM_CACHE_MAX_BYTES``.
+
+Concurrent requests for the same key are coalesced ("single flight"): threads
+share a per-key lock and processes a per-key ``flock`` lock file, so only the
+first caller reaches the backend and the rest read its result. Requests for
+different keys never wait on each other.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from config import LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE_DAYS
+
+# Run an eviction pass after this many stores.
+EVICT_EVERY = 50
+
+
+def make_key(*parts):
+    """Return a stable hex digest for the JSON-serialisable ``parts``."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Disk-backed response cache with LRU eviction and single-flight fills."""
+
+    def __init__(
+        self,
+        cache_dir=LLM_CACHE_DIR,
+        max_bytes=LLM_CACHE_MAX_BYTES,
+        max_age_days=LLM_CACHE_MAX_AGE_DAYS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for ``key`` or ``None``."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.max_age and time.time() - entry.get("created", 0) > self.max_age:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def put(self, key, value):
+        """Atomically store ``value`` under ``key``."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "value": value}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Could not write LLM cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._stores += 1
+            due = self._stores % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    @contextmanager
+    def _single_flight(self, key):
+        with self._lock:
+            lock, users = self._key_locks.get(key, (threading.Lock(), 0))
+            self._key_locks[key] = (lock, users + 1)
+        try:
+            with lock, self._key_file_lock(key):
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._key_locks[key]
+                if users <= 1:
+                    del self._key_locks[key]
+                else:
+                    self._key_locks[key] = (lock, users - 1)
+
+    @contextmanager
+    def _key_file_lock(self, key):
+        """Hold an ``flock`` on ``locks/<key>.lock``, removing the file after.
+
+        The holder unlinks the file before unlocking, so a waiter that wakes
+        up holding the unlinked inode opens the path again.
+        """
+        if fcntl is None:
+            yield
+            return
+        lock_dir = os.path.join(self.cache_dir, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        path = os.path.join(lock_dir, f"{key}.lock")
+        while True:
+            f = open(path, "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        try:
+            yield
+        finally:
+            self._remove(path)
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    @contextmanager
+    def _file_lock(self, name, blocking=True):
+        if fcntl is None:
+            yield True
+            return
+        lock_dir = os.path.join(self.cache_dir, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, name), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for ``key``, calling ``compute`` on a miss.
+
+        ``compute`` returns ``(value, cacheable)``; only cacheable values are
+        stored. Concurrent callers for the same key wait for the first one.
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._single_flight(key):
+            value = self.get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.coalesced += 1
+                return value
+            with self._lock:
+                self.misses += 1
+            value, cacheable = compute()
+            if cacheable and value is not None:
+                self.put(key, value)
+            return value
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over the size cap."""
+        with self._file_lock("evict.lock", blocking=False) as acquired:
+            if not acquired:
+                return
+            entries = []
+            now = time.time()
+            for root, _, files in os.walk(self.cache_dir):
+                if os.path.basename(root) == "locks":
+                    continue
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.endswith(".tmp") and now - st.st_mtime < 3600:
+                        continue
+                    if (
+                        name.endswith(".tmp")
+                        or self.max_age
+                        and now - st.st_mtime > self.max_age
+                    ):
+                        self._remove(path)
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return a snapshot of hit/miss counters for this process."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,143 @@
+"""Persistent metadata index for maildir folders.
+
+Listing, search and cleanup helpers only need the sender, subject and date of
+each message. Parsing every file on every menu action is slow for large
+maildirs, so this module caches those headers in a SQLite database keyed by
+maildir path, filename, size and modification time. Each scan only parses
+files that are new or have changed since the previous scan and drops rows for
+files that have disappeared.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from config import MAIL_INDEX_DB
+from utils import parse_email_headers
+
+SCHEMA_VERSION = 1
+
+IndexedEmail = namedtuple(
+    "IndexedEmail", ["file", "subject", "sender", "date_str", "date_obj"]
+)
+
+_local = threading.local()
+
+
+def get_connection(db_path=MAIL_INDEX_DB):
+    """Return a per-thread connection to the index, creating the schema if needed."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # The index is a cache, so an outdated layout is simply rebuilt.
+        conn.execute("DROP TABLE IF EXISTS messages")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            maildir TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            subject TEXT,
+            sender TEXT,
+            date_str TEXT,
+            date_iso TEXT,
+            PRIMARY KEY (maildir, filename)
+        )
+        """
+    )
+    conn.commit()
+    connections[db_path] = conn
+    return conn
+
+
+def _parse_date(date_iso):
+    if not date_iso:
+        return None
+    try:
+        return datetime.fromisoformat(date_iso)
+    except ValueError:
+        return None
+
+
+def scan_maildir(maildir, db_path=MAIL_INDEX_DB):
+    """
+    Return an ``IndexedEmail`` for every file in ``maildir``.
+
+    Results follow directory listing order, like ``os.listdir``. Cached
+    headers are reused when a file's size and mtime are unchanged; everything
+    else is parsed and written back to the index.
+    """
+    maildir = os.path.abspath(maildir)
+    files = []
+    with os.scandir(maildir) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    files.append((entry.name, entry.stat()))
+            except FileNotFoundError:
+                continue
+
+    conn = get_connection(db_path)
+    cached = {
+        row[0]: row
+        for row in conn.execute(
+            "SELECT filename, size, mtime_ns, subject, sender, date_str, date_iso "
+            "FROM messages WHERE maildir = ?",
+            (maildir,),
+        )
+    }
+
+    results = []
+    updates = []
+    for name, st in files:
+        row = cached.pop(name, None)
+        if row and row[1] == st.st_size and row[2] == st.st_mtime_ns:
+            subject, sender, date_str, date_iso = row[3:]
+            date_obj = _parse_date(date_iso)
+        else:
+            subject, sender, date_str, date_obj = parse_email_headers(
+                os.path.join(maildir, name)
+            )
+            date_iso = date_obj.isoformat() if date_obj else None
+            updates.append(
+                (
+                    maildir,
+                    name,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    str(subject),
+                    str(sender),
+                    str(date_str),
+                    date_iso,
+                )
+            )
+        results.append(IndexedEmail(name, subject, sender, date_str, date_obj))
+
+    if updates or cached:
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    updates,
+                )
+                conn.executemany(
+                    "DELETE FROM messages WHERE maildir = ? AND filename = ?",
+                    [(maildir, name) for name in cached],
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error updating mail index for {maildir}: {e}")
+    return results
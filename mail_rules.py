@@ -1,6 +1,5 @@
 import os
 import shutil
-import subprocess
 from datetime import datetime
 from config import (
     MAIN_INBOX,
@@ -10,13 +9,14 @@ from config import (
     FROMGPT_DIR,
     TRASH_DIR,
 )
-from utils import parse_email
+from mail_index import scan_maildir
+from sync_coordinator import sync_coordinator
 
 
 def move_to_trash_via_maildir(email_file):
     """
     Move a message file into the local Trash maildir without altering its filename,
-    then push the deletion to the IMAP server.
+    then schedule a (coalesced) sync to push the deletion to the IMAP server.
     """
     src = os.path.join(MAIN_INBOX, email_file)
     if not os.path.exists(src):
@@ -30,7 +30,7 @@ def move_to_trash_via_maildir(email_file):
         shutil.move(src, dst)
         print(f"[trash] moved: {dst}")
         # Push the deletion to the remote Trash folder
-        subprocess.run(["mbsync", "gmail-trash"], check=True)
+        sync_coordinator.request("gmail-trash")
     except Exception as e:
         print(f"[error] moving to trash: {e}")
 
@@ -76,16 +76,13 @@ def run_rule_on_mailbox(rule):
     for email_file in os.listdir(MAIN_INBOX):
         if os.path.isfile(os.path.join(MAIN_INBOX, email_file)):
             apply_rule_to_email(email_file, rule)
+    sync_coordinator.flush()
+    print(sync_coordinator.report())
 
 
 def filter_emails(criteria):
     filtered = []
-    email_files = [
-        f for f in os.listdir(MAIN_INBOX) if os.path.isfile(os.path.join(MAIN_INBOX, f))
-    ]
-    for email_file in email_files:
-        file_path = os.path.join(MAIN_INBOX, email_file)
-        subject, sender, _, date_str, date_obj = parse_email(file_path)
+    for email_file, subject, sender, date_str, date_obj in scan_maildir(MAIN_INBOX):
         match = True
         if criteria.get("sender"):
             if criteria["sender"].lower() not in sender.lower():
@@ -165,23 +162,15 @@ def interactive_rule_application():
     if criteria:
         filtered_emails = filter_emails(criteria)
     else:
-        filtered_emails = []
-        email_files = [
-            f
-            for f in os.listdir(MAIN_INBOX)
-            if os.path.isfile(os.path.join(MAIN_INBOX, f))
+        filtered_emails = [
+            {
+                "file": email.file,
+                "sender": email.sender,
+                "subject": email.subject,
+                "date_str": email.date_str,
+            }
+            for email in scan_maildir(MAIN_INBOX)
         ]
-        for email_file in email_files:
-            file_path = os.path.join(MAIN_INBOX, email_file)
-            subj, sndr, _, dstr, _ = parse_email(file_path)
-            filtered_emails.append(
-                {
-                    "file": email_file,
-                    "sender": sndr,
-                    "subject": subj,
-                    "date_str": dstr,
-                }
-            )
 
     if not filtered_emails:
         print("No emails match the specified criteria.")
@@ -217,10 +206,12 @@ def interactive_rule_application():
             return
 
     print("\nThe following emails will have the rule applied:")
+    info_by_file = {e["file"]: e for e in filtered_emails}
     for email_file in selected_emails:
-        fp = os.path.join(MAIN_INBOX, email_file)
-        subj, sndr, _, dstr, _ = parse_email(fp)
-        print(f"From: {sndr} | Subject: {subj} | Date: {dstr}")
+        info = info_by_file[email_file]
+        print(
+            f"From: {info['sender']} | Subject: {info['subject']} | Date: {info['date_str']}"
+        )
     final_confirm = (
         input("Are you sure you want to apply the rule? (yes/no): ").strip().lower()
     )
@@ -230,3 +221,5 @@ def interactive_rule_application():
 
     for email_file in selected_emails:
         apply_rule_to_email(email_file, rule)
+    sync_coordinator.flush()
+    print(sync_coordinator.report())
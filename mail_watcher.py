@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""Long-running watcher that classifies inbox mail as it lands.
+
+Ingestion used to be ``mbsync`` on cron followed by batch jobs that rescanned
+the whole inbox, so new mail waited minutes before anything looked at it.
+``MailWatcher`` watches ``MAIN_INBOX`` with inotify (called through
+``ctypes``, no extra dependency) and queues each file once it is completely
+written: ``IN_MOVED_TO`` for maildir deliveries renamed in from ``tmp/`` and
+``IN_CLOSE_WRITE`` for files written in place. Where inotify is unavailable
+the directory is polled every ``WATCH_POLL_SECONDS``, and a file is taken
+once its size and mtime have stayed the same for ``WATCH_SETTLE_SECONDS``.
+
+Worker threads run each queued file through the filter rules and, when no
+rule matches, through ``summarize_specific_email``, then file it the way a
+bulk run does. Queue depth, counters and end-to-end latency (from the time
+the file landed in the inbox to the time its action was applied) are written
+to ``WATCH_STATUS_FILE`` and printed on exit.
+
+Run ``python mail_watcher.py``; files already in the inbox are queued first
+unless ``--no-scan`` is given.
+"""
+
+import os
+import json
+import time
+import queue
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import logging
+import argparse
+import threading
+from collections import Counter, deque
+
+from config import (
+    MAIN_INBOX,
+    WATCH_BACKEND,
+    WATCH_POLL_SECONDS,
+    WATCH_SETTLE_SECONDS,
+    WATCH_STATUS_FILE,
+)
+from gpt_api import max_concurrency
+from rule_engine import filter_action, get_compiled_rules
+from utils import send_notification
+from summarize import (
+    ACTION_DIRS,
+    FILTER_ACTIONS,
+    move_email_with_category,
+    stylize_console,
+    summarize_specific_email,
+)
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+# Latency samples kept for the percentiles in the status file.
+LATENCY_WINDOW = 1000
+# Seconds between status file writes, and the longest wait for watch events.
+STATUS_INTERVAL = 1.0
+
+
+def _inbox_files(path):
+    try:
+        with os.scandir(path) as entries:
+            return [
+                e.name for e in entries if e.is_file() and not e.name.startswith(".")
+            ]
+    except FileNotFoundError:
+        return []
+
+
+class InotifyWatch:
+    """inotify watch reporting files renamed into, or written in, ``path``."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self.path = path
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"cannot watch {path}: {os.strerror(errno)}")
+
+    def poll(self, timeout):
+        """Return ``(names, rescan)`` for the events seen within ``timeout``.
+
+        ``rescan`` is set when the kernel queue overflowed and events were
+        lost. Raises ``OSError`` once the watched directory itself is gone.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return [], False
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return [], False
+        names, rescan, pos = [], False, 0
+        while pos < len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, pos)
+            name = data[pos + _EVENT.size : pos + _EVENT.size + length].rstrip(b"\0")
+            pos += _EVENT.size + length
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                raise OSError(f"{self.path} was removed or moved")
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+            elif name and not mask & IN_ISDIR:
+                names.append(os.fsdecode(name))
+        return names, rescan
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatch:
+    """Polling stand-in for ``InotifyWatch``.
+
+    A file is reported once its size and mtime match the previous poll and
+    it has not been modified for ``settle`` seconds.
+    """
+
+    def __init__(self, path, interval=WATCH_POLL_SECONDS, settle=WATCH_SETTLE_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.settle = settle
+        self._last = {}
+        self._next = 0.0
+
+    def poll(self, timeout):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if delay > timeout:
+                return [], False
+        self._next = time.monotonic() + self.interval
+        names, seen, now = [], {}, time.time()
+        for name in _inbox_files(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            seen[name] = (st.st_size, st.st_mtime_ns)
+            if self._last.get(name) == seen[name] and now - st.st_mtime >= self.settle:
+                names.append(name)
+        self._last = seen
+        return names, False
+
+    def close(self):
+        pass
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+
+class MailWatcher:
+    """Queues new inbox files and classifies them on worker threads."""
+
+    def __init__(
+        self,
+        inbox=MAIN_INBOX,
+        backend=WATCH_BACKEND,
+        workers=None,
+        status_file=WATCH_STATUS_FILE,
+    ):
+        self.inbox = inbox
+        self.backend = backend
+        self.workers = workers or max_concurrency()
+        self.status_file = status_file
+        self.queue = queue.Queue()
+        self.counts = Counter()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.in_flight = 0
+        self.source = None
+        self.started = time.time()
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._status_written = 0.0
+
+    def _open_source(self):
+        if self.backend in ("auto", "inotify"):
+            try:
+                return InotifyWatch(self.inbox)
+            except OSError as e:
+                if self.backend == "inotify":
+                    raise
+                logging.warning(f"inotify unavailable ({e}); polling {self.inbox}")
+        return PollWatch(self.inbox)
+
+    def enqueue(self, name, detected=None):
+        """Queue inbox file ``name`` unless it is already queued or handled."""
+        with self._lock:
+            if name in self._seen:
+                return
+            self._seen.add(name)
+            self.counts["queued"] += 1
+        self.queue.put((name, detected or time.time()))
+
+    def rescan(self):
+        """Queue every file in the inbox that has not been seen yet."""
+        present = _inbox_files(self.inbox)
+        with self._lock:
+            self._seen &= set(present)
+        now = time.time()
+        for name in present:
+            self.enqueue(name, now)
+
+    def process(self, name, detected):
+        """Apply the filter rules or the classifier's action to one file."""
+        path = os.path.join(self.inbox, name)
+        try:
+            # Renaming into the inbox sets the inode change time.
+            arrived = min(os.stat(path).st_ctime, detected)
+        except FileNotFoundError:
+            self._finish(name, "vanished")
+            return
+        started = time.time()
+        rules = get_compiled_rules(actions=FILTER_ACTIONS)
+        action = filter_action(rules, path) if rules else None
+        result = None
+        if action:
+            outcome = "filtered"
+        else:
+            result = summarize_specific_email(name, silent=True)
+            if result is None:
+                self._finish(name, "failed")
+                return
+            action, outcome = result["recommended_action"], "classified"
+
+        dest = ACTION_DIRS.get(action)
+        if dest:
+            move_email_with_category(name, dest)
+        elif action == "REPLY":
+            send_notification(
+                result["subject"],
+                result["sender"],
+                f"Summary: {result['summary']}\nAction: REPLY",
+            )
+        done = time.time()
+        stylize_console(
+            f"Watcher: {name} → {action} ({outcome}, {done - arrived:.1f}s after arrival)",
+            "blue",
+        )
+        self._finish(name, outcome, action, done - arrived, started - detected)
+
+    def _finish(self, name, outcome, action=None, latency=None, wait=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if action:
+                self.counts[f"action_{action}"] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+                self.waits.append(max(wait, 0.0))
+            if not os.path.exists(os.path.join(self.inbox, name)):
+                # Files left in the inbox (REPLY, failures) stay seen, so a
+                # rescan does not queue them again.
+                self._seen.discard(name)
+
+    def _work(self):
+        while not self._stop.is_set():
+            item = self.queue.get()
+            if item is None:
+                break
+            with self._lock:
+                self.in_flight += 1
+            try:
+                self.process(*item)
+            except Exception as e:
+                logging.error(f"Watcher failed on {item[0]}: {e}")
+                self._finish(item[0], "failed")
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def metrics(self):
+        """Return queue depth, counters and latency percentiles (seconds)."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            waits = sorted(self.waits)
+            counts = dict(self.counts)
+            in_flight = self.in_flight
+        return {
+            "timestamp": time.time(),
+            "uptime": round(time.time() - self.started, 1),
+            "backend": type(self.source).__name__ if self.source else None,
+            "queue_depth": self.queue.qsize(),
+            "in_flight": in_flight,
+            "counts": counts,
+            "latency": {
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": _percentile(latencies, 1.0),
+                "samples": len(latencies),
+            },
+            "queue_wait": {
+                "p50": _percentile(waits, 0.5),
+                "p95": _percentile(waits, 0.95),
+            },
+        }
+
+    def write_status(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._status_written < STATUS_INTERVAL:
+            return
+        self._status_written = now
+        tmp = f"{self.status_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.status_file) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.metrics(), f)
+            os.replace(tmp, self.status_file)
+        except OSError as e:
+            logging.warning(f"Could not write watcher status: {e}")
+
+    def report(self):
+        m = self.metrics()
+        counts = m["counts"]
+        latency = m["latency"]
+        line = (
+            f"[watch] {counts.get('queued', 0)} queued, "
+            f"{counts.get('filtered', 0)} filtered, "
+            f"{counts.get('classified', 0)} classified"
+            + (f", {counts['failed']} failed" if counts.get("failed") else "")
+        )
+        if latency["samples"]:
+            line += (
+                f"; arrival→action p50 {latency['p50']:.1f}s "
+                f"p95 {latency['p95']:.1f}s max {latency['max']:.1f}s"
+            )
+        return line
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, scan=True):
+        """Watch the inbox until ``stop`` is called (or SIGINT/SIGTERM)."""
+        # The watch is opened before the initial scan so nothing landing in
+        # between is missed; the seen set drops the duplicates.
+        self.source = self._open_source()
+        threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        if scan:
+            self.rescan()
+        stylize_console(
+            f"Watching {self.inbox} with {type(self.source).__name__} "
+            f"({self.workers} workers).",
+            "bold",
+        )
+        try:
+            while not self._stop.is_set():
+                try:
+                    names, lost = self.source.poll(STATUS_INTERVAL)
+                except OSError as e:
+                    logging.warning(f"inotify watch lost ({e}); polling instead")
+                    self.source.close()
+                    self.source = PollWatch(self.inbox)
+                    names, lost = [], True
+                if lost:
+                    self.rescan()
+                now = time.time()
+                for name in names:
+                    self.enqueue(name, now)
+                self.write_status()
+        finally:
+            self._stop.set()
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+            self.source.close()
+            self.write_status(force=True)
+            print(self.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--backend", choices=("auto", "inotify", "poll"), default=WATCH_BACKEND
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--no-scan",
+        action="store_true",
+        help="do not queue files already in the inbox at startup",
+    )
+    args = parser.parse_args()
+
+    watcher = MailWatcher(backend=args.backend, workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    try:
+        watcher.run(scan=not args.no_scan)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
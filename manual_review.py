@@ -7,7 +7,7 @@ from datetime import datetime
 from rich.console import Console
 from rich.table import Table
 from rich.prompt import Prompt, IntPrompt
-from utils import parse_email, move_message_to_trash_via_imap
+from utils import parse_email_headers, move_message_to_trash_via_imap
 from config import (
     MAIN_INBOX,
     ARCHIVE_DIR,
@@ -57,7 +57,7 @@ def manual_review_process(num_emails):
 
     for email_file in emails_to_review:
         file_path = os.path.join(MAIN_INBOX, email_file)
-        subject, sender, body, date_str, _ = parse_email(file_path)
+        subject, sender, date_str, _ = parse_email_headers(file_path)
 
         table = Table(title=f"Review: {email_file}", show_lines=True)
         table.add_column("Field", style="bold")
@@ -0,0 +1,100 @@
+"""Cached resolution of the model to use on the local Ollama server.
+
+``get_active_model`` used to query ``/v1/models`` before every prompt. The
+``ModelResolver`` here keeps the model list for ``MODEL_LIST_TTL`` seconds,
+refreshes it on a background thread once it goes stale (callers keep using
+the previous list meanwhile), honours a pinned ``PREFERRED_MODEL`` and falls
+back to the last known list, the pinned model or ``OLLAMA_DEFAULT_MODEL``
+when the listing endpoint is slow or down.
+"""
+
+import time
+import logging
+import threading
+
+import http_session
+from config import (
+    OLLAMA_BASE_URL,
+    PREFERRED_MODEL,
+    MODEL_LIST_TTL,
+    OLLAMA_DEFAULT_MODEL,
+)
+
+# After a failed refresh, wait this long before asking the server again.
+RETRY_AFTER_FAILURE = 30
+LIST_TIMEOUT = 3
+
+
+class ModelResolver:
+    """Resolve the active model from a TTL-cached listing of available models."""
+
+    def __init__(
+        self,
+        list_url=f"{OLLAMA_BASE_URL}/v1/models",
+        ttl=MODEL_LIST_TTL,
+        preferred=PREFERRED_MODEL,
+        fallback=OLLAMA_DEFAULT_MODEL,
+    ):
+        self.list_url = list_url
+        self.ttl = ttl
+        self.preferred = preferred
+        self.fallback = fallback
+        self._models = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        response = http_session.get(
+            self.list_url, read_timeout=LIST_TIMEOUT, retry=False
+        )
+        response.raise_for_status()
+        return [m.get("id") for m in response.json().get("data", []) if m.get("id")]
+
+    def refresh(self):
+        """Fetch the model list now; keep the previous list if the call fails."""
+        try:
+            models = self._fetch()
+        except Exception as e:
+            logging.warning(f"Could not list models: {e}")
+            with self._lock:
+                self._expires_at = time.monotonic() + min(self.ttl, RETRY_AFTER_FAILURE)
+                self._refreshing = False
+            return self._models
+        with self._lock:
+            self._models = models
+            self._expires_at = time.monotonic() + self.ttl
+            self._refreshing = False
+        return models
+
+    def models(self):
+        """
+        Return the cached model list (``None`` if it has never been fetched).
+
+        The first call fetches synchronously; afterwards a stale list is
+        returned immediately while a background thread refreshes it.
+        """
+        with self._lock:
+            models = self._models
+            stale = time.monotonic() >= self._expires_at
+            start_refresh = stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+        if not start_refresh:
+            return models
+        if models is None:
+            return self.refresh()
+        threading.Thread(target=self.refresh, daemon=True).start()
+        return models
+
+    def resolve(self):
+        """Return the pinned model if available, else the first listed model."""
+        models = self.models()
+        if self.preferred and (not models or self.preferred in models):
+            return self.preferred
+        if models:
+            return models[0]
+        return self.fallback
+
+
+model_resolver = ModelResolver()
@@ -0,0 +1,84 @@
+"""Process-pool map for CPU-bound scans over maildir files.
+
+Parsing a message (MIME walk, BeautifulSoup, the ``format_email_body`` regex
+chain) is CPU-bound, so a full-inbox scan on one core is limited by the
+interpreter rather than the disk. ``parallel_map`` splits the work into
+chunks of ``SCAN_CHUNK_SIZE`` items, runs them on ``SCAN_WORKERS`` processes
+and yields the results in input order as chunks finish. Only a few chunks
+per worker are in flight at once, so memory stays bounded however large the
+folder is.
+
+Folders with fewer than ``SCAN_PARALLEL_MIN`` files, and ``SCAN_WORKERS=1``,
+are handled in-process: starting a pool costs more than it saves there.
+"""
+
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from config import SCAN_WORKERS, SCAN_CHUNK_SIZE, SCAN_PARALLEL_MIN
+
+# Chunks queued ahead of the one being consumed, per worker.
+PREFETCH = 2
+
+
+def scan_workers(workers=None):
+    """Resolve a worker count; ``0`` means one worker per CPU."""
+    workers = SCAN_WORKERS if workers is None else workers
+    return max(1, workers or os.cpu_count() or 1)
+
+
+def _run_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def parallel_map(
+    func,
+    items,
+    workers=None,
+    chunksize=SCAN_CHUNK_SIZE,
+    min_items=SCAN_PARALLEL_MIN,
+    initializer=None,
+    initargs=(),
+):
+    """Yield ``func(item)`` for each of ``items``, in order.
+
+    ``func`` and its results must be picklable: a module-level function, or
+    a ``functools.partial`` of one. State that every call needs, such as
+    compiled rules, belongs in ``initializer(*initargs)``, which runs once
+    per worker (or once in-process) instead of being pickled into every
+    chunk. An exception raised by ``func`` reaches the caller as it would
+    from a plain loop.
+    """
+    items = list(items)
+    chunksize = max(1, chunksize)
+    workers = min(scan_workers(workers), -(-len(items) // chunksize))
+    pool = None
+    if workers > 1 and len(items) >= min_items:
+        try:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, initializer=initializer, initargs=initargs
+            )
+        except (OSError, NotImplementedError) as e:
+            logging.warning(f"Process pool unavailable ({e}); scanning serially")
+    if pool is None:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    try:
+        pending = deque()
+        for start in range(0, len(items), chunksize):
+            pending.append(
+                pool.submit(_run_chunk, func, items[start : start + chunksize])
+            )
+            if len(pending) >= workers * PREFETCH:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # Also reached when the caller stops iterating early.
+        pool.shutdown(cancel_futures=True)
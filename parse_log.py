@@ -1,18 +1,35 @@
 import re
 import sys
+import statistics
+from collections import Counter
 
+from config import REQUEST_LOG_PATH
+from request_log import bodies_path, iter_records
 
-def extract_raw_emails(file_path, output_path=None):
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
+# Regex to extract text between EMAIL DETAILS: and last line marker
+EMAIL_PATTERN = re.compile(
+    r"EMAIL DETAILS:\n(.*?)If there are any actions, tasks, or urgent items mentioned, please highlight them\.",
+    re.DOTALL,
+)
+
+
+def _prompts(file_path):
+    """Yield logged prompts from a bodies file or a legacy text log."""
+    if file_path.endswith(".log"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            yield f.read()
+        return
+    if not file_path.endswith(".bodies.jsonl"):
+        file_path = bodies_path(file_path)
+    for body in iter_records(file_path):
+        if body.get("prompt"):
+            yield body["prompt"]
 
-    # Regex to extract text between EMAIL DETAILS: and last line marker
-    pattern = re.compile(
-        r"EMAIL DETAILS:\n(.*?)If there are any actions, tasks, or urgent items mentioned, please highlight them\.",
-        re.DOTALL,
-    )
 
-    matches = pattern.findall(content)
+def extract_raw_emails(file_path, output_path=None):
+    matches = [
+        m for prompt in _prompts(file_path) for m in EMAIL_PATTERN.findall(prompt)
+    ]
     if not matches:
         print("No emails found between markers.")
         return
@@ -31,8 +48,34 @@ def extract_raw_emails(file_path, output_path=None):
         print(full_output)
 
 
+def print_stats(file_path=REQUEST_LOG_PATH):
+    """Summarise request counts, cache status and latency from the request log."""
+    records = list(iter_records(file_path))
+    if not records:
+        print(f"No request records found in {file_path}.")
+        return
+    by_model = Counter(r.get("model") or "unknown" for r in records)
+    by_cache = Counter(r.get("cache") or "unknown" for r in records)
+    errors = sum(1 for r in records if r.get("error"))
+    latencies = sorted(
+        r["client_ms"] for r in records if r.get("cache") != "hit" and "client_ms" in r
+    )
+    print(f"Requests : {len(records)} ({errors} errors)")
+    print("Cache    : " + ", ".join(f"{k}={v}" for k, v in by_cache.most_common()))
+    print("Models   : " + ", ".join(f"{k}={v}" for k, v in by_model.most_common()))
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(
+            f"Latency  : p50 {statistics.median(latencies):.0f} ms, "
+            f"p95 {p95:.0f} ms, max {latencies[-1]:.0f} ms"
+        )
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python extract_exact_emails.py <log_file> [output_file]")
+    if len(sys.argv) > 1 and sys.argv[1] == "--stats":
+        print_stats(sys.argv[2] if len(sys.argv) > 2 else REQUEST_LOG_PATH)
+    elif len(sys.argv) < 2:
+        print("Usage: python parse_log.py <log_file> [output_file]")
+        print("       python parse_log.py --stats [log_file]")
     else:
         extract_raw_emails(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
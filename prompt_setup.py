@@ -1,3 +1,13 @@
+import re
+
+# Bump whenever a prompt template changes so cached model responses are not reused.
+PROMPT_VERSION = "1"
+
+# A complete action indicator in a reply to the action prompt; streamed replies
+# are cut off as soon as it appears.
+ACTION_PATTERN = re.compile(r"ACTION:\s*(ARCHIVE|DELETE|REPLY|REVIEW)", re.IGNORECASE)
+
+
 def get_summary_prompt(sender, date_str, subject, body):
     SUMMARY_PROMPT = (
         "Assess this email and summarize briefly. Highlight any critical requests, deadlines, or key context.\n"
@@ -28,3 +38,22 @@ def get_action_prompt(summary_content):
     if ACTION_PROMPT:
         print("Succesfully built action prompt.")
         return ACTION_PROMPT
+
+
+def get_classification_prompt(sender, date_str, subject, body):
+    CLASSIFICATION_PROMPT = (
+        "Assess this email, summarize it briefly and choose one final action.\n"
+        "ENSURE that ONLY IMPORTANT emails are marked for REVIEW. Brayden DOES NOT need ANY account status updates of ANY kind.\n\n"
+        "Actions:\n"
+        "ARCHIVE — informational, or if you cannot decide (DEFAULT)\n"
+        "REVIEW — genuinely important and needs attention, but no reply\n"
+        "DELETE — marketing, frequent announcements of little import etc.\n"
+        "REPLY — directly requires an email response\n\n"
+        f"EMAIL DETAILS:\nFrom: {sender}\nSubject: {subject}\nDate: {date_str}\n\n"
+        f"{body}\n\n"
+        "Respond with ONLY a JSON object with exactly these keys and nothing else:\n"
+        '{"summary": "<one or two sentences>", "action": "ARCHIVE|REVIEW|DELETE|REPLY", "confidence": <number between 0 and 1>}\n'
+    )
+    if CLASSIFICATION_PROMPT:
+        print("Succesfully built classification prompt.")
+        return CLASSIFICATION_PROMPT
@@ -0,0 +1,274 @@
+"""Structured, rotating log of language model requests.
+
+Every model call becomes one JSON line in ``REQUEST_LOG_PATH`` with the model,
+token counts, client and server latency, cache status and a hash of the
+prompt. Records are queued and written by a background thread, so callers
+never wait on disk I/O; values given as zero-argument callables (such as an
+exact token count) are resolved by the writer too.
+
+When a file grows past ``REQUEST_LOG_MAX_BYTES`` it is rotated to ``.1``,
+older backups shift up and only ``REQUEST_LOG_BACKUPS`` are kept. With
+``REQUEST_LOG_ZSTD`` and the optional ``zstandard`` package installed,
+rotated files are stored as ``.1.zst`` and so on.
+
+Prompt and response bodies are only kept when ``REQUEST_LOG_BODIES`` is set.
+They go to a sibling ``*.bodies.jsonl`` file, rotated the same way and joined
+to the main log by the record ``id``.
+"""
+
+import io
+import os
+import json
+import queue
+import atexit
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+from config import (
+    REQUEST_LOG_PATH,
+    REQUEST_LOG_MAX_BYTES,
+    REQUEST_LOG_BACKUPS,
+    REQUEST_LOG_ZSTD,
+    REQUEST_LOG_BODIES,
+)
+
+# Records queued beyond this are dropped rather than blocking the caller.
+QUEUE_SIZE = 10000
+
+
+def prompt_hash(prompt):
+    """Return a short stable hash identifying ``prompt``."""
+    return hashlib.sha256(prompt.encode("utf-8", "replace")).hexdigest()[:16]
+
+
+def bodies_path(path):
+    """Return the bodies file that accompanies the log at ``path``."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.bodies{ext or '.jsonl'}"
+
+
+class RotatingJsonl:
+    """Append-only JSONL file with size-based rotation.
+
+    Several processes (the menu, ``silent_summary``, ``run_batches``) append
+    to the same log. Each write and rotation holds an ``flock`` on
+    ``<path>.lock``, every line is flushed before the lock is released, and
+    a handle whose file was rotated away by another process is reopened.
+    """
+
+    def __init__(self, path, max_bytes, backups, compress=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.compress = compress and zstandard is not None
+        self._fh = None
+
+    def _backup(self, n):
+        return f"{self.path}.{n}.zst" if self.compress else f"{self.path}.{n}"
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self):
+        if self._fh is not None:
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(self._fh.fileno()).st_ino:
+                self.close()
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._locked():
+            fh = self._open()
+            fh.write(line)
+            fh.flush()
+            if self.max_bytes and os.fstat(fh.fileno()).st_size >= self.max_bytes:
+                self._rotate()
+
+    def flush(self):
+        if self._fh is not None:
+            self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def rotate(self):
+        """Move the active file to backup ``.1``, shifting older backups up."""
+        with self._locked():
+            self._rotate()
+
+    def _rotate(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if self.backups == 0:
+            os.remove(self.path)
+            return
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup(n)):
+                os.replace(self._backup(n), self._backup(n + 1))
+        if self.compress:
+            tmp = self._backup(1) + ".tmp"
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+            os.replace(tmp, self._backup(1))
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._backup(1))
+
+
+class RequestLog:
+    """Queue-backed writer for request records and optional bodies."""
+
+    def __init__(
+        self,
+        path,
+        max_bytes=REQUEST_LOG_MAX_BYTES,
+        backups=REQUEST_LOG_BACKUPS,
+        compress=REQUEST_LOG_ZSTD,
+        bodies=REQUEST_LOG_BODIES,
+    ):
+        self.records = RotatingJsonl(path, max_bytes, backups, compress)
+        self.bodies = (
+            RotatingJsonl(bodies_path(path), max_bytes, backups, compress)
+            if bodies
+            else None
+        )
+        self.dropped = 0
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="request-log", daemon=True
+                )
+                self._thread.start()
+
+    def log(self, record, prompt=None, response=None):
+        """Queue ``record`` for writing and return its ``id``.
+
+        ``prompt`` and ``response`` are written to the bodies file when body
+        logging is enabled and otherwise discarded.
+        """
+        record = {
+            "id": uuid.uuid4().hex,
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            **record,
+        }
+        if prompt is not None:
+            record.setdefault("prompt_hash", prompt_hash(prompt))
+        body = None
+        if self.bodies is not None and (prompt is not None or response is not None):
+            body = {"id": record["id"], "prompt": prompt, "response": response}
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((record, body))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1:
+                logging.warning("Request log queue full; dropping records.")
+        return record["id"]
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            record, body = self._queue.get()
+            try:
+                for key, value in record.items():
+                    if callable(value):
+                        record[key] = value()
+                self.records.write(record)
+                if body is not None:
+                    self.bodies.write(body)
+                if self._queue.empty():
+                    self.records.flush()
+                    if self.bodies is not None:
+                        self.bodies.flush()
+            except Exception as e:
+                logging.error(f"Error writing request log record: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def _open_text(path):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def log_files(path):
+    """Return the log at ``path`` and its backups, oldest first."""
+    found = []
+    n = 1
+    while True:
+        for candidate in (f"{path}.{n}", f"{path}.{n}.zst"):
+            if os.path.exists(candidate):
+                found.append(candidate)
+                break
+        else:
+            break
+        n += 1
+    found.reverse()
+    if os.path.exists(path):
+        found.append(path)
+    return found
+
+
+def iter_records(path=REQUEST_LOG_PATH):
+    """Yield every record from ``path`` and its rotated backups, oldest first."""
+    for file_path in log_files(path):
+        with _open_text(file_path) as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping malformed line in {file_path}")
+
+
+request_log = RequestLog(REQUEST_LOG_PATH)
+atexit.register(request_log.flush)
@@ -0,0 +1,137 @@
+"""Compiled matcher for the JSON filter rules.
+
+``filter_rules.json`` holds an ordered list of ``{"pattern", "action"}``
+rules, and the first rule whose pattern matches an email decides its action.
+Rather than running ``re.search`` for every rule against every email, the
+rules are compiled once:
+
+* literal patterns (no regex metacharacters) are folded into a prefix trie and
+  emitted as a single regular expression, so one scan of the email tells
+  whether any literal rule can match at all;
+* the remaining patterns are compiled individually and only tried until the
+  first literal hit, since CPython's ``re`` gains nothing from merging
+  unrelated regexes into one alternation.
+
+Compiled rules are cached until the rules file's mtime or size changes.
+"""
+
+import os
+import re
+import logging
+
+import utils
+
+_REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+_cache = {"key": None, "rules": None}
+# Rules compiled by ``init_worker`` in a scan worker process.
+_worker = {"rules": None}
+
+
+def _trie_pattern(words):
+    """Return a regex matching any of ``words``, factored by shared prefixes."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        alts = [
+            re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch
+        ]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class CompiledRules:
+    """An ordered rule set compiled for fast first-match lookup."""
+
+    def __init__(self, rules, actions=None):
+        self.actions = {}
+        self.literals = []
+        self.regexes = []
+        allowed = {a.upper() for a in actions} if actions else None
+        for index, rule in enumerate(rules):
+            pattern = rule.get("pattern")
+            action = (rule.get("action") or "").upper()
+            if not pattern or not action:
+                continue
+            if allowed is not None and action not in allowed:
+                continue
+            if not _REGEX_META.intersection(pattern):
+                self.literals.append((index, pattern.lower()))
+            else:
+                try:
+                    self.regexes.append((index, re.compile(pattern, re.IGNORECASE)))
+                except re.error as e:
+                    logging.warning(f"Skipping invalid filter rule {pattern!r}: {e}")
+                    continue
+            self.actions[index] = action
+
+        self.literal_re = None
+        if self.literals:
+            words = {literal for _, literal in self.literals}
+            self.literal_re = re.compile(_trie_pattern(words), re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def first_match(self, text):
+        """Return the index of the first rule matching ``text``, or ``None``."""
+        best = None
+        if self.literal_re is not None and self.literal_re.search(text):
+            lowered = text.lower()
+            best = next(
+                (index for index, literal in self.literals if literal in lowered), None
+            )
+        for index, compiled in self.regexes:
+            if best is not None and index > best:
+                break
+            if compiled.search(text):
+                return index
+        return best
+
+    def match(self, text):
+        """Return the upper-cased action of the first matching rule, or ``None``."""
+        index = self.first_match(text)
+        return self.actions[index] if index is not None else None
+
+
+def filter_action(rules, file_path):
+    """Return the action of the first rule in ``rules`` matching ``file_path``."""
+    subject, sender, body, date_str, _ = utils.parse_email(file_path)
+    email_text = f"From: {sender}\nSubject: {subject}\nDate: {date_str}\n\n{body}"
+    return rules.match(email_text)
+
+
+def init_worker(actions=None):
+    """``parallel_map`` initializer: compile the rules once per process."""
+    _worker["rules"] = get_compiled_rules(actions)
+
+
+def worker_filter_action(file_path):
+    """``filter_action`` with the rules loaded by ``init_worker``."""
+    return filter_action(_worker["rules"], file_path)
+
+
+def get_compiled_rules(actions=None):
+    """
+    Return ``CompiledRules`` for ``utils.RULES_FILE``, recompiling only when the
+    file's mtime or size has changed since the last call.
+    """
+    try:
+        st = os.stat(utils.RULES_FILE)
+        key = (os.path.abspath(utils.RULES_FILE), st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = None
+    key = (key, frozenset(a.upper() for a in actions) if actions else None)
+    if _cache["key"] != key or _cache["rules"] is None:
+        _cache["rules"] = CompiledRules(utils.load_filter_rules(), actions)
+        _cache["key"] = key
+    return _cache["rules"]
@@ -1,10 +1,9 @@
 
-import time
 from summarize import bulk_summarize_and_process_silent
+from throttle import throttle
 
 # Settings
 emails_per_batch = 5
-sleep_between_batches = 30  # seconds
 max_batches = 10  # or set to None to run indefinitely
 
 def run_batches():
@@ -18,8 +17,10 @@ def run_batches():
             print("✅ Reached maximum batch count. Exiting.")
             break
 
-        print(f"⏳ Sleeping for {sleep_between_batches} seconds...")
-        time.sleep(sleep_between_batches)
+        # Only waits when the last batch found the backend saturated.
+        delay = throttle.pause()
+        if delay:
+            print(f"⏳ Backend saturated; paused {delay:.0f} seconds.")
 
 if __name__ == "__main__":
     run_batches()
@@ -0,0 +1,202 @@
+"""Crash-safe journal for resumable bulk classification runs.
+
+Each bulk run appends JSON lines to its own file under ``RUN_JOURNAL_DIR``,
+and every line is flushed and fsynced before the run moves on:
+
+* ``start``: the inbox being processed;
+* ``classified``: an email's classification result;
+* ``move_pending``: a move is about to happen, with its destination;
+* ``moved``: the move completed;
+* ``finish``: the run completed normally.
+
+A run that dies part-way leaves an unfinished journal. The next run on the
+same inbox picks it up. It reuses the stored classifications instead of
+asking the model again and replays moves that were pending when the process
+died. Replays are idempotent: an email that already left the inbox is just
+marked as moved.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+
+from config import RUN_JOURNAL_DIR, RUN_JOURNAL_KEEP
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if not f.tell():
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def read_events(path):
+    """Return the events in journal ``path``, skipping a torn final line."""
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning(f"Ignoring incomplete journal line in {path}")
+    return events
+
+
+class RunJournal:
+    """Append-only record of one bulk run's classifications and moves."""
+
+    def __init__(self, path, events=()):
+        self.path = path
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        self.inbox = None
+        self.classified = {}
+        self.pending = {}
+        self.moved = set()
+        self.finished = False
+        for event in events:
+            self._apply(event)
+        self.resumed = bool(events)
+        self._fh = None
+
+    def _apply(self, event):
+        kind = event.get("event")
+        email_file = event.get("email_file")
+        if kind == "start":
+            self.inbox = event.get("inbox")
+        elif kind == "classified":
+            self.classified[email_file] = event["result"]
+        elif kind == "move_pending":
+            self.pending[email_file] = event["dest"]
+        elif kind == "moved":
+            self.pending.pop(email_file, None)
+            self.moved.add(email_file)
+        elif kind == "finish":
+            self.finished = True
+
+    def _append(self, event):
+        if self._fh is None:
+            new = not os.path.exists(self.path)
+            torn = not new and not _ends_with_newline(self.path)
+            self._fh = open(self.path, "a", encoding="utf-8")
+            if new:
+                _fsync_dir(os.path.dirname(self.path))
+            elif torn:
+                # Terminate a line cut short by a crash so the next event parses.
+                self._fh.write("\n")
+        event = {"ts": datetime.now().isoformat(timespec="seconds"), **event}
+        self._fh.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._apply(event)
+
+    @classmethod
+    def start(cls, inbox, journal_dir=RUN_JOURNAL_DIR):
+        """Resume the latest unfinished run on ``inbox`` or begin a new one."""
+        os.makedirs(journal_dir, exist_ok=True)
+        for path in reversed(journal_paths(journal_dir)):
+            events = read_events(path)
+            journal = cls(path, events)
+            if journal.inbox == inbox and not journal.finished:
+                return journal
+        prune(journal_dir)
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        journal = cls(os.path.join(journal_dir, f"{run_id}.jsonl"))
+        journal._append({"event": "start", "inbox": inbox})
+        return journal
+
+    def record_classified(self, result):
+        self._append(
+            {
+                "event": "classified",
+                "email_file": result["email_file"],
+                "result": result,
+            }
+        )
+
+    def record_move_pending(self, email_file, dest):
+        self._append({"event": "move_pending", "email_file": email_file, "dest": dest})
+
+    def record_moved(self, email_file, dest):
+        self._append({"event": "moved", "email_file": email_file, "dest": dest})
+
+    def move(self, email_file, dest, move_func):
+        """Journal and perform ``move_func(email_file, dest)``."""
+        self.record_move_pending(email_file, dest)
+        move_func(email_file, dest)
+        self.record_moved(email_file, dest)
+
+    def move_many(self, email_files, dest, move_func):
+        """Journal and perform ``move_func(email_files)`` as one batch.
+
+        ``move_func`` returns the files it actually moved; the others stay
+        pending, so a resumed run tries them again.
+        """
+        for email_file in email_files:
+            self.record_move_pending(email_file, dest)
+        for email_file in move_func(email_files):
+            self.record_moved(email_file, dest)
+
+    def replay_pending(self, move_func):
+        """Finish moves interrupted by a crash and return how many there were.
+
+        Emails no longer in the inbox were moved before the crash and are only
+        marked as done.
+        """
+        replayed = list(self.pending.items())
+        for email_file, dest in replayed:
+            if os.path.exists(os.path.join(self.inbox, email_file)):
+                move_func(email_file, dest)
+            self.record_moved(email_file, dest)
+        return len(replayed)
+
+    def result_for(self, email_file):
+        """Return the stored classification for ``email_file``, if any."""
+        return self.classified.get(email_file)
+
+    def finish(self):
+        self._append({"event": "finish"})
+        self.close()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def journal_paths(journal_dir=RUN_JOURNAL_DIR):
+    """Return journal files in ``journal_dir``, oldest first."""
+    if not os.path.isdir(journal_dir):
+        return []
+    return sorted(
+        os.path.join(journal_dir, name)
+        for name in os.listdir(journal_dir)
+        if name.endswith(".jsonl")
+    )
+
+
+def prune(journal_dir=RUN_JOURNAL_DIR, keep=RUN_JOURNAL_KEEP):
+    """Delete all but the newest ``keep`` finished journals."""
+    finished = [
+        p for p in journal_paths(journal_dir) if RunJournal(p, read_events(p)).finished
+    ]
+    for path in finished[: max(0, len(finished) - keep)]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Could not remove old journal {path}: {e}")
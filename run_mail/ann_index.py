@@ -0,0 +1,444 @@
+"""Approximate nearest-neighbour (IVF-PQ) index over labelled email embeddings.
+
+``KnnIndex`` compares a query with every stored vector and keeps them all in
+RAM as float32, which stops scaling once ``embeddings.jsonl`` holds hundreds
+of thousands of emails. ``AnnIndex`` is an inverted file with product
+quantisation, written with NumPy only:
+
+* a coarse k-means quantiser splits the space into ``nlist`` cells, and every
+  vector is filed under the cell of its nearest centroid;
+* the residual (vector minus centroid) is compressed to ``m`` one-byte codes,
+  one per subspace, each naming the nearest of 256 sub-centroids;
+* a query only visits the ``nprobe`` cells nearest to it. Its similarity to a
+  stored vector is the dot product with the centroid plus ``m`` lookups in a
+  table computed once per query;
+* the best ``refine`` candidates are re-scored exactly against the stored
+  vectors. These are the rows of the ``EmbeddingStore`` the index syncs
+  from, or otherwise a float16 copy kept beside the index. Either is
+  memory-mapped from disk, so only the rows actually read are paged in.
+  Returned similarities are therefore true cosines, and ``KNN_THRESHOLD``
+  keeps its meaning.
+
+In RAM, a vector costs ``m`` bytes (64 by default) instead of 6 KiB for a
+1536-dimensional float32. Until ``train_size`` vectors have been added, the
+index is exact and simply wraps a ``KnnIndex``. Small mailboxes therefore
+keep exact results, and the quantisers are trained on a representative
+sample. Later vectors are encoded with the trained quantisers as they
+arrive.
+
+The trained index is saved with the position in its source that it covers:
+a byte offset into a JSONL file or a record count in a store. A new run
+loads it and only adds the records appended since then.
+"""
+
+import os
+import logging
+
+import numpy as np
+
+from knn_index import KnnIndex, _normalize, records_since, vote
+
+TRAIN_SIZE = 20000
+PQ_M = 64
+NPROBE = 8
+REFINE = 64
+KMEANS_ITERATIONS = 15
+# Vectors sampled from the training set for k-means.
+TRAIN_SAMPLE = 50000
+# Rows per block when assigning vectors to centroids.
+ASSIGN_CHUNK = 4096
+
+
+def _assign(vectors, centroids):
+    """Return the index of the nearest (L2) centroid for each vector."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(vectors), dtype=np.int32)
+    for i in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[i : i + ASSIGN_CHUNK]
+        out[i : i + ASSIGN_CHUNK] = np.argmin(c_sq - 2 * block @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(vectors, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign(vectors, centroids)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        starts = np.searchsorted(assign[order], np.arange(k))
+        filled = counts > 0
+        sums = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        if not filled.all():
+            empty = np.flatnonzero(~filled)
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty))]
+    return centroids
+
+
+def _subspaces(dim, m):
+    """Largest number of equal subspaces ``<= m`` that divides ``dim``."""
+    m = max(1, min(m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def vectors_path(path):
+    """Path of the float16 vector file kept beside the index at ``path``."""
+    return os.path.splitext(path)[0] + ".f16"
+
+
+class _Postings:
+    """Growable ``(ids, codes)`` arrays for one inverted list."""
+
+    def __init__(self, m, ids=None, codes=None):
+        self.ids = ids if ids is not None else np.empty(0, dtype=np.int64)
+        self.codes = codes if codes is not None else np.empty((0, m), dtype=np.uint8)
+        self.size = len(self.ids)
+
+    def append(self, ids, codes):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids), 16)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_codes = np.empty((capacity, self.codes.shape[1]), dtype=np.uint8)
+            grown_ids[: self.size] = self.ids[: self.size]
+            grown_codes[: self.size] = self.codes[: self.size]
+            self.ids, self.codes = grown_ids, grown_codes
+        self.ids[self.size : needed] = ids
+        self.codes[self.size : needed] = codes
+        self.size = needed
+
+
+class _Vectors:
+    """Append-only float16 vectors, in a file (memory-mapped) or in RAM."""
+
+    def __init__(self, dim, path=None, size=0):
+        self.dim = dim
+        self.path = path
+        self.size = size
+        self._rows = np.empty((0, dim), dtype=np.float16)
+        if path is not None:
+            # Rows past ``size`` were written after the last save; they are
+            # re-added from the JSONL, so drop them to keep ids aligned.
+            with open(path, "ab") as f:
+                f.truncate(size * dim * 2)
+
+    def append(self, vectors):
+        data = np.asarray(vectors, dtype=np.float16)
+        if self.path is not None:
+            with open(self.path, "ab") as f:
+                f.write(data.tobytes())
+            self.size += len(data)
+            return
+        needed = self.size + len(data)
+        if needed > len(self._rows):
+            grown = np.empty((max(needed, 2 * len(self._rows)), self.dim), np.float16)
+            grown[: self.size] = self._rows[: self.size]
+            self._rows = grown
+        self._rows[self.size : needed] = data
+        self.size = needed
+
+    def rows(self, ids):
+        if self.path is not None and len(self._rows) != self.size:
+            self._rows = np.memmap(
+                self.path, dtype=np.float16, mode="r", shape=(self.size, self.dim)
+            )
+        return self._rows[ids]
+
+
+class AnnIndex:
+    """IVF-PQ index with the same query interface as ``KnnIndex``."""
+
+    def __init__(
+        self,
+        path=None,
+        train_size=TRAIN_SIZE,
+        nlist=0,
+        m=PQ_M,
+        nprobe=NPROBE,
+        refine=REFINE,
+        store=None,
+    ):
+        self.path = path
+        self.store = store
+        self.train_size = train_size
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.refine = refine
+        self.dim = None
+        self.size = 0
+        self.source_offset = 0
+        self.label_names = []
+        self._label_codes = {}
+        self._labels = np.empty(0, dtype=np.int16)
+        self._exact = KnnIndex()
+        self._vectors = None
+        self.centroids = None
+        self.codebooks = None
+        self._lists = None
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return self.size
+
+    def _encode_labels(self, labels):
+        codes = np.empty(len(labels), dtype=np.int16)
+        for i, label in enumerate(labels):
+            code = self._label_codes.get(label)
+            if code is None:
+                code = self._label_codes[label] = len(self.label_names)
+                self.label_names.append(label)
+            codes[i] = code
+        needed = self.size + len(codes)
+        if needed > len(self._labels):
+            grown = np.empty(max(needed, 2 * len(self._labels)), dtype=np.int16)
+            grown[: self.size] = self._labels[: self.size]
+            self._labels = grown
+        self._labels[self.size : needed] = codes
+
+    def add(self, vector, label):
+        """Append one vector with its label."""
+        self.add_many([vector], [label])
+
+    def add_many(self, vectors, labels):
+        """Append a batch of vectors; trains the quantisers once enough exist."""
+        vectors = _normalize(np.atleast_2d(vectors))
+        if len(vectors) != len(labels):
+            raise ValueError("vectors and labels must have the same length")
+        if not len(vectors):
+            return
+        if self.store is not None and self.size + len(vectors) > len(self.store):
+            raise ValueError("a store-backed index only takes vectors via sync()")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            if self.store is not None:
+                self._vectors = self.store
+            else:
+                path = vectors_path(self.path) if self.path else None
+                self._vectors = _Vectors(self.dim, path)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-dimensional vectors")
+        ids = np.arange(self.size, self.size + len(vectors))
+        self._encode_labels(labels)
+        if self.store is None:
+            self._vectors.append(vectors)
+        self.size += len(vectors)
+        if self.trained:
+            self._file(ids, vectors)
+            return
+        self._exact.add_many(vectors, ids)
+        if self.size >= self.train_size:
+            self.train()
+
+    def train(self):
+        """Train the coarse and product quantisers on the vectors held so far."""
+        vectors = self._exact.matrix
+        rng = np.random.default_rng(0)
+        sample = vectors
+        if len(sample) > TRAIN_SAMPLE:
+            sample = sample[rng.choice(len(sample), TRAIN_SAMPLE, replace=False)]
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        self.m = _subspaces(self.dim, self.m)
+        self.centroids = kmeans(sample, nlist)
+        residuals = sample - self.centroids[_assign(sample, self.centroids)]
+        sub = self.dim // self.m
+        self.codebooks = np.stack(
+            [
+                kmeans(np.ascontiguousarray(residuals[:, j * sub : (j + 1) * sub]), 256)
+                for j in range(self.m)
+            ]
+        )
+        self.nlist = len(self.centroids)
+        self._lists = [_Postings(self.m) for _ in range(self.nlist)]
+        self._file(np.arange(len(vectors)), vectors)
+        self._exact = None
+        logging.info(f"Trained IVF-PQ index: {self.nlist} lists, {self.m} subspaces")
+
+    def _encode(self, residuals):
+        sub = self.dim // self.m
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            block = np.ascontiguousarray(residuals[:, j * sub : (j + 1) * sub])
+            codes[:, j] = _assign(block, self.codebooks[j])
+        return codes
+
+    def _file(self, ids, vectors):
+        cells = _assign(vectors, self.centroids)
+        codes = self._encode(vectors - self.centroids[cells])
+        order = np.argsort(cells, kind="stable")
+        cells, ids, codes = cells[order], ids[order], codes[order]
+        bounds = np.flatnonzero(np.diff(cells)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(cells)]):
+            self._lists[cells[start]].append(ids[start:end], codes[start:end])
+
+    def search(self, query, k=1, nprobe=None):
+        """Return ``(ids, similarities)`` of the ``k`` most similar vectors."""
+        indices, sims = self.search_batch(np.atleast_2d(query), k, nprobe)
+        return indices[0], sims[0]
+
+    def search_batch(self, queries, k=1, nprobe=None):
+        """Approximate top-``k`` search for each row of ``queries``.
+
+        Returns two ``(len(queries), k)`` arrays of ids and cosine
+        similarities, each row ordered best first. Rows are padded with
+        ``-1`` ids when the probed lists hold fewer than ``k`` vectors.
+        """
+        if not self.trained:
+            return self._exact.search_batch(queries, k)
+        queries = _normalize(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        c_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-(coarse - c_sq / 2), nprobe - 1, axis=1)[:, :nprobe]
+        sub = self.dim // self.m
+        # tables[q, j, c]: query q's dot product with sub-centroid c of subspace j
+        tables = np.einsum(
+            "qjd,jcd->qjc", queries.reshape(len(queries), self.m, sub), self.codebooks
+        )
+        columns = np.arange(self.m)
+        shortlist = max(k, self.refine)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        out_sims = np.zeros((len(queries), k), dtype=np.float32)
+        for qi, cells in enumerate(probes):
+            lists = [self._lists[cell] for cell in cells if self._lists[cell].size]
+            if not lists:
+                continue
+            ids = np.concatenate([p.ids[: p.size] for p in lists])
+            codes = np.concatenate([p.codes[: p.size] for p in lists])
+            base = np.repeat(
+                [coarse[qi, cell] for cell in cells if self._lists[cell].size],
+                [p.size for p in lists],
+            )
+            approx = base + tables[qi, columns, codes].sum(axis=1)
+            if len(ids) > shortlist:
+                ids = ids[np.argpartition(-approx, shortlist - 1)[:shortlist]]
+            ids.sort()
+            rows = self._vectors.rows(ids).astype(np.float32)
+            sims = (rows @ queries[qi]) / np.maximum(
+                np.linalg.norm(rows, axis=1), 1e-12
+            )
+            top = min(k, len(ids))
+            best = np.argpartition(-sims, top - 1)[:top]
+            best = best[np.argsort(-sims[best])]
+            out_ids[qi, :top] = ids[best]
+            out_sims[qi, :top] = sims[best]
+        return out_ids, out_sims
+
+    def _names(self, ids):
+        return {i: self.label_names[self._labels[i]] for i in ids if i >= 0}
+
+    def label_for(self, query, k=1, threshold=0.0, nprobe=None):
+        """Similarity-weighted vote of the top-``k`` neighbours at or above
+        ``threshold``; ``None`` when no neighbour is similar enough."""
+        ids, sims = self.search(query, k, nprobe)
+        return vote(self._names(ids), *_found(ids, sims), threshold)
+
+    def labels_for(self, queries, k=1, threshold=0.0, nprobe=None):
+        """``label_for`` for a batch of queries."""
+        ids, sims = self.search_batch(queries, k, nprobe)
+        return [
+            vote(self._names(i), *_found(i, s), threshold) for i, s in zip(ids, sims)
+        ]
+
+    def sync(self, source):
+        """Add the records appended to ``source`` (JSONL path or store) since
+        the last sync."""
+        for vectors, labels, offset in records_since(source, self.source_offset):
+            self.add_many(vectors, labels)
+            self.source_offset = offset
+
+    def save(self):
+        """Write the trained index to its ``path`` atomically.
+
+        Returns ``False`` (writing nothing) while the index is still exact; it
+        is then cheaper to rebuild from the JSONL than to load a copy.
+        """
+        if not self.trained or not self.path:
+            return False
+        lists = self._lists
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                offsets=np.cumsum([0] + [p.size for p in lists]),
+                ids=np.concatenate([p.ids[: p.size] for p in lists]),
+                codes=np.concatenate([p.codes[: p.size] for p in lists]),
+                labels=self._labels[: self.size],
+                label_names=np.array(self.label_names, dtype=str),
+                meta=np.array([self.size, self.source_offset, self.store is not None]),
+            )
+        os.replace(tmp, self.path)
+        return True
+
+    @classmethod
+    def load(cls, path, **params):
+        index = cls(path, **params)
+        with np.load(path) as data:
+            # Indexes saved before the store-backed flag existed lack it (0).
+            meta = [int(v) for v in data["meta"]] + [0]
+            size, source_offset, store_backed = meta[:3]
+            if store_backed != (index.store is not None):
+                raise ValueError("index was built from a different kind of source")
+            index.centroids = data["centroids"]
+            index.codebooks = data["codebooks"]
+            index.nlist, index.dim = index.centroids.shape
+            index.m = len(index.codebooks)
+            offsets, ids, codes = data["offsets"], data["ids"], data["codes"]
+            index._lists = [
+                _Postings(index.m, ids[a:b].copy(), codes[a:b].copy())
+                for a, b in zip(offsets[:-1], offsets[1:])
+            ]
+            index._labels = data["labels"].copy()
+            index.label_names = [str(name) for name in data["label_names"]]
+        index._label_codes = {name: i for i, name in enumerate(index.label_names)}
+        index._exact = None
+        index.size, index.source_offset = size, source_offset
+        if index.store is not None:
+            if len(index.store) < size:
+                raise ValueError("embedding store is shorter than the index")
+            index._vectors = index.store
+            return index
+        if os.path.getsize(vectors_path(path)) < size * index.dim * 2:
+            raise ValueError("vector file is shorter than the index")
+        index._vectors = _Vectors(index.dim, vectors_path(path), size)
+        return index
+
+    @classmethod
+    def open(cls, path, source, **params):
+        """Load the index saved at ``path`` and catch up with ``source``.
+
+        ``source`` is an embeddings JSONL path or an ``EmbeddingStore``. The
+        index is rebuilt from scratch when it is missing, unreadable, or
+        covers more than ``source`` now holds (the source was rewritten).
+        """
+        if not isinstance(source, str):
+            params["store"] = source
+        index = None
+        if os.path.exists(path):
+            try:
+                index = cls.load(path, **params)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Rebuilding unreadable ANN index {path}: {e}")
+        if not isinstance(source, str):
+            source_size = len(source)
+        else:
+            source_size = os.path.getsize(source) if os.path.exists(source) else 0
+        if index is None or index.source_offset > source_size:
+            index = cls(path, **params)
+        index.sync(source)
+        return index
+
+
+def _found(ids, sims):
+    keep = ids >= 0
+    return ids[keep], sims[keep]
@@ -0,0 +1,257 @@
+"""Columnar, append-only store for labelled email embeddings.
+
+``embeddings.jsonl`` kept each email's subject, body and vector (as a JSON
+float list) on one line, and every start re-parsed all of it. The store
+splits a record into columns under one directory:
+
+* ``vectors.f16`` or ``vectors.i8``: fixed-width rows, memory-mapped for
+  reading. ``int8`` rows are scaled per vector, with the scales kept in
+  ``scales.f32``;
+* ``labels.u8``: one label code per record. ``header.json`` maps codes to
+  label names and records the dimension and vector type;
+* ``meta.jsonl`` with ``meta.idx``: subject, body and timestamp as JSON lines,
+  plus the byte offset where each record's line starts, so one record's
+  metadata is one seek away and is never parsed at load time.
+
+Appends write the vectors, metadata and offsets first and the label byte
+last. The number of label bytes is therefore the record count, and on open
+anything written past it by an interrupted append is cut off.
+``migrate_jsonl`` converts an existing ``embeddings.jsonl`` in one pass.
+"""
+
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+
+HEADER_VERSION = 1
+DTYPES = ("float16", "int8")
+# Records buffered per append while migrating a JSONL file.
+MIGRATE_CHUNK = 10000
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _truncate(path, size):
+    if _size(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+class EmbeddingStore:
+    """Memory-mapped vector, label and metadata columns in one directory."""
+
+    def __init__(self, path, dim, dtype="float16", label_names=()):
+        if dtype not in DTYPES:
+            raise ValueError(f"unsupported vector type {dtype!r}")
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.label_names = list(label_names)
+        self._label_codes = {name: i for i, name in enumerate(self.label_names)}
+        self._vectors = None
+        self._scales = None
+        self.size = _size(self._file("labels.u8"))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def _vector_file(self):
+        return self._file("vectors.f16" if self.dtype == "float16" else "vectors.i8")
+
+    @property
+    def _row_bytes(self):
+        return self.dim * (2 if self.dtype == "float16" else 1)
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def open(cls, path, dtype="float16"):
+        """Open the store at ``path``, creating an empty one if it is missing.
+
+        ``dtype`` only applies to a new store; an existing store keeps the
+        type it was created with.
+        """
+        header = os.path.join(path, "header.json")
+        if not os.path.exists(header):
+            os.makedirs(path, exist_ok=True)
+            return cls(path, None, dtype)
+        with open(header, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") != HEADER_VERSION:
+            raise ValueError(f"unsupported embedding store version in {path}")
+        store = cls(path, info["dim"], info["dtype"], info["labels"])
+        store._repair()
+        return store
+
+    def _write_header(self):
+        tmp = self._file("header.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": HEADER_VERSION,
+                    "dim": self.dim,
+                    "dtype": self.dtype,
+                    "labels": self.label_names,
+                },
+                f,
+            )
+        os.replace(tmp, self._file("header.json"))
+
+    def _repair(self):
+        """Cut columns back to ``size`` records after an interrupted append."""
+        n = self.size
+        _truncate(self._vector_file, n * self._row_bytes)
+        _truncate(self._file("scales.f32"), n * 4)
+        index = self._file("meta.idx")
+        if _size(index) > n * 8:
+            end = int(np.fromfile(index, dtype=np.uint64, count=1, offset=n * 8)[0])
+            _truncate(self._file("meta.jsonl"), end)
+            _truncate(index, n * 8)
+
+    def _encode_labels(self, labels):
+        codes = bytearray()
+        for label in labels:
+            code = self._label_codes.get(label)
+            if code is None:
+                if len(self.label_names) >= 255:
+                    raise ValueError("embedding store supports at most 255 labels")
+                code = self._label_codes[label] = len(self.label_names)
+                self.label_names.append(label)
+                self._write_header()
+            codes.append(code)
+        return bytes(codes)
+
+    def append(self, vectors, labels, metadata=None):
+        """Append records; ``metadata`` is a list of JSON-serialisable dicts."""
+        if not len(labels):
+            return
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if len(vectors) != len(labels):
+            raise ValueError("vectors and labels must have the same length")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._write_header()
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-dimensional vectors")
+        metadata = metadata or [{} for _ in labels]
+
+        if self.dtype == "float16":
+            rows = vectors.astype(np.float16)
+        else:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            rows = np.round(vectors / scales[:, None]).astype(np.int8)
+            with open(self._file("scales.f32"), "ab") as f:
+                f.write(scales.astype(np.float32).tobytes())
+        with open(self._vector_file, "ab") as f:
+            f.write(rows.tobytes())
+
+        with open(self._file("meta.jsonl"), "ab") as f:
+            offset = f.tell()
+            starts = []
+            for meta in metadata:
+                line = (json.dumps(meta, ensure_ascii=False) + "\n").encode("utf-8")
+                starts.append(offset)
+                f.write(line)
+                offset += len(line)
+        with open(self._file("meta.idx"), "ab") as f:
+            f.write(np.asarray(starts, dtype=np.uint64).tobytes())
+
+        codes = self._encode_labels(labels)
+        with open(self._file("labels.u8"), "ab") as f:
+            f.write(codes)
+        self.size += len(codes)
+
+    def append_one(self, vector, label, metadata=None):
+        self.append([vector], [label], [metadata or {}])
+
+    def _maps(self):
+        if self._vectors is None or len(self._vectors) != self.size:
+            np_dtype = np.float16 if self.dtype == "float16" else np.int8
+            self._vectors = np.memmap(
+                self._vector_file, dtype=np_dtype, mode="r", shape=(self.size, self.dim)
+            )
+            if self.dtype == "int8":
+                self._scales = np.memmap(
+                    self._file("scales.f32"), dtype=np.float32, mode="r"
+                )[: self.size]
+        return self._vectors, self._scales
+
+    def rows(self, ids):
+        """Return the vectors of records ``ids`` (an index or slice) as float32."""
+        if not self.size:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        vectors, scales = self._maps()
+        rows = vectors[ids].astype(np.float32)
+        if scales is not None:
+            rows *= scales[ids][..., None]
+        return rows
+
+    def labels(self, start=0, stop=None):
+        """Return the label names of records ``start`` to ``stop``."""
+        stop = self.size if stop is None else min(stop, self.size)
+        if start >= stop:
+            return []
+        codes = np.fromfile(
+            self._file("labels.u8"), dtype=np.uint8, count=stop - start, offset=start
+        )
+        return [self.label_names[code] for code in codes]
+
+    def metadata(self, i):
+        """Return the metadata dict stored with record ``i``."""
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        start = np.fromfile(
+            self._file("meta.idx"), dtype=np.uint64, count=1, offset=i * 8
+        )
+        with open(self._file("meta.jsonl"), "rb") as f:
+            f.seek(int(start[0]))
+            return json.loads(f.readline())
+
+    def read_records(self, offset=0, chunk=MIGRATE_CHUNK):
+        """Yield ``(vectors, labels, end)`` batches from record ``offset`` on.
+
+        Mirrors ``knn_index.read_records`` with record counts as offsets, so
+        an index can ``sync`` from a store as it does from a JSONL file.
+        """
+        for start in range(offset, self.size, chunk):
+            end = min(start + chunk, self.size)
+            yield self.rows(slice(start, end)), self.labels(start, end), end
+
+
+def migrate_jsonl(jsonl_path, store_path, dtype="float16"):
+    """Convert an ``embeddings.jsonl`` file into a new store at ``store_path``.
+
+    The store is built in a temporary directory and moved into place when
+    complete, so an interrupted migration leaves no partial store behind.
+    Returns the number of records migrated.
+    """
+    tmp = store_path + ".migrating"
+    shutil.rmtree(tmp, ignore_errors=True)
+    store = EmbeddingStore.open(tmp, dtype)
+    vectors, labels, metadata = [], [], []
+    with open(jsonl_path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping unreadable line in {jsonl_path}")
+                continue
+            vectors.append(record.pop("emb"))
+            labels.append(record.pop("label"))
+            metadata.append(record)
+            if len(vectors) >= MIGRATE_CHUNK:
+                store.append(vectors, labels, metadata)
+                vectors, labels, metadata = [], [], []
+    store.append(vectors, labels, metadata)
+    os.replace(tmp, store_path)
+    return len(store)
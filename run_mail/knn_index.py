@@ -0,0 +1,201 @@
+"""In-memory k-nearest-neighbour index over labelled email embeddings.
+
+All vectors live in one float32 matrix whose rows are normalised once, when
+they are added, so cosine similarity against every stored email is a single
+matrix-vector product (matrix-matrix for a batch of queries). Labels are kept
+in a parallel array. The matrix grows geometrically, so ``add`` appends in
+place without copying the whole index on every new email.
+"""
+
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+INITIAL_CAPACITY = 1024
+# Records parsed from an embeddings JSONL file before they are added at once.
+READ_CHUNK = 10000
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def read_records(path, offset=0, chunk=READ_CHUNK):
+    """Yield ``(vectors, labels, end_offset)`` batches of JSONL records.
+
+    Reading starts at byte ``offset``; ``end_offset`` is where the batch's
+    last complete line ends, so a later call can continue from there. A
+    final line without a newline is still being written and is left alone.
+    """
+    vectors, labels = [], []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            vectors.append(record["emb"])
+            labels.append(record["label"])
+            if len(vectors) >= chunk:
+                yield vectors, labels, offset
+                vectors, labels = [], []
+    if vectors:
+        yield vectors, labels, offset
+
+
+def records_since(source, offset):
+    """``read_records`` for a JSONL path, or the equivalent of an ``EmbeddingStore``.
+
+    JSONL offsets are byte positions; store offsets are record counts.
+    """
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            return iter(())
+        return read_records(source, offset)
+    return source.read_records(offset)
+
+
+def vote(labels, indices, sims, threshold):
+    """Similarity-weighted label vote among neighbours at or above ``threshold``."""
+    scores = defaultdict(float)
+    for i, sim in zip(indices, sims):
+        if sim >= threshold:
+            scores[labels[i]] += float(sim)
+    return max(scores, key=scores.get) if scores else None
+
+
+class KnnIndex:
+    """Labelled, pre-normalised embedding matrix with cosine top-k queries."""
+
+    def __init__(self, dim=None, capacity=INITIAL_CAPACITY):
+        self.dim = dim
+        self.size = 0
+        self._capacity = capacity
+        self._matrix = None
+        self._labels = None
+        self.source_offset = 0
+        if dim is not None:
+            self._allocate(dim, capacity)
+
+    def _allocate(self, dim, capacity):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._labels = np.empty(capacity, dtype=object)
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self._matrix):
+            return
+        capacity = max(needed, 2 * len(self._matrix))
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[: self.size] = self._matrix[: self.size]
+        labels = np.empty(capacity, dtype=object)
+        labels[: self.size] = self._labels[: self.size]
+        self._matrix, self._labels = matrix, labels
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def matrix(self):
+        """The normalised vectors currently stored (a view, not a copy)."""
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self._matrix[: self.size]
+
+    @property
+    def labels(self):
+        if self._labels is None:
+            return np.empty(0, dtype=object)
+        return self._labels[: self.size]
+
+    def add(self, vector, label):
+        """Append one vector with its label."""
+        self.add_many([vector], [label])
+
+    def add_many(self, vectors, labels):
+        """Append a batch of vectors with their labels."""
+        vectors = _normalize(np.atleast_2d(vectors))
+        if len(vectors) != len(labels):
+            raise ValueError("vectors and labels must have the same length")
+        if not len(vectors):
+            return
+        if self._matrix is None:
+            self._allocate(vectors.shape[1], max(self._capacity, len(vectors)))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-dimensional vectors")
+        self._reserve(len(vectors))
+        self._matrix[self.size : self.size + len(vectors)] = vectors
+        self._labels[self.size : self.size + len(vectors)] = list(labels)
+        self.size += len(vectors)
+
+    def search(self, query, k=1):
+        """Return ``(indices, similarities)`` of the ``k`` most similar vectors."""
+        indices, sims = self.search_batch(np.atleast_2d(query), k)
+        return indices[0], sims[0]
+
+    def search_batch(self, queries, k=1):
+        """Top-``k`` search for each row of ``queries`` with one matrix product.
+
+        Returns two ``(len(queries), k)`` arrays of indices and cosine
+        similarities, each row ordered best first.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        k = min(k, self.size)
+        if not k:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.intp), empty.astype(np.float32)
+        sims = queries @ self.matrix.T
+        if k < self.size:
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(self.size), (len(queries), self.size))
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        return (
+            np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(top_sims, order, axis=1),
+        )
+
+    def label_for(self, query, k=1, threshold=0.0):
+        """Similarity-weighted vote of the top-``k`` neighbours at or above
+        ``threshold``; ``None`` when no neighbour is similar enough."""
+        indices, sims = self.search(query, k)
+        return vote(self._labels, indices, sims, threshold)
+
+    def labels_for(self, queries, k=1, threshold=0.0):
+        """``label_for`` for a batch of queries."""
+        indices, sims = self.search_batch(queries, k)
+        return [vote(self._labels, i, s, threshold) for i, s in zip(indices, sims)]
+
+    def sync(self, source):
+        """Add the records appended to ``source`` since the last sync.
+
+        ``source`` is an embeddings JSONL path or an ``EmbeddingStore``. Only
+        the vector and label of each record are kept in memory.
+        """
+        if not isinstance(source, str):
+            # A store knows its size, so the matrix is allocated once.
+            pending = len(source) - self.source_offset
+            if self._matrix is None:
+                self._capacity = max(self._capacity, pending)
+            elif pending > 0:
+                self._reserve(pending)
+        for vectors, labels, offset in records_since(source, self.source_offset):
+            self.add_many(vectors, labels)
+            self.source_offset = offset
+
+    @classmethod
+    def from_jsonl(cls, path):
+        """Build an index from an embeddings JSONL file of ``emb``/``label`` records."""
+        index = cls()
+        index.sync(path)
+        return index
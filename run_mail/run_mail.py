@@ -7,7 +7,6 @@ responses. It can operate against a local OpenAI-compatible API when
 """
 
 import datetime
-import json
 import os
 import shutil
 import subprocess
@@ -16,22 +15,38 @@ from email.parser import BytesParser
 from email.policy import default
 from glob import glob
 
-import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
 from config import LOCAL_AI_BASE_URL
+from batch_embedder import BatchEmbedder, client_embedder
+from embedding_cache import embedding_cache
+from ann_index import AnnIndex, vectors_path
+from embedding_store import EmbeddingStore, migrate_jsonl
+from knn_index import KnnIndex
 
 # ─── load config ───────────────────────────────────────────────────────────────
 load_dotenv()
 MAILDIR = os.getenv("MAILDIR_ROOT", os.path.expanduser("~/.mail/Gmail"))
 REPORT_PATH = os.getenv("REPORT_PATH", "/reports/email_report.md")
+# Legacy JSONL embeddings, migrated once into the columnar EMB_STORE
 EMB_FILE = os.getenv("EMB_FILE", "/data/embeddings.jsonl")
+EMB_STORE = os.getenv("EMB_STORE", os.path.splitext(EMB_FILE)[0] + ".store")
+# Vector type of a new store: float16 or int8 (per-vector scaled)
+EMB_DTYPE = os.getenv("EMB_DTYPE", "float16")
 API_KEY = os.getenv("OPENAI_API_KEY", "")
 THRESH_SIM = float(os.getenv("KNN_THRESHOLD", "0.80"))
 
-openai.api_key = API_KEY
-if LOCAL_AI_BASE_URL:
-    openai.api_base = LOCAL_AI_BASE_URL
+KNN_K = int(os.getenv("KNN_K", "1"))
+# "ann": IVF-PQ index saved next to EMB_STORE (exact until it holds enough
+# vectors to train); "exact": brute-force search over all vectors in RAM
+KNN_INDEX = os.getenv("KNN_INDEX", "ann").lower()
+ANN_FILE = os.getenv("ANN_FILE", os.path.splitext(EMB_FILE)[0] + ".ann.npz")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+EMBED_MODEL = "text-embedding-3-small"
+
+client = OpenAI(
+    api_key=API_KEY, base_url=f"{LOCAL_AI_BASE_URL}/v1" if LOCAL_AI_BASE_URL else None
+)
 
 # ─── maildirs ────────────────────────────────────────────────────────────────
 dirs = dict(
@@ -47,61 +62,81 @@ for d in dirs.values():
 
 
 # ─── embedding utils ──────────────────────────────────────────────────────────
+# Batches the texts of process_folder into single embedding requests and serves
+# texts embedded before from the persistent embedding cache.
+embedder = BatchEmbedder(client_embedder(client, EMBED_MODEL), model=EMBED_MODEL)
+
+
 def embed_text(text: str) -> list:
-    """Return an embedding vector for the given text."""
+    """Return an embedding vector for the given text (``None`` on failure)."""
+
+    return embedder.embed_texts([text])[0]
+
 
-    resp = client.embeddings.create(model="text-embedding-3-small", input=text)
-    return resp.data[0].embedding
+def email_text(subject, body):
+    return subject + "\n\n" + body
+
+
+def open_store():
+    """Open the embedding store, migrating ``EMB_FILE`` into it on first use."""
+    if os.path.exists(EMB_FILE) and not os.path.exists(
+        os.path.join(EMB_STORE, "header.json")
+    ):
+        count = migrate_jsonl(EMB_FILE, EMB_STORE, EMB_DTYPE)
+        os.replace(EMB_FILE, EMB_FILE + ".migrated")
+        # An ANN index built from the JSONL kept its own vector copy.
+        if os.path.exists(vectors_path(ANN_FILE)):
+            os.remove(vectors_path(ANN_FILE))
+        print(f"Migrated {count} embeddings from {EMB_FILE} to {EMB_STORE}")
+    return EmbeddingStore.open(EMB_STORE, EMB_DTYPE)
 
 
 def load_embeddings():
-    embs = []
-    if os.path.exists(EMB_FILE):
-        for line in open(EMB_FILE):
-            embs.append(json.loads(line))
-    return embs
-
-
-def save_embedding(subject, body, label):
-    record = dict(
-        subject=subject,
-        body=body,
-        label=label,
-        emb=embed_text(subject + "\n\n" + body),
-        ts=datetime.datetime.utcnow().isoformat(),
-    )
-    with open(EMB_FILE, "a") as f:
-        f.write(json.dumps(record) + "\n")
+    """Load stored embeddings into the configured k-NN index."""
+    if KNN_INDEX == "exact":
+        index = KnnIndex()
+        index.sync(store)
+        return index
+    return AnnIndex.open(ANN_FILE, store, nprobe=ANN_NPROBE)
+
+
+def save_index():
+    if KNN_INDEX != "exact":
+        embs_db.save()
+
 
+def save_embedding(subject, body, label, index=None, emb=None):
+    """Append a labelled embedding; ``emb`` skips re-embedding a known vector."""
+    if emb is None:
+        emb = embed_text(email_text(subject, body))
+        if emb is None:
+            return
+    meta = dict(subject=subject, body=body, ts=datetime.datetime.utcnow().isoformat())
+    store.append_one(emb, label, meta)
+    if index is not None:
+        index.sync(store)
 
-def knn_label(subject, body, embs):
-    if not embs:
+
+def knn_label(subject, body, index, emb=None):
+    if not len(index):
         return None
-    query = np.array(embed_text(subject + "\n\n" + body))
-    sims = [
-        (
-            e["label"],
-            float(
-                np.dot(query, e["emb"])
-                / (np.linalg.norm(query) * np.linalg.norm(e["emb"]))
-            ),
-        )
-        for e in embs
-    ]
-    best_label, best_sim = max(sims, key=lambda x: x[1])
-    return best_label if best_sim >= THRESH_SIM else None
+    query = emb if emb is not None else embed_text(email_text(subject, body))
+    if query is None:
+        return None
+    return index.label_for(query, k=KNN_K, threshold=THRESH_SIM)
 
 
 # ─── classification & reply ──────────────────────────────────────────────────
 counts = {"JUNK": 0, "REVIEW": 0, "REPLY": 0}
+store = open_store()
 embs_db = load_embeddings()
 
 
-def classify_email(subject: str, body: str) -> str:
+def classify_email(subject: str, body: str, emb=None) -> str:
     """Classify an email as JUNK, REVIEW, or REPLY."""
 
     # 1) try k-NN
-    label = knn_label(subject, body, embs_db)
+    label = knn_label(subject, body, embs_db, emb)
     if label:
         return label
     # 2) fallback to LLM
@@ -134,10 +169,11 @@ def draft_reply(subject: str, body: str) -> str:
 
 
 # ─── processing loop ─────────────────────────────────────────────────────────
-def process_folder(src):
+def parse_folder(src):
+    """Yield ``((path, msg, subject, body), text)`` for each email in ``src``."""
     for sub in ("new", "cur"):
         for path in glob(os.path.join(src, sub, "*")):
-            # parse email
+            msg = None
             try:
                 msg = BytesParser(policy=default).parse(open(path, "rb"))
                 subj = msg.get("subject", "")
@@ -145,26 +181,36 @@ def process_folder(src):
                 body = part.get_content() if part else ""
             except:
                 subj, body = "", ""
-            label = classify_email(subj, body)
-            counts[label] += 1
+            yield (path, msg, subj, body), email_text(subj, body)
+
+
+def process_folder(src):
+    # emails are embedded a batch at a time; each vector serves both the
+    # k-NN lookup and the stored record
+    for (path, msg, subj, body), emb in embedder.embed(parse_folder(src)):
+        label = classify_email(subj, body, emb)
+        counts[label] += 1
 
-            # record embedding
-            save_embedding(subj, body, label)
+        # record embedding
+        if emb is not None:
+            save_embedding(subj, body, label, embs_db, emb)
 
-            # move
-            dest = {"JUNK": "TRASH", "REVIEW": "IMPORTANT", "REPLY": "OUTBOX"}[label]
-            dst = os.path.join(dirs[dest], "cur", os.path.basename(path))
-            shutil.move(path, dst)
+        # move
+        dest = {"JUNK": "TRASH", "REVIEW": "IMPORTANT", "REPLY": "OUTBOX"}[label]
+        dst = os.path.join(dirs[dest], "cur", os.path.basename(path))
+        shutil.move(path, dst)
 
-            # generate reply
-            if label == "REPLY":
-                dr = draft_reply(subj, body)
-                with open(dst.replace(".eml", ".reply.txt"), "w") as f:
-                    f.write(f"To: {msg.get('from')}\nSubject: Re: {subj}\n\n{dr}")
+        # generate reply
+        if label == "REPLY":
+            dr = draft_reply(subj, body)
+            sender = msg.get("from") if msg is not None else ""
+            with open(dst.replace(".eml", ".reply.txt"), "w") as f:
+                f.write(f"To: {sender}\nSubject: Re: {subj}\n\n{dr}")
 
 
 # ─── interactive training mode ───────────────────────────────────────────────
-def train_mode():
+def label_inbox():
+    """Yield ``(path, subject, body, label)`` for each email labelled by hand."""
     # pick unembedded emails in Inbox/cur:
     for path in glob(os.path.join(dirs["INBOX"], "cur", "*")):
         msg = BytesParser(policy=default).parse(open(path, "rb"))
@@ -189,7 +235,16 @@ def train_mode():
             .strip()
         )
         if choice in ("JUNK", "REVIEW", "REPLY"):
-            save_embedding(subj, body, choice)
+            yield path, subj, body, choice
+
+
+def train_mode():
+    # each label is embedded and saved as soon as it is given, so stopping
+    # midway loses no answer (a batch would hold up to EMBED_BATCH_SIZE unsaved)
+    for path, subj, body, choice in label_inbox():
+        emb = embed_text(email_text(subj, body))
+        if emb is not None:
+            save_embedding(subj, body, choice, embs_db, emb)
             os.remove(path)
 
 
@@ -198,11 +253,20 @@ if __name__ == "__main__":
     mode = sys.argv[1] if len(sys.argv) > 1 else "run"
     if mode == "train":
         train_mode()
+        save_index()
         sys.exit(0)
     process_folder(dirs["INBOX"])
+    save_index()
     today = datetime.date.today().isoformat()
     with open(REPORT_PATH, "w") as r:
         r.write(f"# Email Summary – {today}\n\n")
         for k in counts:
             r.write(f"- **{k}**: {counts[k]}\n")
+        cache = embedding_cache.stats()
+        r.write(
+            f"\nEmbedding cache: {cache['hits']} hits, {cache['misses']} misses "
+            f"({cache['hit_rate']:.0%} hit rate)\n"
+        )
+    print(embedder.report())
+    print(embedding_cache.report())
     sys.exit(0)
@@ -3,7 +3,7 @@ import os
 import re
 from datetime import datetime
 import subprocess
-from utils import parse_email
+from mail_index import scan_maildir
 from config import MAIN_INBOX, IMPORTANT_DIR
 
 def search_emails(keyword):
@@ -27,10 +27,7 @@ def search_emails(keyword):
     for mailbox_name, mailbox_path in mailboxes:
         if not os.path.exists(mailbox_path):
             continue
-        email_files = [f for f in os.listdir(mailbox_path) if os.path.isfile(os.path.join(mailbox_path, f))]
-        for email_file in email_files:
-            file_path = os.path.join(mailbox_path, email_file)
-            subject, sender, _, date_str, date_obj = parse_email(file_path)
+        for email_file, subject, sender, date_str, date_obj in scan_maildir(mailbox_path):
             if filter_by_date:
                 if date_obj is None:
                     continue
@@ -8,7 +8,7 @@ import time as systime
 import json.decoder
 from summarize import bulk_summarize_and_process_silent
 from config import MAIN_INBOX
-from utils import parse_email
+from mail_index import scan_maildir
 
 summary_file_path = os.path.expanduser("~/.cache/email_summary_log.json")
 status_path = os.path.expanduser("~/Projects/GPTMail/email_status.json")
@@ -46,13 +46,7 @@ def start_icon_animation(stop_event):
 def generate_email_snapshot():
     summary = []
     try:
-        email_files = [
-            f
-            for f in os.listdir(MAIN_INBOX)
-            if os.path.isfile(os.path.join(MAIN_INBOX, f))
-        ]
-        for f in email_files:
-            subject, sender, _, date_str, _ = parse_email(os.path.join(MAIN_INBOX, f))
+        for f, subject, sender, date_str, _ in scan_maildir(MAIN_INBOX):
             summary.append(
                 {"file": f, "subject": subject, "sender": sender, "date": date_str}
             )
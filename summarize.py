@@ -4,28 +4,52 @@ import os
 import shutil
 import json
 import time
-import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from rich.console import Console
 from rich.table import Table
 from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
 from rich.text import Text
-from prompt_setup import get_summary_prompt, get_action_prompt
+from prompt_setup import (
+    ACTION_PATTERN,
+    get_summary_prompt,
+    get_action_prompt,
+    get_classification_prompt,
+)
 from utils import (
     parse_email,
     send_notification,
     fuzzy_select_email,
-    load_filter_rules,
-    matches_filter_rule,
-    move_message_to_trash_via_imap,
+    move_messages_to_trash_via_imap,
+)
+from rule_engine import get_compiled_rules, init_worker, worker_filter_action
+from parallel_scan import parallel_map
+from gpt_api import ask_gpt, get_active_model, max_concurrency
+from throttle import throttle
+from run_journal import RunJournal
+from llm_cache import response_cache
+from mail_index import scan_maildir
+from dedupe import cluster_emails
+from config import (
+    MAIN_INBOX,
+    ARCHIVE_DIR,
+    FOLLOWUP_DIR,
+    TRASH_DIR,
+    CLASSIFY_MODE,
+    USE_DEDUP,
+    DEDUP_SIMILARITY,
+    DEDUP_DELETE_MEMBERS,
+    USE_LOCAL_LLM,
 )
-from gpt_api import ask_gpt, get_active_model
-from config import MAIN_INBOX, ARCHIVE_DIR, FOLLOWUP_DIR, TRASH_DIR
 from draft_reply import generate_draft_reply
 
 console = Console()
 STATS_FILE = os.path.expanduser("~/Projects/GPTMail/email_batch_stats.json")
+VALID_ACTIONS = ("ARCHIVE", "DELETE", "REPLY", "REVIEW")
+# Actions a filter rule may take, and the folder each action files mail into
+FILTER_ACTIONS = ("DELETE", "ARCHIVE", "REVIEW")
+ACTION_DIRS = {"ARCHIVE": ARCHIVE_DIR, "DELETE": TRASH_DIR, "REVIEW": FOLLOWUP_DIR}
 
 
 def stylize_console(message, style="green"):
@@ -39,18 +63,8 @@ def summarize_all_unread_emails():
     bulk_summarize_and_process_silent()
 
 
-def summarize_specific_email(email_file=None, silent=False):
-    if email_file is None:
-        stylize_console("No email file specified.", "red")
-        return None
-
-    file_path = os.path.join(MAIN_INBOX, email_file)
-    if not os.path.exists(file_path):
-        stylize_console(f"Error: File '{email_file}' not found in {MAIN_INBOX}.", "red")
-        return None
-
-    subject, sender, body, date_str, _ = parse_email(file_path)
-
+def _two_step_classification(sender, date_str, subject, body):
+    """Summarize the email, then ask for an action based on the summary."""
     summary_prompt = get_summary_prompt(sender, date_str, subject, body)
 
     raw_match = re.search(
@@ -97,7 +111,7 @@ def summarize_specific_email(email_file=None, silent=False):
     action_prompt = get_action_prompt(summary_content)
     console.print(Panel(Text(action_prompt), title="🟡 Action Prompt", style="yellow"))
 
-    action_response = ask_gpt(action_prompt)
+    action_response = ask_gpt(action_prompt, stop=ACTION_PATTERN)
     action_text = (
         action_response.get("choices", [{}])[0].get("message", {}).get("content")
         or action_response.get("text")
@@ -113,9 +127,7 @@ def summarize_specific_email(email_file=None, silent=False):
     )
 
     used_model = action_response.get("model", used_model)
-    match = re.search(
-        r"ACTION:\s*(ARCHIVE|DELETE|REPLY|REVIEW)", action_text, re.IGNORECASE
-    )
+    match = ACTION_PATTERN.search(action_text)
     recommended_action = (
         match.group(1).upper()
         if match
@@ -129,6 +141,108 @@ def summarize_specific_email(email_file=None, silent=False):
         )
     )
 
+    return {
+        "summary": summary_content,
+        "action_text": action_text,
+        "recommended_action": recommended_action,
+        "model": used_model,
+        "confidence": None,
+    }
+
+
+def parse_structured_classification(text):
+    """
+    Strictly parse a ``{summary, action, confidence}`` JSON reply.
+
+    Returns a dict with the upper-cased action, or ``None`` when the reply is
+    not a JSON object of that exact shape.
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or set(data) != {"summary", "action", "confidence"}:
+        return None
+    summary, action, confidence = data["summary"], data["action"], data["confidence"]
+    if not isinstance(summary, str) or not isinstance(action, str):
+        return None
+    action = action.strip().upper()
+    if action.startswith("ACTION:"):
+        action = action[len("ACTION:") :].strip()
+    if action not in VALID_ACTIONS:
+        return None
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return None
+    if not 0 <= confidence <= 1:
+        return None
+    return {"summary": summary.strip(), "action": action, "confidence": confidence}
+
+
+def _structured_classification(sender, date_str, subject, body):
+    """Classify with a single JSON-constrained request; ``None`` if unusable."""
+    prompt = get_classification_prompt(sender, date_str, subject, body)
+    console.print(
+        Panel(
+            Text(prompt),
+            title="🧠 [bold blue]Structured Classification Prompt[/bold blue]",
+            style="blue",
+        )
+    )
+    response = ask_gpt(prompt, json_mode=True) or {}
+    raw_text = (response.get("text") or "").strip()
+    parsed = parse_structured_classification(raw_text)
+    if parsed is None:
+        stylize_console(
+            "Structured reply was not valid JSON; falling back to two-step flow.",
+            "yellow",
+        )
+        return None
+    console.print(
+        Panel(
+            Text(f"{parsed['summary']}\n\nconfidence: {parsed['confidence']:.2f}"),
+            title="🤖 [bold green]GPT Structured Response[/bold green]",
+            style="green",
+        )
+    )
+    return {
+        "summary": parsed["summary"],
+        "action_text": raw_text,
+        "recommended_action": parsed["action"],
+        "model": response.get("model", "unknown"),
+        "confidence": parsed["confidence"],
+    }
+
+
+def summarize_specific_email(email_file=None, silent=False, mode=None):
+    """
+    Classify one inbox email and, unless ``silent``, act on the result.
+
+    ``mode`` is ``"two-step"`` (summary prompt, then action prompt) or
+    ``"structured"`` (one JSON reply, falling back to two-step when the reply
+    is invalid); it defaults to ``CLASSIFY_MODE``.
+    """
+    if email_file is None:
+        stylize_console("No email file specified.", "red")
+        return None
+
+    file_path = os.path.join(MAIN_INBOX, email_file)
+    if not os.path.exists(file_path):
+        stylize_console(f"Error: File '{email_file}' not found in {MAIN_INBOX}.", "red")
+        return None
+
+    subject, sender, body, date_str, _ = parse_email(file_path)
+
+    mode = mode or CLASSIFY_MODE
+    classification = None
+    if mode == "structured":
+        classification = _structured_classification(sender, date_str, subject, body)
+    if classification is None:
+        classification = _two_step_classification(sender, date_str, subject, body)
+    summary_content = classification["summary"]
+    action_text = classification["action_text"]
+    recommended_action = classification["recommended_action"]
+    used_model = classification["model"]
+
     console.print(
         Panel(
             Text(f"{recommended_action}"),
@@ -181,6 +295,8 @@ def summarize_specific_email(email_file=None, silent=False):
         "recommended_action": recommended_action,
         "action_text": action_text,
         "model": used_model,
+        "confidence": classification["confidence"],
+        "mode": mode,
     }
 
 
@@ -224,11 +340,7 @@ def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
 
         if confirm_all or Confirm.ask("Execute ALL recommended actions?", default=True):
             for r in batch_results:
-                dest = {
-                    "ARCHIVE": ARCHIVE_DIR,
-                    "DELETE": TRASH_DIR,
-                    "REVIEW": FOLLOWUP_DIR,
-                }.get(r["recommended_action"])
+                dest = ACTION_DIRS.get(r["recommended_action"])
                 if dest:
                     move_email_with_category(r["email_file"], dest)
                 else:
@@ -252,9 +364,11 @@ def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
             f"Avg for {model} over {len(stats[model])} runs: {avg:.2f}s", "bold cyan"
         )
 
+        throttle.adjust()
         if batch_idx < len(batches):
-            stylize_console("Pausing 20–30 seconds before next batch…", "blue")
-            time.sleep(random.uniform(20, 30))
+            delay = throttle.pause()
+            if delay:
+                stylize_console(f"Backend saturated; paused {delay:.0f}s.", "blue")
 
     stylize_console(
         f"\nProcessed {len(emails)} emails in {len(batches)} batches. Total time: {total_time:.2f}s",
@@ -263,21 +377,43 @@ def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
 
 
 def move_to_trash_via_maildir(email_file):
-    src = os.path.join(MAIN_INBOX, email_file)
-    if not os.path.exists(src):
-        stylize_console(f"Source not found: {src}", "red")
-        return
-    if not move_message_to_trash_via_imap(src):
-        stylize_console(
-            f"IMAP deletion failed for {email_file}; skipping local move.", "red"
-        )
-        return
+    move_emails_to_trash([email_file])
+
+
+def move_emails_to_trash(email_files):
+    """Trash ``email_files`` on the server in one IMAP batch, then locally.
+
+    Returns the email files that actually left the inbox.
+    """
+    sources = {}
+    for email_file in email_files:
+        src = os.path.join(MAIN_INBOX, email_file)
+        if os.path.exists(src):
+            sources[email_file] = src
+        else:
+            stylize_console(f"Source not found: {src}", "red")
+    if not sources:
+        return []
+    succeeded = move_messages_to_trash_via_imap(list(sources.values()))
     os.makedirs(os.path.join(TRASH_DIR, "cur"), exist_ok=True)
-    try:
-        shutil.move(src, os.path.join(TRASH_DIR, "cur", email_file))
-        stylize_console(f"Email moved to trash: {email_file}", "red")
-    except Exception as e:
-        stylize_console(f"Error moving to trash {email_file}: {e}", "bold red")
+    moved = []
+    for email_file, src in sources.items():
+        if not succeeded[src]:
+            # The IMAP helper already tried the local trash as a fallback.
+            if os.path.exists(src):
+                stylize_console(
+                    f"IMAP deletion failed for {email_file}; left in inbox.", "red"
+                )
+            else:
+                moved.append(email_file)
+            continue
+        try:
+            shutil.move(src, os.path.join(TRASH_DIR, "cur", email_file))
+            stylize_console(f"Email moved to trash: {email_file}", "red")
+            moved.append(email_file)
+        except Exception as e:
+            stylize_console(f"Error moving to trash {email_file}: {e}", "bold red")
+    return moved
 
 
 def move_email_with_category(email_file, target_dir):
@@ -299,10 +435,8 @@ def move_email_with_category(email_file, target_dir):
 
 
 def list_emails_for_summary(inbox_path=MAIN_INBOX):
-    email_files = [
-        f for f in os.listdir(inbox_path) if os.path.isfile(os.path.join(inbox_path, f))
-    ]
-    if not email_files:
+    emails = scan_maildir(inbox_path)
+    if not emails:
         stylize_console("No new emails found.", "yellow")
         return None
     table = Table(
@@ -313,10 +447,7 @@ def list_emails_for_summary(inbox_path=MAIN_INBOX):
     table.add_column("Subject", style="green")
     table.add_column("Date", style="yellow")
     email_info = []
-    for i, email_file in enumerate(email_files):
-        subject, sender, _, date_str, _ = parse_email(
-            os.path.join(inbox_path, email_file)
-        )
+    for i, (email_file, subject, sender, date_str, _) in enumerate(emails):
         email_info.append([i + 1, sender, subject, email_file, date_str])
         table.add_row(str(i + 1), sender, subject, date_str)
     console.print(table)
@@ -335,16 +466,62 @@ def stylized_search_output(query, matches):
 def search_emails(query, inbox_path=MAIN_INBOX):
     query_lower = query.lower()
     matches = []
-    for f in os.listdir(inbox_path):
-        if os.path.isfile(os.path.join(inbox_path, f)):
-            subject, sender, *_ = parse_email(os.path.join(inbox_path, f))
-            if query_lower in subject.lower() or query_lower in sender.lower():
-                matches.append(f)
+    for email in scan_maildir(inbox_path):
+        if query_lower in email.subject.lower() or query_lower in email.sender.lower():
+            matches.append(email.file)
     stylized_search_output(query, matches)
     return matches if matches else None
 
 
-def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
+def classify_emails(email_files, concurrency=None, mode=None):
+    """
+    Run ``summarize_specific_email`` silently over ``email_files``.
+
+    Up to ``concurrency`` emails (default: the backend's in-flight limit from
+    ``gpt_api.max_concurrency``) are classified at once on a thread pool.
+    Results come back in the same order as ``email_files``; emails that could
+    not be read are dropped.
+    """
+    workers = min(concurrency or max_concurrency(), len(email_files)) or 1
+    if workers == 1:
+        results = [
+            summarize_specific_email(f, silent=True, mode=mode) for f in email_files
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(
+                    lambda f: summarize_specific_email(f, silent=True, mode=mode),
+                    email_files,
+                )
+            )
+    return [r for r in results if r]
+
+
+def bulk_summarize_and_process_silent(
+    num_emails=None,
+    confirm_all=False,
+    concurrency=None,
+    mode=None,
+    dedupe_similarity=None,
+    resume=True,
+):
+    """
+    Classify inbox emails in batches and apply the recommended actions.
+
+    Progress is written to a ``RunJournal``. With ``resume`` an interrupted
+    run on the same inbox is continued: moves that were in flight are
+    replayed and emails already classified are not sent to the model again.
+    """
+    journal = RunJournal.start(MAIN_INBOX) if resume else None
+    if journal is not None and journal.resumed:
+        replayed = journal.replay_pending(move_email_with_category)
+        stylize_console(
+            f"Resuming run {journal.run_id}: {len(journal.classified)} emails "
+            f"already classified, {len(journal.moved)} moved "
+            f"({replayed} interrupted moves replayed).",
+            "bold yellow",
+        )
     stylize_console("Applying filter rules...", "blue")
     apply_filter_rules(MAIN_INBOX)
     emails = [
@@ -354,47 +531,113 @@ def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
         emails = emails[:num_emails]
     if not emails:
         stylize_console("No emails to process.", "yellow")
+        if journal is not None:
+            journal.finish()
         return
     stats = json.load(open(STATS_FILE)) if os.path.exists(STATS_FILE) else {}
-    batches = [emails[i : i + 10] for i in range(0, len(emails), 10)]
-    for batch_idx, batch in enumerate(batches, 1):
-        stylize_console(f"\nBatch {batch_idx}/{len(batches)} processing…", "bold")
+    if USE_DEDUP:
+        similarity = (
+            DEDUP_SIMILARITY if dedupe_similarity is None else dedupe_similarity
+        )
+        clusters = cluster_emails(MAIN_INBOX, emails, similarity)
+        stylize_console(
+            f"Grouped {len(emails)} emails into {len(clusters)} clusters "
+            f"(similarity ≥ {similarity:.2f}).",
+            "blue",
+        )
+    else:
+        clusters = {email_file: [] for email_file in emails}
+    representatives = list(clusters)
+    done = 0
+    batch_idx = 0
+    run_time = 0.0
+    sent = 0
+    cache_before = response_cache.stats()
+    while done < len(representatives):
+        # Sized per window so a batch keeps every concurrency slot busy for
+        # the same number of rounds as the throttle moves.
+        batch = representatives[done : done + throttle.batch_size(concurrency)]
+        done += len(batch)
+        batch_idx += 1
+        stylize_console(
+            f"\nBatch {batch_idx} ({done}/{len(representatives)}) processing…",
+            "bold",
+        )
 
-        model = get_active_model()
+        model = get_active_model() if USE_LOCAL_LLM else None
+        throttle.observe_server(model)
         start_ts = time.time()
+        journaled = {f: journal.result_for(f) for f in batch} if journal else {}
+        fresh = classify_emails(
+            [f for f in batch if not journaled.get(f)],
+            concurrency or throttle.concurrency(),
+            mode,
+        )
+        end_ts = time.time()
+        if journal is not None:
+            for r in fresh:
+                journal.record_classified(r)
+        sent += len(fresh)
+        fresh = {r["email_file"]: r for r in fresh}
         results = [
-            summarize_specific_email(email_file, silent=True) for email_file in batch
+            journaled.get(f) or fresh[f]
+            for f in batch
+            if journaled.get(f) or f in fresh
         ]
-        end_ts = time.time()
         table = Table(title=f"Batch {batch_idx} Recommendations", show_lines=True)
         table.add_column("No.", style="bold")
         table.add_column("From", style="cyan")
         table.add_column("Subject", style="magenta")
         table.add_column("Date", style="green")
         table.add_column("Action", style="yellow")
+        table.add_column("Similar", style="blue")
         for i, r in enumerate(results, 1):
             disp = (
                 r["recommended_action"]
                 if r["recommended_action"] != "REVIEW"
                 else "REVIEW (manual)"
             )
-            table.add_row(str(i), r["sender"], r["subject"], r["clean_date"], disp)
+            similar = clusters.get(r["email_file"], [])
+            table.add_row(
+                str(i),
+                r["sender"],
+                r["subject"],
+                r["clean_date"],
+                disp,
+                f"+{len(similar)}" if similar else "",
+            )
         console.print(table)
         if confirm_all or Confirm.ask("Execute ALL recommended actions?", default=True):
+            trash = []
             for r in results:
-                dest = {
-                    "ARCHIVE": ARCHIVE_DIR,
-                    "DELETE": TRASH_DIR,
-                    "REVIEW": FOLLOWUP_DIR,
-                }.get(r["recommended_action"])
-                if dest:
-                    move_email_with_category(r["email_file"], dest)
+                dest = ACTION_DIRS.get(r["recommended_action"])
+                members = clusters[r["email_file"]]
+                if dest == TRASH_DIR:
+                    # Without DEDUP_DELETE_MEMBERS, look-alikes the model never
+                    # saw stay in the inbox and are classified next run.
+                    trash.append(r["email_file"])
+                    if DEDUP_DELETE_MEMBERS:
+                        trash.extend(members)
+                    moves = []
+                elif dest:
+                    moves = [(f, dest) for f in [r["email_file"], *members]]
                 else:
+                    moves = []
                     stylize_console(
                         f"Unknown action '{r['recommended_action']}' — skipped.", "red"
                     )
+                for email_file, target in moves:
+                    if journal is not None:
+                        journal.move(email_file, target, move_email_with_category)
+                    else:
+                        move_email_with_category(email_file, target)
+            if trash and journal is not None:
+                journal.move_many(trash, TRASH_DIR, move_emails_to_trash)
+            elif trash:
+                move_emails_to_trash(trash)
         duration = end_ts - start_ts
-        count = len(batch)
+        run_time += duration
+        count = len(batch) + sum(len(clusters[f]) for f in batch)
         model = results[0].get("model", "unknown") if results else "unknown"
         stats.setdefault(model, []).append({"duration": duration, "count": count})
         os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
@@ -403,45 +646,63 @@ def bulk_summarize_and_process_silent(num_emails=None, confirm_all=False):
         entries = stats[model]
         avg = sum(e["duration"] for e in entries) / len(entries)
         stylize_console(
-            f"Batch #{batch_idx} took {duration:.1f}s for {count} emails using model {model}",
+            f"Batch #{batch_idx} took {duration:.1f}s for {count} emails using model {model}"
+            f" ({count / duration if duration else 0:.2f} emails/s)",
             "bold cyan",
         )
         stylize_console(
             f"Avg for {model} over {len(entries)} runs: {avg:.1f}s", "bold cyan"
         )
-        if batch_idx < len(batches):
-            stylize_console("Pausing 20–30 seconds before next batch…", "blue")
-            time.sleep(random.uniform(20, 30))
+        throttle.adjust()
+        stylize_console(f"Throttle: {throttle.status()}", "blue")
+        if done < len(representatives):
+            delay = throttle.pause()
+            if delay:
+                stylize_console(f"Backend saturated; paused {delay:.0f}s.", "blue")
+    stylize_console(
+        f"\nProcessed {len(emails)} emails ({sent} sent to the model) "
+        f"in {batch_idx} batches "
+        f"({len(emails) / run_time if run_time else 0:.2f} emails/s while classifying).",
+        "bold green",
+    )
+    cache_after = response_cache.stats()
     stylize_console(
-        f"\nProcessed {len(emails)} emails in {len(batches)} batches.", "bold green"
+        f"LLM cache: {cache_after['hits'] - cache_before['hits']} hits, "
+        f"{cache_after['misses'] - cache_before['misses']} misses "
+        f"({cache_after['coalesced'] - cache_before['coalesced']} coalesced).",
+        "bold cyan",
     )
+    if journal is not None:
+        journal.finish()
 
 
 def apply_filter_rules(inbox_path=MAIN_INBOX):
-    rules = load_filter_rules()
+    rules = get_compiled_rules(actions=FILTER_ACTIONS)
+    if not rules:
+        return
     email_files = [
         f for f in os.listdir(inbox_path) if os.path.isfile(os.path.join(inbox_path, f))
     ]
-    for email_file in email_files:
-        file_path = os.path.join(inbox_path, email_file)
-        subject, sender, body, date_str, _ = parse_email(file_path)
-        email_text = f"From: {sender}\nSubject: {subject}\nDate: {date_str}\n\n{body}"
-        for rule in rules:
-            action = matches_filter_rule(email_text, rule)
-            if action == "DELETE":
-                move_email_with_category(email_file, TRASH_DIR)
-                stylize_console(f"Filtered to DELETE (trash): {email_file}", "red")
-                break
-            elif action == "ARCHIVE":
-                move_email_with_category(email_file, ARCHIVE_DIR)
-                stylize_console(f"Filtered to ARCHIVE: {email_file}", "green")
-                break
-            elif action == "REVIEW":
-                move_email_with_category(email_file, FOLLOWUP_DIR)
-                stylize_console(
-                    f"Filtered to REVIEW (follow-up): {email_file}", "yellow"
-                )
-                break
+    paths = [os.path.join(inbox_path, f) for f in email_files]
+    actions = parallel_map(
+        worker_filter_action,
+        paths,
+        initializer=init_worker,
+        initargs=(FILTER_ACTIONS,),
+    )
+    trash = []
+    for email_file, action in zip(email_files, actions):
+        if action == "DELETE":
+            trash.append(email_file)
+            stylize_console(f"Filtered to DELETE (trash): {email_file}", "red")
+        elif action == "ARCHIVE":
+            move_email_with_category(email_file, ARCHIVE_DIR)
+            stylize_console(f"Filtered to ARCHIVE: {email_file}", "green")
+        elif action == "REVIEW":
+            move_email_with_category(email_file, FOLLOWUP_DIR)
+            stylize_console(f"Filtered to REVIEW (follow-up): {email_file}", "yellow")
+    if trash:
+        move_emails_to_trash(trash)
 
 
 def reply_to_email(email_file=None):
@@ -479,7 +740,7 @@ def reply_to_email(email_file=None):
         f"Compose a brief, polite email reply with a greeting and relevant details.\n\n"
         f"Original Email:\nFrom: {sender}\nSubject: {subject}\nDate: {date_str}\n\n{body}\n"
     )
-    draft = ask_gpt(prompt)
+    draft = ask_gpt(prompt, use_cache=False)
     if draft:
         stylize_console("\nDraft Reply:", "bold underline")
         console.print(draft.get("text", draft))
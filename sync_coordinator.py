@@ -0,0 +1,122 @@
+"""Debounced, coalesced ``mbsync`` runs after local maildir changes.
+
+Moving a message used to run ``mbsync <channel>`` straight away, so applying
+a rule to hundreds of messages started hundreds of full syncs. Callers now
+``request`` a sync instead. The channel is marked dirty, and one ``mbsync``
+runs once ``SYNC_DEBOUNCE_SECONDS`` have passed since the first request in
+the window; requests arriving meanwhile share that run. Any channel still
+dirty is flushed, and running syncs are waited for, when the process exits.
+
+Only one ``mbsync`` per channel runs at a time, across threads and processes,
+thanks to an ``flock`` on ``<SYNC_LOCK_DIR>/mbsync-<channel>.lock``.
+"""
+
+import os
+import atexit
+import shlex
+import logging
+import threading
+import subprocess
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from config import MBSYNC_COMMAND, SYNC_DEBOUNCE_SECONDS, SYNC_LOCK_DIR
+
+
+class SyncCoordinator:
+    """Collects sync requests per channel and runs ``mbsync`` once per window."""
+
+    def __init__(
+        self,
+        command=MBSYNC_COMMAND,
+        window=SYNC_DEBOUNCE_SECONDS,
+        lock_dir=SYNC_LOCK_DIR,
+    ):
+        self.command = shlex.split(command)
+        self.window = window
+        self.lock_dir = lock_dir
+        self.requested = 0
+        self.runs = 0
+        self.failures = 0
+        self._dirty = set()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._channel_locks = {}
+
+    def request(self, channel):
+        """Mark ``channel`` as needing a sync; the sync itself is deferred."""
+        with self._lock:
+            self.requested += 1
+            self._dirty.add(channel)
+            if self.window <= 0:
+                run_now = True
+            else:
+                run_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if run_now:
+            self.flush()
+
+    def flush(self):
+        """Sync every dirty channel now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            channels, self._dirty = self._dirty, set()
+        for channel in sorted(channels):
+            self._sync(channel)
+
+    def _channel_lock(self, channel):
+        with self._lock:
+            return self._channel_locks.setdefault(channel, threading.Lock())
+
+    def _sync(self, channel):
+        with self._channel_lock(channel):
+            lock_file = None
+            if fcntl is not None:
+                os.makedirs(self.lock_dir, exist_ok=True)
+                lock_file = open(
+                    os.path.join(self.lock_dir, f"mbsync-{channel}.lock"), "w"
+                )
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                subprocess.run([*self.command, channel], check=True)
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"mbsync {channel} failed: {e}")
+                print(f"[error] mbsync {channel}: {e}")
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def close(self):
+        """Flush dirty channels and wait for syncs already in progress."""
+        self.flush()
+        with self._lock:
+            locks = list(self._channel_locks.values())
+        for lock in locks:
+            with lock:
+                pass
+
+    def saved(self):
+        """Return how many requested syncs were absorbed by coalescing."""
+        return max(self.requested - self.runs - self.failures, 0)
+
+    def report(self):
+        return (
+            f"[sync] {self.requested} sync requests → {self.runs} mbsync runs "
+            f"({self.saved()} saved"
+            + (f", {self.failures} failed)" if self.failures else ")")
+        )
+
+
+sync_coordinator = SyncCoordinator()
+atexit.register(sync_coordinator.close)
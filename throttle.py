@@ -0,0 +1,214 @@
+"""Adaptive request throttle for bulk classification.
+
+Bulk runs used to sleep a fixed 20–30 seconds between batches whatever the
+backend was doing. ``AdaptiveThrottle`` instead sets the number of concurrent
+model requests with AIMD (additive increase, multiplicative decrease) from
+what ``gpt_api`` reports about each call:
+
+* latency — time to first token for streamed replies, otherwise the whole
+  call — compared against the lowest recent latency (the idle baseline);
+* the error rate, and any rate-limit (HTTP 429) responses;
+* for Ollama, the ``/api/ps`` listing of loaded models: a cold model makes
+  the next window's latency meaningless, and models loaded by someone else
+  mean the GPU is shared, so concurrency is not raised.
+
+The throttle owns the in-flight limit: ``gpt_api`` holds a ``slot`` around
+every backend call, so the limit applies to every caller. It starts at
+``THROTTLE_START_CONCURRENCY`` and can move between
+``THROTTLE_MIN_CONCURRENCY`` and the backend's ``*_MAX_CONCURRENCY`` ceiling.
+After each window (one batch) ``adjust`` raises the limit by one while the
+backend keeps up and halves it when latency exceeds
+``THROTTLE_LATENCY_TOLERANCE`` times the baseline or errors pile up.
+``batch_size`` grows and shrinks with the limit, so every window sends
+``THROTTLE_BATCH_ROUNDS`` requests per slot: enough for a median at low
+concurrency without waiting on one straggler at high concurrency.
+``pause`` only sleeps after an unhealthy window, backing off exponentially up
+to ``THROTTLE_MAX_PAUSE`` seconds, so an idle server gets no delay at all.
+"""
+
+import time
+import logging
+import threading
+import statistics
+from contextlib import contextmanager
+
+import http_session
+from config import (
+    USE_LOCAL_LLM,
+    OLLAMA_BASE_URL,
+    OLLAMA_MAX_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    THROTTLE_MIN_CONCURRENCY,
+    THROTTLE_START_CONCURRENCY,
+    THROTTLE_BATCH_ROUNDS,
+    THROTTLE_LATENCY_TOLERANCE,
+    THROTTLE_ERROR_RATE,
+    THROTTLE_MAX_PAUSE,
+)
+
+# The idle baseline drifts up slowly so a permanently slower server (bigger
+# model, longer prompts) is eventually accepted as normal.
+BASELINE_DRIFT = 0.05
+PAUSE_BASE = 2.0
+PS_TIMEOUT = 2
+
+
+def ollama_running_models(base_url=OLLAMA_BASE_URL):
+    """Return the names of models loaded on the Ollama server, or ``None``."""
+    try:
+        response = http_session.get(
+            f"{base_url}/api/ps", read_timeout=PS_TIMEOUT, retry=False
+        )
+        response.raise_for_status()
+        return [m.get("name") for m in response.json().get("models", [])]
+    except Exception as e:
+        logging.debug(f"Could not read Ollama running models: {e}")
+        return None
+
+
+class AdaptiveThrottle:
+    """AIMD concurrency controller fed by per-request measurements."""
+
+    def __init__(
+        self,
+        max_limit,
+        start=THROTTLE_START_CONCURRENCY,
+        min_limit=THROTTLE_MIN_CONCURRENCY,
+        rounds=THROTTLE_BATCH_ROUNDS,
+        tolerance=THROTTLE_LATENCY_TOLERANCE,
+        error_rate=THROTTLE_ERROR_RATE,
+        max_pause=THROTTLE_MAX_PAUSE,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.tolerance = tolerance
+        self.error_rate = error_rate
+        self.max_pause = max_pause
+        self.rounds = max(1, rounds)
+        self.limit = min(self.max_limit, max(self.min_limit, start))
+        self.baseline = None
+        self.last_latency = None
+        self.last_decision = "start"
+        self._latencies = []
+        self._errors = 0
+        self._rate_limited = 0
+        self._bad_windows = 0
+        self._ignore_latency = False
+        self._hold = False
+        self._active = 0
+        self._lock = threading.Condition()
+
+    def concurrency(self):
+        """Return the number of requests to run at once right now."""
+        return int(self.limit)
+
+    def batch_size(self, concurrency=None):
+        """Return how many requests the next window should send."""
+        return (concurrency or self.concurrency()) * self.rounds
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the ``concurrency()`` in-flight request slots."""
+        with self._lock:
+            self._lock.wait_for(lambda: self._active < self.concurrency())
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._lock.notify()
+
+    def record(self, latency, error=False, rate_limited=False):
+        """Record one backend call that took ``latency`` seconds."""
+        with self._lock:
+            if rate_limited:
+                self._rate_limited += 1
+            if error or rate_limited:
+                self._errors += 1
+            elif latency is not None:
+                self._latencies.append(latency)
+
+    def observe_server(self, model=None):
+        """Check Ollama's loaded models before the next window.
+
+        If ``model`` is not loaded yet, the next window includes load time and
+        its latency is not judged. If other models are loaded, concurrency is
+        held rather than raised.
+        """
+        if not USE_LOCAL_LLM:
+            return
+        running = ollama_running_models()
+        if running is None:
+            return
+        with self._lock:
+            self._ignore_latency = bool(model) and model not in running
+            self._hold = any(name != model for name in running)
+
+    def adjust(self):
+        """Close the current window, update the limit and return the decision."""
+        with self._lock:
+            samples, self._latencies = self._latencies, []
+            errors, self._errors = self._errors, 0
+            rate_limited, self._rate_limited = self._rate_limited, 0
+            ignore_latency, self._ignore_latency = self._ignore_latency, False
+            hold, self._hold = self._hold, False
+            total = len(samples) + errors
+            if not total:
+                return self.last_decision
+
+            latency = statistics.median(samples) if samples else None
+            self.last_latency = latency
+            slow = False
+            if latency is not None and not ignore_latency:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    slow = latency > self.baseline * self.tolerance
+                    self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+
+            if rate_limited or errors / total > self.error_rate or slow:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._bad_windows += 1
+                reason = (
+                    "rate limited"
+                    if rate_limited
+                    else "errors" if errors / total > self.error_rate else "slow"
+                )
+                self.last_decision = f"back off ({reason})"
+            else:
+                self._bad_windows = 0
+                if hold:
+                    self.last_decision = "hold (server shared)"
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.last_decision = "increase"
+                    self._lock.notify_all()
+            return self.last_decision
+
+    def pause_seconds(self):
+        """Return how long to wait before the next window (0 when healthy)."""
+        if not self._bad_windows:
+            return 0.0
+        return min(self.max_pause, PAUSE_BASE * 2 ** (self._bad_windows - 1))
+
+    def pause(self):
+        """Sleep for ``pause_seconds`` and return the delay."""
+        delay = self.pause_seconds()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def status(self):
+        """One-line summary of the controller state for console output."""
+        latency = f"{self.last_latency:.2f}s" if self.last_latency else "n/a"
+        baseline = f"{self.baseline:.2f}s" if self.baseline else "n/a"
+        return (
+            f"concurrency {self.concurrency()}/{self.max_limit}, "
+            f"median latency {latency} (baseline {baseline}), {self.last_decision}"
+        )
+
+
+throttle = AdaptiveThrottle(
+    OLLAMA_MAX_CONCURRENCY if USE_LOCAL_LLM else OPENAI_MAX_CONCURRENCY
+)
@@ -3,15 +3,20 @@ import re
 import logging
 import json
 import subprocess
-import imaplib
+import binascii
+import quopri
 from bs4 import BeautifulSoup
-from email import message_from_file
+from email.parser import BytesHeaderParser
 from email.policy import default
-from config import IMAP_HOST, IMAP_USER, IMAP_PASS
+from email.utils import parsedate_to_datetime
+from config import MAX_BODY_BYTES
+from imap_session import imap_session
 from rich.console import Console
 
 console = Console()
 RULES_FILE = "filter_rules.json"
+# Longest raw line read at once; longer lines are split into several reads.
+LINE_LIMIT = 64 * 1024
 
 
 def format_email_body(body):
@@ -39,39 +44,173 @@ def format_email_body(body):
     return body
 
 
+def _format_date(date_str):
+    """Return ``(formatted_date, date_obj)`` for a raw ``Date`` header."""
+    try:
+        date_obj = parsedate_to_datetime(date_str)
+        return date_obj.strftime("%Y-%m-%d %H:%M:%S"), date_obj
+    except Exception:
+        return date_str, None
+
+
 def parse_email(file_path):
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            msg = message_from_file(f, policy=default)
-            subject = msg.get("Subject", "No Subject")
-            sender = msg.get("From", "Unknown Sender")
-            body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            body += payload.decode("utf-8", errors="ignore")
-            else:
-                payload = msg.get_payload(decode=True)
-                if payload:
-                    body = payload.decode("utf-8", errors="ignore")
-            formatted_body = format_email_body(body)
-            date_str = msg.get("Date", "Unknown Date")
-            from email.utils import parsedate_to_datetime
-
-            try:
-                date_obj = parsedate_to_datetime(date_str)
-                formatted_date = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-            except Exception:
-                formatted_date = date_str
-                date_obj = None
-            return subject, sender, formatted_body, formatted_date, date_obj
+        headers, body = read_email_text(file_path)
+        subject = headers.get("Subject", "No Subject")
+        sender = headers.get("From", "Unknown Sender")
+        formatted_body = format_email_body(body)
+        formatted_date, date_obj = _format_date(headers.get("Date", "Unknown Date"))
+        return subject, sender, formatted_body, formatted_date, date_obj
     except Exception as e:
         logging.error(f"Error parsing email {file_path}: {e}")
         return "Error", "Error", "", "Unknown Date", None
 
 
+def read_header_block(fp):
+    """Read raw header lines from a binary line iterable up to the first blank line."""
+    lines = []
+    for line in fp:
+        if line in (b"\n", b"\r\n"):
+            break
+        lines.append(line)
+    return b"".join(lines)
+
+
+def load_email_headers(file_path):
+    """Return the header-only ``Message`` for ``file_path`` without reading the body."""
+    with open(file_path, "rb") as f:
+        return BytesHeaderParser(policy=default).parsebytes(
+            read_header_block(_iter_lines(f))
+        )
+
+
+def _iter_lines(fp):
+    """Yield raw lines from ``fp``, splitting pathological lines at ``LINE_LIMIT``."""
+    while True:
+        line = fp.readline(LINE_LIMIT)
+        if not line:
+            return
+        yield line
+
+
+def _decode_part(data, part_headers):
+    """Decode a transfer-encoded text part using its declared charset."""
+    cte = part_headers.get("Content-Transfer-Encoding", "7bit").strip().lower()
+    if cte == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        # A truncated part may end mid-quantum; drop the incomplete tail.
+        data = binascii.a2b_base64(data[: len(data) - len(data) % 4])
+    elif cte == "quoted-printable":
+        data = quopri.decodestring(data)
+    charset = part_headers.get_content_charset() or "utf-8"
+    try:
+        return data.decode(charset, errors="ignore")
+    except LookupError:
+        return data.decode("utf-8", errors="ignore")
+
+
+def read_email_text(file_path, max_bytes=None):
+    """
+    Stream ``file_path`` and return ``(headers, body_text)``.
+
+    The message is read line by line as bytes. Only ``text/plain`` parts are
+    buffered (``text/html`` is kept as a fallback when no plain part exists);
+    attachments and other non-text parts are skipped without being stored or
+    decoded. Buffering stops once ``max_bytes`` (``MAX_BODY_BYTES`` by default)
+    of text has been collected, which also ends the read, so large messages
+    never need to be loaded whole.
+    """
+    budget = MAX_BODY_BYTES if max_bytes is None else max_bytes
+    plain, html = [], []
+    with open(file_path, "rb") as f:
+        lines = _iter_lines(f)
+        headers = BytesHeaderParser(policy=default).parsebytes(read_header_block(lines))
+        boundaries = []
+        part = headers
+        buf = []
+        used = 0
+
+        def open_part(part_headers):
+            if part_headers.get_content_maintype() == "multipart":
+                boundary = part_headers.get_param("boundary")
+                if boundary:
+                    boundaries.append(b"--" + str(boundary).encode("ascii", "ignore"))
+                return None
+            content_type = part_headers.get_content_type()
+            if part_headers.get_content_disposition() == "attachment":
+                return None
+            if content_type == "text/plain" or (
+                not boundaries and part_headers.get_content_maintype() == "text"
+            ):
+                return plain
+            if content_type == "text/html":
+                return html
+            return None
+
+        def close_part(target, part_headers):
+            if target is not None and buf:
+                target.append(_decode_part(b"".join(buf), part_headers))
+            buf.clear()
+
+        target = open_part(part)
+        for line in lines:
+            if boundaries and line.startswith(b"--"):
+                stripped = line.rstrip(b" \t\r\n")
+                depth = next(
+                    (
+                        i
+                        for i in range(len(boundaries) - 1, -1, -1)
+                        if stripped in (boundaries[i], boundaries[i] + b"--")
+                    ),
+                    None,
+                )
+                if depth is not None:
+                    close_part(target, part)
+                    closing = stripped == boundaries[depth] + b"--"
+                    del boundaries[depth + 1 :]
+                    if closing:
+                        boundaries.pop()
+                        target = None
+                    else:
+                        part = BytesHeaderParser(policy=default).parsebytes(
+                            read_header_block(lines)
+                        )
+                        target = open_part(part)
+                    continue
+            if target is None:
+                continue
+            if used + len(line) > budget:
+                buf.append(line[: budget - used])
+                break
+            buf.append(line)
+            used += len(line)
+        close_part(target, part)
+
+    body = "".join(plain) if plain else "".join(html)
+    return headers, body
+
+
+def parse_email_headers(file_path):
+    """
+    Header-only counterpart of ``parse_email``.
+
+    Returns ``(subject, sender, date_str, date_obj)`` and never touches the
+    message body, so it is cheap enough for listing and search paths.
+    """
+    try:
+        headers = load_email_headers(file_path)
+        formatted_date, date_obj = _format_date(headers.get("Date", "Unknown Date"))
+        return (
+            headers.get("Subject", "No Subject"),
+            headers.get("From", "Unknown Sender"),
+            formatted_date,
+            date_obj,
+        )
+    except Exception as e:
+        logging.error(f"Error parsing email headers {file_path}: {e}")
+        return "Error", "Error", "Unknown Date", None
+
+
 def send_notification(subject, sender, recommendation):
     try:
         notification_msg = f"{subject} | Action: {recommendation}"
@@ -134,46 +273,57 @@ def matches_filter_rule(email_text, rule):
     return None
 
 
+def move_messages_to_trash_via_imap(file_paths):
+    """
+    Trash ``file_paths`` on the IMAP server in one batch over the shared session.
+
+    Returns ``{file_path: succeeded}``. Messages that could not be trashed via
+    IMAP are moved to the local trash instead.
+    """
+    message_ids = {}
+    for file_path in file_paths:
+        try:
+            msg_id = load_email_headers(file_path).get("Message-ID")
+        except OSError as e:
+            logging.error(f"Cannot read {file_path}: {e}")
+            continue
+        if msg_id:
+            message_ids[file_path] = msg_id.strip()
+        else:
+            logging.warning(f"Missing Message-ID header: {file_path}")
+    moved = set()
+    if message_ids:
+        try:
+            moved = imap_session.trash(message_ids.values())
+        except Exception as e:
+            logging.error(f"IMAP trash failed: {e}")
+    results = {}
+    for file_path in file_paths:
+        msg_id = message_ids.get(file_path)
+        results[file_path] = msg_id in moved
+        if results[file_path]:
+            console.print(f"[green]Message {msg_id} moved to Trash via IMAP.[/green]")
+        else:
+            _move_to_local_trash(file_path)
+    return results
+
+
 def move_message_to_trash_via_imap(file_path):
     """
     Attempts IMAP-based deletion. Falls back to local trash if it fails.
     """
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            msg = message_from_file(f, policy=default)
-            msg_id = msg.get("Message-ID")
-
-        if not msg_id:
-            raise ValueError("Missing Message-ID header")
-
-        assert IMAP_USER and IMAP_PASS, "Missing IMAP credentials"
-
-        M = imaplib.IMAP4_SSL(IMAP_HOST)
-        M.login(IMAP_USER, IMAP_PASS)
-        M.select("INBOX")
-
-        typ, data = M.search(None, "HEADER", "Message-ID", msg_id)
-        if typ != "OK" or not data or not data[0]:
-            raise ValueError("Message not found via IMAP")
-
-        for num in data[0].split():
-            M.copy(num, "[Gmail]/Trash")
-            M.store(num, "+FLAGS", "\\Deleted")
-        M.expunge()
-        M.logout()
-        console.print(f"[green]Message {msg_id} moved to Trash via IMAP.[/green]")
-        return True
-    except Exception as e:
-        # Fallback to local trash move
-        from config import TRASH_DIR
+    return move_messages_to_trash_via_imap([file_path])[file_path]
 
-        try:
-            os.makedirs(os.path.join(TRASH_DIR, "cur"), exist_ok=True)
-            fallback_dest = os.path.join(TRASH_DIR, "cur", os.path.basename(file_path))
-            os.rename(file_path, fallback_dest)
-            console.print(
-                f"[yellow]IMAP failed, moved locally to trash: {file_path}[/yellow]"
-            )
-        except Exception as e2:
-            console.print(f"[red]Failed fallback move: {e2}[/red]")
-        return False
+
+def _move_to_local_trash(file_path):
+    from config import TRASH_DIR
+
+    try:
+        os.makedirs(os.path.join(TRASH_DIR, "cur"), exist_ok=True)
+        fallback_dest = os.path.join(TRASH_DIR, "cur", os.path.basename(file_path))
+        os.rename(file_path, fallback_dest)
+        console.print(
+            f"[yellow]IMAP failed, moved locally to trash: {file_path}[/yellow]"
+        )
+    except Exception as e2:
+        console.print(f"[red]Failed fallback move: {e2}[/red]")